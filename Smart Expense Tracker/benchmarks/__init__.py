@@ -0,0 +1,9 @@
+"""Benchmarks for the Smart Expense Splitter.
+
+Run them from the application directory, for example:
+
+    python -m benchmarks.suite --output baseline.json
+    python -m benchmarks.storage_throughput
+
+Benchmarks that need accounts build them with benchmarks.datagen.
+"""
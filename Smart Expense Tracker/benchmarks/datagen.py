@@ -0,0 +1,71 @@
+"""Deterministic synthetic data for benchmarks.
+
+Rows are generated from a seeded random.Random and written with
+seeding.BulkWriter, so the same arguments always produce the same accounts,
+amounts and splits. Unlike ``flask seed-data`` every account has exactly the
+requested shape, which keeps timings comparable between runs.
+
+    from benchmarks.datagen import generate
+    dataset = generate(users=2, groups=3, members=8, bills=20, products=10, seed=7)
+"""
+import random
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+from models import User, Group, Member, Bill, Product, ProductMember
+from seeding import BulkWriter, free_logins
+
+# Same choices as BillForm
+CATEGORIES = ['Food & Dining', 'Transportation', 'Entertainment', 'Shopping', 'Travel',
+              'Utilities', 'Healthcare', 'Education', 'Business', 'Other']
+
+# Every generated user can log in with this password
+PASSWORD = 'benchmark'
+
+Dataset = namedtuple('Dataset', ['user_ids', 'group_ids', 'bill_ids', 'counts'])
+
+
+def generate(users=1, groups=2, members=6, bills=10, products=8, max_participants=4,
+             active_members=None, seed=1, start=date(2025, 1, 1), days=365):
+    """Insert ``users`` accounts, each with ``groups`` groups of ``members`` members,
+    ``bills`` bills per group and ``products`` products per bill.
+
+    Each product is paid by one of the group's first ``active_members`` members
+    (default: all of them) and split between 1 and ``max_participants`` of
+    them. Returns a Dataset with the created ids and per-table row counts.
+    """
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    password_hash = generate_password_hash(PASSWORD)
+    writer = BulkWriter()
+    add = writer.add
+    user_rows, group_rows, bill_rows = [], [], []
+
+    for username, email in free_logins(f'bench{seed}-', users):
+        user = add(User, username=username, email=email, password_hash=password_hash, created_at=now)
+        user_rows.append(user)
+        for g in range(groups):
+            group = add(Group, name=f'Group {g + 1}', description='Synthetic benchmark group',
+                        user_id=user, created_at=now)
+            group_rows.append(group)
+            group_members = [add(Member, name=f'Member {m + 1}', email=f'member{m + 1}@example.com',
+                                 mobile_number=f'+1555{m:07d}', group_id=group, created_at=now)
+                             for m in range(members)]
+            active = group_members[:active_members or members]
+            for b in range(bills):
+                bill_date = start + timedelta(days=rng.randrange(days))
+                bill = add(Bill, title=f'Bill {b + 1}', category=rng.choice(CATEGORIES), date=bill_date,
+                           group_id=group, created_at=now)
+                bill_rows.append(bill)
+                for p in range(products):
+                    product = add(Product, name=f'Item {p + 1}', price=round(rng.uniform(1, 200), 2),
+                                  bill_id=bill, payer_id=rng.choice(active), created_at=now)
+                    split = rng.sample(active, rng.randint(1, min(max_participants, len(active))))
+                    for member in split:
+                        add(ProductMember, product_id=product, member_id=member)
+
+    writer.flush()
+    return Dataset([row.id for row in user_rows], [row.id for row in group_rows],
+                   [row.id for row in bill_rows], writer.counts)
@@ -0,0 +1,369 @@
+"""Replay user workflows with concurrent virtual users and report latency per endpoint.
+
+Each virtual user registers its own account, then repeats a workflow until
+the time is up: log in, create a group, add members, create a bill, add
+products, view the bill, the dashboard and the analytics pages, export the
+bill as CSV and wait for the export job, then log out. Between requests it
+pauses for a random think time averaging ``--think-time`` seconds. Forms are
+submitted with the CSRF token of the page they came from, as a browser would.
+
+By default every ``--profile`` runs against the app served in-process by a
+threaded Werkzeug server on a fresh SQLite database, so storage profiles can
+be compared on the same workload. ``--url`` points the virtual users at a
+running deployment instead, to size its workers.
+
+    python -m benchmarks.load_test --users 20 --seconds 60
+    python -m benchmarks.load_test --profile tuned --profile legacy --think-time 0
+    python -m benchmarks.load_test --url http://127.0.0.1:8000 --users 50
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import date
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+
+from werkzeug.serving import make_server
+
+from models import db
+from smart_expense_splitter import create_app
+from storage import STORAGE_PROFILES
+
+CSRF_RE = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+ID_RE = {
+    'group': re.compile(r'^/group/(\d+)$'),
+    'bill': re.compile(r'^/bill/(\d+)$'),
+}
+
+# Seconds to wait for an export job before counting it as failed
+EXPORT_TIMEOUT = 30
+
+
+def percentile(ordered, p):
+    """Return the p-th percentile of an ascending list by the nearest-rank method"""
+    if not ordered:
+        return 0.0
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+class WorkflowError(Exception):
+    """A response that the rest of the workflow cannot continue from"""
+
+
+class Stats:
+    """Latencies and errors per endpoint, shared by all virtual users"""
+
+    def __init__(self):
+        self.timings = defaultdict(list)  # endpoint -> [seconds]
+        self.errors = defaultdict(int)  # endpoint -> failed requests
+        self.workflows = 0
+        self.failed_workflows = 0
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, elapsed, ok):
+        with self._lock:
+            self.timings[endpoint].append(elapsed)
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def finish_workflow(self, ok):
+        with self._lock:
+            if ok:
+                self.workflows += 1
+            else:
+                self.failed_workflows += 1
+
+    def summary(self, seconds):
+        """Return {'endpoints': {endpoint: row}, ...totals} for a run of ``seconds``"""
+        endpoints = {}
+        for endpoint, timings in sorted(self.timings.items()):
+            ordered = sorted(timings)
+            endpoints[endpoint] = {
+                'requests': len(ordered),
+                'errors': self.errors[endpoint],
+                'error_rate': self.errors[endpoint] / len(ordered),
+                'per_sec': len(ordered) / seconds,
+                'p50_ms': percentile(ordered, 50) * 1000,
+                'p95_ms': percentile(ordered, 95) * 1000,
+                'p99_ms': percentile(ordered, 99) * 1000,
+            }
+        requests = sum(row['requests'] for row in endpoints.values())
+        errors = sum(row['errors'] for row in endpoints.values())
+        return {
+            'seconds': seconds,
+            'requests': requests,
+            'requests_per_sec': requests / seconds,
+            'error_rate': errors / requests if requests else 0.0,
+            'workflows': self.workflows,
+            'failed_workflows': self.failed_workflows,
+            'endpoints': endpoints,
+        }
+
+
+class VirtualUser:
+    """One simulated browser: a cookie jar, a CSRF token and a think-time clock"""
+
+    def __init__(self, number, base_url, stats, think_time, seed):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.stats = stats
+        self.think_time = think_time
+        self.random = random.Random(seed * 1000 + number)
+        self.cookies = {}
+        self.username = f'load{seed}-{number}-{time.time_ns()}'
+        self.password = 'password123'
+
+    def request(self, endpoint, method, path, form=None, headers=None, expect=(200,)):
+        """Send one request, record it under ``endpoint`` and return (status, headers, body)"""
+        headers = dict(headers or {})
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+        body = None
+        if form is not None:
+            body = urlencode(form, doseq=True)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        connection = self.connection_class(self.host, self.port, timeout=60)
+        start = time.perf_counter()
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            content = response.read()
+        except (OSError, http.client.HTTPException) as exc:
+            self.stats.record(endpoint, time.perf_counter() - start, False)
+            raise WorkflowError(f'{method} {path}: {exc}') from exc
+        finally:
+            connection.close()
+        elapsed = time.perf_counter() - start
+        for header in response.headers.get_all('Set-Cookie') or []:
+            for name, morsel in SimpleCookie(header).items():
+                self.cookies[name] = morsel.value
+        ok = response.status in expect
+        self.stats.record(endpoint, elapsed, ok)
+        if not ok:
+            raise WorkflowError(f'{method} {path}: {response.status}')
+        return response.status, response.headers, content.decode('utf-8', 'replace')
+
+    def think(self):
+        if self.think_time > 0:
+            time.sleep(self.random.uniform(0, 2 * self.think_time))
+
+    def form_page(self, endpoint, path):
+        """GET a form page and return its CSRF token"""
+        _, _, page = self.request(endpoint, 'GET', path)
+        match = CSRF_RE.search(page)
+        return match.group(1) if match else ''
+
+    def submit(self, endpoint, path, token, fields):
+        """POST a form that redirects on success; return the redirect target's path"""
+        _, headers, _ = self.request(endpoint, 'POST', path, dict(fields, csrf_token=token), expect=(302, 303))
+        return urlsplit(headers.get('Location', '')).path
+
+    def register(self):
+        token = self.form_page('GET /register', '/register')
+        self.submit('POST /register', '/register', token, {
+            'username': self.username, 'email': f'{self.username}@example.com',
+            'password': self.password, 'password2': self.password,
+        })
+
+    def workflow(self, members, products):
+        token = self.form_page('GET /login', '/login')
+        self.submit('POST /login', '/login', token, {'username': self.username, 'password': self.password})
+        self.think()
+
+        token = self.form_page('GET /group/new', '/group/new')
+        location = self.submit('POST /group/new', '/group/new', token, {'name': 'Trip', 'description': 'Load test'})
+        match = ID_RE['group'].match(location)
+        if not match:
+            raise WorkflowError(f'unexpected redirect after creating a group: {location}')
+        group_id = match.group(1)
+        self.request('GET /group/<id>', 'GET', location)
+        self.think()
+
+        for m in range(members):
+            path = f'/group/{group_id}/member/new'
+            token = self.form_page('GET /group/<id>/member/new', path)
+            self.submit('POST /group/<id>/member/new', path, token, {
+                'name': f'Member {m + 1}', 'email': f'member{m + 1}@example.com',
+                'mobile_number': f'+1 555 {self.random.randrange(10 ** 7):07d}',
+            })
+            self.think()
+
+        path = f'/group/{group_id}/bill/new'
+        token = self.form_page('GET /group/<id>/bill/new', path)
+        location = self.submit('POST /group/<id>/bill/new', path, token, {
+            'title': 'Dinner', 'description': '', 'date': date.today().isoformat(),
+            'category': 'Food & Dining',
+        })
+        match = ID_RE['bill'].match(location)
+        if not match:
+            raise WorkflowError(f'unexpected redirect after creating a bill: {location}')
+        bill_id = match.group(1)
+        self.think()
+
+        member_ids = None
+        for p in range(products):
+            path = f'/bill/{bill_id}/product/new'
+            _, _, page = self.request('GET /bill/<id>/product/new', 'GET', path)
+            if member_ids is None:
+                member_ids = sorted(set(re.findall(r'<option[^>]*value="(\d+)"', page)), key=int)
+                if not member_ids:
+                    raise WorkflowError(f'no members offered on {path}')
+            match = CSRF_RE.search(page)
+            self.submit('POST /bill/<id>/product/new', path, match.group(1) if match else '', {
+                'name': f'Item {p + 1}', 'price': f'{self.random.uniform(2, 80):.2f}',
+                'payer': self.random.choice(member_ids),
+                'members_involved': self.random.sample(member_ids, self.random.randint(1, len(member_ids))),
+            })
+            self.think()
+
+        _, _, page = self.request('GET /bill/<id>', 'GET', f'/bill/{bill_id}')
+        match = CSRF_RE.search(page)
+        export_token = match.group(1) if match else ''
+        self.think()
+        self.request('GET /dashboard', 'GET', '/dashboard')
+        self.think()
+        self.request('GET /analytics', 'GET', '/analytics')
+        self.think()
+        self.request('GET /analytics/group/<id>', 'GET', f'/analytics/group/{group_id}')
+        self.think()
+        self.export(bill_id, export_token)
+        self.think()
+
+        self.request('GET /logout', 'GET', '/logout', expect=(302, 303))
+
+    def export(self, bill_id, token):
+        """Start a bill export as an API client would, poll the job and download the file"""
+        json_headers = {'Accept': 'application/json'}
+        _, _, body = self.request('POST /bill/<id>/export/csv', 'POST', f'/bill/{bill_id}/export/csv',
+                                  form={'csrf_token': token}, headers=json_headers, expect=(202,))
+        job_id = json.loads(body)['id']
+        deadline = time.monotonic() + EXPORT_TIMEOUT
+        while True:
+            _, _, body = self.request('GET /api/jobs/<id>', 'GET', f'/api/jobs/{job_id}', headers=json_headers)
+            job = json.loads(body)
+            if job['status'] == 'done':
+                break
+            if job['status'] in ('failed', 'cancelled') or time.monotonic() > deadline:
+                self.stats.record('export job', 0.0, False)
+                raise WorkflowError(f"export job {job_id} ended as {job['status']}")
+            time.sleep(0.05)
+        self.request('GET /jobs/<id>/download', 'GET', job['download_url'])
+
+    def run(self, stop, members, products):
+        try:
+            self.register()
+        except WorkflowError as exc:
+            logging.getLogger(__name__).warning('Virtual user could not register: %s', exc)
+            return
+        while not stop.is_set():
+            try:
+                self.workflow(members, products)
+                self.stats.finish_workflow(True)
+            except WorkflowError as exc:
+                logging.getLogger(__name__).debug('Workflow failed: %s', exc)
+                self.stats.finish_workflow(False)
+                # Start the next workflow logged out, whatever state this one left behind
+                self.cookies.clear()
+
+
+def run_load(base_url, args):
+    """Run the virtual users against base_url for the configured time and return the summary"""
+    stats = Stats()
+    stop = threading.Event()
+    users = [VirtualUser(i, base_url, stats, args.think_time, args.seed) for i in range(args.users)]
+    threads = []
+    for i, user in enumerate(users):
+        thread = threading.Thread(target=user.run, args=(stop, args.members, args.products), daemon=True)
+        threads.append(thread)
+        thread.start()
+        if args.ramp_up and i < len(users) - 1:
+            time.sleep(args.ramp_up / len(users))
+    start = time.perf_counter()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    # Workflows still running at the deadline finish, so measure to the last response
+    return stats.summary(time.perf_counter() - start)
+
+
+def run_in_process(profile, tmpdir, args):
+    """Serve a fresh app on a threaded Werkzeug server and load it"""
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tmpdir, f'{profile}.db'),
+        'STORAGE_PROFILE': profile,
+        'JOB_RESULTS_PATH': os.path.join(tmpdir, f'{profile}-jobs'),
+    })
+    with app.app_context():
+        db.create_all()
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        return run_load(f'http://127.0.0.1:{server.server_port}', args)
+    finally:
+        server.shutdown()
+        thread.join()
+
+
+def print_summary(name, summary):
+    print(f"\n{name}: {summary['requests']} requests in {summary['seconds']:.1f} s, "
+          f"{summary['requests_per_sec']:.1f} req/s, {summary['workflows']} workflows "
+          f"({summary['failed_workflows']} failed), {summary['error_rate']:.1%} errors")
+    print(f"{'endpoint':<34}{'requests':>9}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for endpoint, row in summary['endpoints'].items():
+        print(f"{endpoint:<34}{row['requests']:>9}{row['per_sec']:>8.1f}{row['p50_ms']:>9.1f}"
+              f"{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}{row['error_rate']:>8.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10, help='concurrent virtual users')
+    parser.add_argument('--seconds', type=float, default=30.0, help='how long to keep starting workflows')
+    parser.add_argument('--ramp-up', type=float, default=0.0, help='seconds over which the users are started')
+    parser.add_argument('--think-time', type=float, default=0.5, help='mean pause between requests in seconds')
+    parser.add_argument('--members', type=int, default=4, help='members added per workflow')
+    parser.add_argument('--products', type=int, default=5, help='products added per workflow')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--profile', action='append', choices=STORAGE_PROFILES,
+                        help='storage profile to serve in-process (repeatable, default tuned)')
+    parser.add_argument('--url', help='load a running server instead of serving the app in-process')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+    if args.url and args.profile:
+        parser.error('--profile only applies to the in-process server')
+
+    # Per-request SQL reports and the server's access log would drown out the results
+    logging.getLogger('sqlperf').setLevel(logging.ERROR)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    results = {}
+    if args.url:
+        results[args.url] = run_load(args.url.rstrip('/'), args)
+    else:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for profile in args.profile or ['tuned']:
+                results[f'sqlite/{profile}'] = run_in_process(profile, tmpdir, args)
+
+    for name, summary in results.items():
+        print_summary(name, summary)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'\nResults written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+"""Check peak memory of routes and model methods against per-scenario budgets.
+
+A large synthetic account is generated into a temporary database (see
+benchmarks.datagen). Each scenario runs once to warm up, then once under
+tracemalloc, which records its peak allocation. For scenarios over budget,
+or all of them with ``--sites``, it runs once more with deep tracebacks and
+lists the biggest allocation sites still live when the work is done, grouped
+by the innermost application line; for routes this is measured before the
+request's session is closed. The command exits with status 1 when a
+scenario's peak is over its budget.
+
+    python -m benchmarks.memory_budget
+    python -m benchmarks.memory_budget --scenario analytics --sites --top 10
+    python -m benchmarks.memory_budget --write-budgets budgets.json --headroom 1.5
+    python -m benchmarks.memory_budget --budgets budgets.json
+
+The budgets in BUDGETS_KIB are for the default dataset; a different dataset
+needs its own budget file.
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import sys
+import tempfile
+import tracemalloc
+from collections import Counter
+
+from sqlalchemy.orm import selectinload
+
+from benchmarks.datagen import generate
+from benchmarks.suite import git_revision, largest_bill_id
+from models import db, User, Group, Bill, Product, GroupRollup
+from smart_expense_splitter import create_app
+
+# Peak KiB allowed per scenario on the default dataset, about 1.5x what it measured when set
+BUDGETS_KIB = {
+    'user_total_expenses': 11200,
+    'user_expenses_by_category': 11200,
+    'user_monthly_expenses': 11200,
+    'member_summary': 400,
+    'settlement_summary': 400,
+    'group_summary_dict': 8700,
+    'group_compute_rollup': 8700,
+    'dashboard': 800,
+    'group_detail': 4300,
+    'bill_detail': 1300,
+    'bills': 650,
+    'analytics': 550,
+    'analytics_cold_rollups': 43200,
+    'group_analytics': 600,
+    'templates': 550,
+    'export_bill_csv': 400,
+    'export_group_csv': 9000,
+    'export_analytics_csv': 11500,
+}
+
+# Frames kept per allocation when looking for allocation sites; deep enough to get from
+# SQLAlchemy internals back to app code, but it makes tracing many times slower
+TRACE_FRAMES = 40
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
+
+
+def _is_app_file(filename):
+    return filename.startswith(APP_ROOT) and 'site-packages' not in filename \
+        and not filename.startswith(os.path.join(APP_ROOT, 'benchmarks'))
+
+
+def top_sites(snapshot, limit):
+    """Return [(site, KiB)] for the biggest live allocations, grouped by innermost app line"""
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    ])
+    sizes = Counter()
+    for stat in snapshot.statistics('traceback'):
+        # Frames run from the oldest to the most recent call
+        site = None
+        for frame in reversed(stat.traceback):
+            if _is_app_file(frame.filename):
+                site = f'{frame.filename[len(APP_ROOT):]}:{frame.lineno}'
+                break
+        if site is None:
+            frame = stat.traceback[-1]
+            site = '/'.join(frame.filename.split(os.sep)[-2:]) + f':{frame.lineno}'
+        sizes[site] += stat.size
+    return [(site, size / 1024) for site, size in sizes.most_common(limit)]
+
+
+class Tracer:
+    """Runs one scenario under tracemalloc and keeps a snapshot of what it still holds"""
+
+    def __init__(self):
+        self.snapshot = None
+
+    def capture(self):
+        """Take the snapshot; routes call this from an after_request hook"""
+        if tracemalloc.is_tracing() and self.snapshot is None:
+            self.snapshot = tracemalloc.take_snapshot()
+
+    def measure(self, run, frames=1):
+        """Return (peak KiB, snapshot) of one call of run, tracing ``frames`` frames per allocation"""
+        gc.collect()
+        self.snapshot = None
+        tracemalloc.start(frames)
+        try:
+            result = run()
+            self.capture()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        del result
+        return peak / 1024, self.snapshot
+
+
+def build_scenarios(app, client, dataset):
+    """Return (name, setup, run) triples; setup is untimed and may be None"""
+    with app.app_context():
+        bill_id = largest_bill_id(dataset.bill_ids)
+    group_id = dataset.group_ids[0]
+    user_id = dataset.user_ids[0]
+
+    def model(func):
+        # Start from an empty session so loading the rows counts against the scenario
+        def run():
+            with app.app_context():
+                db.session.expunge_all()
+                return func()
+        return run
+
+    def load_bill():
+        return Bill.query.options(selectinload(Bill.products).selectinload(Product.members_involved)).get(bill_id)
+
+    def get(url, **kwargs):
+        def run():
+            response = client.get(url, **kwargs)
+            assert response.status_code in (200, 202), (url, response.status_code)
+            return response
+        return run
+
+    def post(url, **kwargs):
+        def run():
+            response = client.post(url, **kwargs)
+            assert response.status_code in (200, 202), (url, response.status_code)
+            return response
+        return run
+
+    def clear_rollups():
+        with app.app_context():
+            GroupRollup.query.delete()
+            db.session.commit()
+
+    json_headers = {'Accept': 'application/json'}
+    return [
+        ('user_total_expenses', None, model(lambda: db.session.get(User, user_id).get_total_expenses())),
+        ('user_expenses_by_category', None, model(lambda: db.session.get(User, user_id).get_expenses_by_category())),
+        ('user_monthly_expenses', None, model(lambda: db.session.get(User, user_id).get_monthly_expenses(2025))),
+        ('member_summary', None, model(lambda: load_bill().get_member_summary())),
+        ('settlement_summary', None, model(lambda: load_bill().get_settlement_summary())),
+        ('group_summary_dict', None, model(lambda: db.session.get(Group, group_id).to_summary_dict())),
+        ('group_compute_rollup', None, model(lambda: db.session.get(Group, group_id).compute_rollup())),
+        ('dashboard', None, get('/dashboard')),
+        ('group_detail', None, get(f'/group/{group_id}')),
+        ('bill_detail', None, get(f'/bill/{bill_id}')),
+        ('bills', None, get('/bills')),
+        ('analytics', None, get('/analytics')),
+        ('analytics_cold_rollups', clear_rollups, get('/analytics')),
+        ('group_analytics', None, get(f'/analytics/group/{group_id}')),
+        ('templates', None, get('/templates')),
+        ('export_bill_csv', None, post(f'/bill/{bill_id}/export/csv', headers=json_headers)),
+        ('export_group_csv', None, post(f'/analytics/group/{group_id}/export/csv', headers=json_headers)),
+        ('export_analytics_csv', None, post('/analytics/export/csv', headers=json_headers)),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--groups', type=int, default=5, help='groups in the benchmark account')
+    parser.add_argument('--members', type=int, default=8, help='members per group')
+    parser.add_argument('--bills', type=int, default=60, help='bills per group')
+    parser.add_argument('--products', type=int, default=20, help='products per bill')
+    parser.add_argument('--max-participants', type=int, default=4, help='most members sharing one product')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--scenario', action='append', help='only run the named scenario (repeatable)')
+    parser.add_argument('--sites', action='store_true', help='list allocation sites for every scenario, not just those over budget')
+    parser.add_argument('--top', type=int, default=5, help='allocation sites to list per scenario')
+    parser.add_argument('--budgets', help='JSON file of {scenario: KiB} budgets to use instead of the defaults')
+    parser.add_argument('--write-budgets', help='write the measured peaks times --headroom to this JSON file')
+    parser.add_argument('--headroom', type=float, default=1.5, help='multiplier applied by --write-budgets')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    budgets = BUDGETS_KIB
+    if args.budgets:
+        with open(args.budgets) as f:
+            budgets = json.load(f)
+
+    # Per-request SQL reports would drown out the results table
+    logging.getLogger('sqlperf').setLevel(logging.ERROR)
+    tracer = Tracer()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        app = create_app({
+            'TESTING': True,
+            'WTF_CSRF_ENABLED': False,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tmpdir, 'bench.db'),
+            # Measure the work itself, not the caches in front of it
+            'FRAGMENT_CACHE_BACKEND': 'none',
+            'JOB_WORKERS': 0,
+            'JOB_RECOVER': False,
+            'JOB_RESULTS_PATH': os.path.join(tmpdir, 'jobs'),
+        })
+
+        @app.after_request
+        def snapshot_before_teardown(response):
+            # The request's session, and every row it loaded, is released on teardown
+            tracer.capture()
+            return response
+
+        with app.app_context():
+            db.create_all()
+            dataset = generate(users=1, groups=args.groups, members=args.members, bills=args.bills,
+                               products=args.products, max_participants=args.max_participants, seed=args.seed)
+        print(', '.join(f'{count} {table}' for table, count in dataset.counts.items()))
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(dataset.user_ids[0])
+            session['_fresh'] = True
+
+        scenarios = build_scenarios(app, client, dataset)
+        if args.scenario:
+            unknown = set(args.scenario) - {name for name, _, _ in scenarios}
+            if unknown:
+                parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+            scenarios = [s for s in scenarios if s[0] in args.scenario]
+
+        results = {'revision': git_revision(), 'dataset': {'groups': args.groups, 'members': args.members,
+                                                           'bills': args.bills, 'products': args.products,
+                                                           'seed': args.seed}, 'scenarios': {}}
+        over = []
+        print(f"\n{'scenario':<28}{'peak KiB':>12}{'budget KiB':>12}")
+        for name, setup, run in scenarios:
+            if setup:
+                setup()
+            run()
+            if setup:
+                setup()
+            peak, _ = tracer.measure(run)
+            budget = budgets.get(name)
+            is_over = budget is not None and peak > budget
+            if is_over:
+                over.append(name)
+            sites = []
+            if is_over or args.sites:
+                if setup:
+                    setup()
+                _, snapshot = tracer.measure(run, TRACE_FRAMES)
+                sites = top_sites(snapshot, args.top)
+            results['scenarios'][name] = {'peak_kib': round(peak, 1), 'budget_kib': budget,
+                                          'top_sites': [[site, round(kib, 1)] for site, kib in sites]}
+            print(f"{name:<28}{peak:>12.1f}{budget if budget is not None else '-':>12}"
+                  f"{'  over budget' if is_over else ''}")
+            for site, kib in sites:
+                print(f"    {kib:>10.1f} KiB  {site}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'\nResults written to {args.output}')
+
+    if args.write_budgets:
+        with open(args.write_budgets, 'w') as f:
+            json.dump({name: round(result['peak_kib'] * args.headroom)
+                       for name, result in results['scenarios'].items()}, f, indent=2)
+        print(f'Budgets written to {args.write_budgets}')
+
+    if over:
+        print(f"\nOver the memory budget: {', '.join(over)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+"""Check SQL statement counts and wall time per route against budgets.
+
+Two synthetic accounts are generated into a temporary database (see
+benchmarks.datagen): a small one and one several times larger in groups,
+bills, products and templates. Each route is requested as both users, once
+to warm up and then ``--runs`` times measured. A route fails when, for the
+large account, it runs more statements than its budget or its median time is
+over its budget, or when it runs more statements for the large account than
+for the small one: a page whose statement count grows with the data has a
+lazy-load loop somewhere. Statements repeated within one request are listed
+for every failing route, with the code and template line that ran them, and
+the command exits with status 1. tests/test_query_budget.py runs the same
+check under pytest.
+
+    python -m benchmarks.query_budget
+    python -m benchmarks.query_budget --route bill_detail --route bills
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from sqlalchemy import event
+
+from benchmarks.datagen import generate
+from benchmarks.suite import largest_bill_id
+from instrumentation import sql_monitor
+from models import db, Bill, Member, Product, BillTemplate, TemplateProduct
+from smart_expense_splitter import create_app
+
+# Route -> (most SQL statements, most median ms) for the large account. Statement
+# budgets are what each route runs today, so a single extra query fails; time
+# budgets leave room for slower machines
+BUDGETS = {
+    'dashboard': (3, 250),
+    'settings': (0, 250),
+    'currency_settings': (28, 250),
+    'group_detail': (3, 250),
+    'edit_group': (1, 250),
+    'edit_member': (2, 250),
+    'bill_detail': (7, 250),
+    'edit_bill': (2, 250),
+    'edit_product': (6, 250),
+    'bills': (13, 250),
+    'bills_sort_amount': (13, 250),
+    'analytics': (5, 400),
+    'group_analytics': (11, 250),
+    'api_monthly_data': (4, 1000),
+    'api_category_data': (4, 1000),
+    'api_bill_summary': (7, 250),
+    'api_group_summary': (6, 1500),
+    'api_group_bills': (2, 250),
+    'templates': (2, 250),
+    'template_detail': (3, 250),
+    'edit_template': (1, 250),
+    'export_bill_csv': (18, 250),
+    'export_group_csv': (15, 1500),
+    'export_analytics_csv': (11, 1500),
+}
+
+# Dataset shapes of the two accounts; everything that grows is at least three times larger
+SMALL = {'groups': 2, 'members': 6, 'bills': 6, 'products': 4, 'templates': 2}
+LARGE = {'groups': 6, 'members': 6, 'bills': 24, 'products': 16, 'templates': 6}
+
+
+def add_templates(user_id, count, products):
+    """Give a user ``count`` bill templates of ``products`` products each; return their ids"""
+    templates = []
+    for t in range(count):
+        template = BillTemplate(name=f'Template {t + 1}', title=f'Bill {t + 1}', category='Other', user_id=user_id)
+        template.template_products = [TemplateProduct(name=f'Item {p + 1}', price=10.0 + p) for p in range(products)]
+        templates.append(template)
+    db.session.add_all(templates)
+    db.session.commit()
+    ids = [template.id for template in templates]
+    # A fixture that silently writes nothing would make the template routes pass trivially
+    made = TemplateProduct.query.filter(TemplateProduct.bill_template_id.in_(ids)).count()
+    assert made == count * products, f'expected {count * products} template products, found {made}'
+    return ids
+
+
+def build_account(shape, seed):
+    """Generate one account and return the ids its routes are requested with"""
+    dataset = generate(users=1, groups=shape['groups'], members=shape['members'], bills=shape['bills'],
+                       products=shape['products'], seed=seed)
+    bill_id = largest_bill_id(dataset.bill_ids)
+    bill = db.session.get(Bill, bill_id)
+    return {
+        'user_id': dataset.user_ids[0],
+        'group_id': dataset.group_ids[0],
+        'bill_id': bill_id,
+        'product_id': db.session.query(Product.id).filter_by(bill_id=bill_id).order_by(Product.id).limit(1).scalar(),
+        'member_id': db.session.query(Member.id).filter_by(group_id=bill.group_id).order_by(Member.id).limit(1).scalar(),
+        'template_id': add_templates(dataset.user_ids[0], shape['templates'], shape['products'])[0],
+        'year': bill.date.year,
+    }
+
+
+def route_urls(ids):
+    """Return {route: url} for one account"""
+    return {
+        'dashboard': '/dashboard',
+        'settings': '/settings',
+        'currency_settings': '/settings/currency',
+        'group_detail': f"/group/{ids['group_id']}",
+        'edit_group': f"/group/{ids['group_id']}/edit",
+        'edit_member': f"/member/{ids['member_id']}/edit",
+        'bill_detail': f"/bill/{ids['bill_id']}",
+        'edit_bill': f"/bill/{ids['bill_id']}/edit",
+        'edit_product': f"/product/{ids['product_id']}/edit",
+        'bills': '/bills',
+        'bills_sort_amount': '/bills?sort=amount_desc',
+        'analytics': '/analytics',
+        'group_analytics': f"/analytics/group/{ids['group_id']}",
+        'api_monthly_data': f"/api/analytics/monthly-data/{ids['year']}",
+        'api_category_data': '/api/analytics/category-data',
+        'api_bill_summary': f"/api/bill/{ids['bill_id']}/summary",
+        'api_group_summary': f"/api/group/{ids['group_id']}/summary",
+        'api_group_bills': f"/api/group/{ids['group_id']}/bills",
+        'templates': '/templates',
+        'template_detail': f"/template/{ids['template_id']}",
+        'edit_template': f"/template/{ids['template_id']}/edit",
+        'export_bill_csv': f"/bill/{ids['bill_id']}/export/csv",
+        'export_group_csv': f"/analytics/group/{ids['group_id']}/export/csv",
+        'export_analytics_csv': '/analytics/export/csv',
+    }
+
+
+class StatementCounter:
+    """Counts every statement the engine runs, including those of export jobs run inline"""
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def measure(app, client, counter, url, runs):
+    """Request url once to warm up, then ``runs`` times; return (statements, median ms, last report)"""
+    # Exports are started with a POST, answered with 202 and their job run inline
+    export = '/export/' in url
+    headers = {'Accept': 'application/json'} if export else {}
+    counts = []
+    timings = []
+    for i in range(runs + 1):
+        before = counter.count
+        start = time.perf_counter()
+        response = client.open(url, method='POST' if export else 'GET', headers=headers)
+        elapsed = (time.perf_counter() - start) * 1000
+        assert response.status_code in (200, 202), (url, response.status_code)
+        if i:
+            counts.append(counter.count - before)
+            timings.append(elapsed)
+    with app.app_context():
+        report = sql_monitor().recent()[0]
+    return max(counts), statistics.median(timings), report
+
+
+def run(routes, runs=3):
+    """Request ``routes`` as the small and the large account in a temporary database.
+
+    Returns {(route, 'small' | 'large'): (statements, median ms, last SQL report)}.
+    """
+    # Per-request SQL reports would drown out the results
+    logging.getLogger('sqlperf').setLevel(logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        app = create_app({
+            'TESTING': True,
+            'WTF_CSRF_ENABLED': False,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tmpdir, 'bench.db'),
+            # Count the statements behind each page, not the caches in front of it
+            'FRAGMENT_CACHE_BACKEND': 'none',
+            'JOB_WORKERS': 0,
+            'JOB_RECOVER': False,
+            'JOB_RESULTS_PATH': os.path.join(tmpdir, 'jobs'),
+            # Keeps each request's SQL report, to explain failures
+            'DEBUG_PERF_PAGE': True,
+            'DEBUG_PERF_HISTORY': 1,
+            'SQL_REPEAT_THRESHOLD': 3,
+        })
+        with app.app_context():
+            db.create_all()
+            accounts = {'small': build_account(SMALL, seed=1), 'large': build_account(LARGE, seed=2)}
+            counter = StatementCounter(db.engine)
+
+        results = {}
+        for size, ids in accounts.items():
+            client = app.test_client()
+            with client.session_transaction() as session:
+                session['_user_id'] = str(ids['user_id'])
+                session['_fresh'] = True
+            urls = route_urls(ids)
+            for route in routes:
+                results[route, size] = measure(app, client, counter, urls[route], runs)
+    return results
+
+
+def problems(route, results):
+    """Return what is wrong with a route's results, if anything"""
+    max_queries, max_ms = BUDGETS[route]
+    small, _, _ = results[route, 'small']
+    large, elapsed, _ = results[route, 'large']
+    found = []
+    if large > max_queries:
+        found.append('over statement budget')
+    if large > small:
+        found.append('grows with data')
+    if elapsed > max_ms:
+        found.append('over time budget')
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--route', action='append', help='only check the named route (repeatable)')
+    args = parser.parse_args()
+
+    routes = list(BUDGETS)
+    if args.route:
+        unknown = set(args.route) - set(routes)
+        if unknown:
+            parser.error(f"unknown route(s): {', '.join(sorted(unknown))}")
+        routes = [route for route in routes if route in args.route]
+
+    results = run(routes, args.runs)
+
+    failures = []
+    print(f"{'route':<22}{'small':>7}{'large':>7}{'budget':>8}{'large ms':>10}{'budget':>8}")
+    for route in routes:
+        max_queries, max_ms = BUDGETS[route]
+        small, _, _ = results[route, 'small']
+        large, elapsed, report = results[route, 'large']
+        found = problems(route, results)
+        print(f"{route:<22}{small:>7}{large:>7}{max_queries:>8}{elapsed:>10.1f}{max_ms:>8}"
+              f"{'  ' + ', '.join(found) if found else ''}")
+        if found:
+            failures.append(route)
+            for item in report['repeated']:
+                site = ' / '.join(filter(None, [item['code'], item['template']]))
+                print(f"    {item['count']}x at {site}: {item['statement'].splitlines()[0][:100]}")
+
+    if failures:
+        print(f"\nOver budget: {', '.join(failures)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Measure application startup cost.
+
+Each sample runs in a fresh interpreter so module caches do not hide import
+cost. Three phases are timed: importing ``smart_expense_splitter``, building
+the app with ``create_app()``, and serving the first request.
+
+    python -m benchmarks.startup_time --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Executed in the child interpreter; prints one JSON line of timings in milliseconds
+SAMPLE_SCRIPT = """
+import json, time
+t0 = time.perf_counter()
+import smart_expense_splitter
+t1 = time.perf_counter()
+app = smart_expense_splitter.create_app({'TESTING': True})
+t2 = time.perf_counter()
+response = app.test_client().get('/')
+t3 = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print(json.dumps({'import': (t1 - t0) * 1000, 'create_app': (t2 - t1) * 1000,
+                  'first_request': (t3 - t2) * 1000, 'total': (t3 - t0) * 1000}))
+"""
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def sample(env):
+    """Run one cold start in a subprocess and return its timings"""
+    output = subprocess.check_output([sys.executable, '-c', SAMPLE_SCRIPT], cwd=APP_DIR, env=env)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        env = dict(os.environ, DATABASE_URL='sqlite:///' + os.path.join(tmpdir, 'startup.db'))
+        # The app refuses requests until the database has its schema
+        subprocess.check_call([sys.executable, '-m', 'flask', '--app', 'smart_expense_splitter', 'upgrade-db'],
+                              cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL)
+        samples = [sample(env) for _ in range(args.runs)]
+
+    print(f"{'phase':<16}{'median ms':>12}{'min ms':>12}{'max ms':>12}")
+    for phase in ('import', 'create_app', 'first_request', 'total'):
+        values = [s[phase] for s in samples]
+        print(f"{phase:<16}{statistics.median(values):>12.1f}{min(values):>12.1f}{max(values):>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""Compare concurrent read/write throughput across storage profiles.
+
+Writer threads insert products (one transaction each) while reader threads
+compute per-bill totals, which is the mix the bill and analytics pages create
+under load. Each SQLite profile gets a fresh database file.
+
+    python -m benchmarks.storage_throughput --writers 4 --readers 8 --seconds 5
+    python -m benchmarks.storage_throughput --database-url postgresql://localhost/expenses
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.exc import OperationalError
+
+from config import Config
+from models import db, User, Group, Member, Bill, Product
+from storage import STORAGE_PROFILES, apply_sqlite_pragmas, engine_options, is_sqlite
+
+
+def base_config():
+    """Return the default configuration as a plain dict"""
+    return {key: getattr(Config, key) for key in dir(Config) if key.isupper()}
+
+
+def seed(engine, bills=10):
+    """Create the rows every worker writes against and return the bill ids"""
+    db.metadata.create_all(engine)
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        user_id = conn.execute(insert(User.__table__).values(
+            username=f'bench-{time.time_ns()}', email=f'bench-{time.time_ns()}@example.com',
+            password_hash='x', created_at=now)).inserted_primary_key[0]
+        group_id = conn.execute(insert(Group.__table__).values(
+            name='Benchmark', user_id=user_id, created_at=now)).inserted_primary_key[0]
+        member_id = conn.execute(insert(Member.__table__).values(
+            name='Payer', mobile_number='0000000000', group_id=group_id, created_at=now)).inserted_primary_key[0]
+        bill_ids = [
+            conn.execute(insert(Bill.__table__).values(
+                title=f'Bill {i}', group_id=group_id, date=now.date(), created_at=now)).inserted_primary_key[0]
+            for i in range(bills)
+        ]
+    return member_id, bill_ids
+
+
+def run_profile(uri, config, writers, readers, seconds):
+    """Run the mixed workload against one database and return the counters"""
+    engine = create_engine(uri, **engine_options(config))
+    apply_sqlite_pragmas(engine, config)
+    member_id, bill_ids = seed(engine)
+
+    counts = {'writes': 0, 'reads': 0, 'write_errors': 0, 'read_errors': 0}
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def writer(worker):
+        done = errors = 0
+        while not stop.is_set():
+            try:
+                with engine.begin() as conn:
+                    conn.execute(insert(Product.__table__).values(
+                        name=f'Item {worker}-{done}', price=9.99,
+                        bill_id=bill_ids[done % len(bill_ids)], payer_id=member_id,
+                        created_at=datetime.utcnow()))
+                done += 1
+            except OperationalError:
+                errors += 1
+        with lock:
+            counts['writes'] += done
+            counts['write_errors'] += errors
+
+    def reader(worker):
+        done = errors = 0
+        query = select(Product.bill_id, func.sum(Product.price)).group_by(Product.bill_id)
+        while not stop.is_set():
+            try:
+                with engine.connect() as conn:
+                    conn.execute(query).all()
+                done += 1
+            except OperationalError:
+                errors += 1
+        with lock:
+            counts['reads'] += done
+            counts['read_errors'] += errors
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    threads += [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+
+    counts['writes_per_sec'] = counts['writes'] / seconds
+    counts['reads_per_sec'] = counts['reads'] / seconds
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--database-url', help='also benchmark a server database (its tables are created if missing)')
+    args = parser.parse_args()
+
+    runs = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for profile in STORAGE_PROFILES:
+            uri = 'sqlite:///' + os.path.join(tmpdir, f'{profile}.db')
+            config = dict(base_config(), SQLALCHEMY_DATABASE_URI=uri, STORAGE_PROFILE=profile)
+            runs.append((f'sqlite/{profile}', run_profile(uri, config, args.writers, args.readers, args.seconds)))
+
+    if args.database_url:
+        if is_sqlite(args.database_url):
+            parser.error('--database-url is meant for server databases; SQLite profiles are always run')
+        config = dict(base_config(), SQLALCHEMY_DATABASE_URI=args.database_url)
+        runs.append(('server', run_profile(args.database_url, config, args.writers, args.readers, args.seconds)))
+
+    print(f"{'profile':<16}{'writes/s':>12}{'reads/s':>12}{'write errs':>12}{'read errs':>12}")
+    for name, counts in runs:
+        print(f"{name:<16}{counts['writes_per_sec']:>12.1f}{counts['reads_per_sec']:>12.1f}"
+              f"{counts['write_errors']:>12}{counts['read_errors']:>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+"""Run timed scenarios over a synthetic dataset and compare them with a baseline.
+
+A dataset is generated into a temporary database (see benchmarks.datagen),
+then each scenario runs once to warm up and ``--runs`` times measured. The
+fragment cache is disabled and export jobs run inline so every run does the
+full work. Results are written as JSON; pass an earlier file as
+``--baseline`` to print the change in median time per scenario.
+
+    python -m benchmarks.suite --output baseline.json
+    python -m benchmarks.suite --baseline baseline.json --fail-over 10
+    python -m benchmarks.suite --scenario member_summary --scenario analytics
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import sqlalchemy
+from sqlalchemy import func
+from sqlalchemy.orm import selectinload
+
+from benchmarks.datagen import generate
+from models import db, Bill, Product, GroupRollup
+from smart_expense_splitter import create_app
+
+
+def largest_bill_id(bill_ids):
+    """Return the generated bill with the most products"""
+    return db.session.query(Product.bill_id).filter(Product.bill_id.in_(bill_ids)) \
+        .group_by(Product.bill_id).order_by(func.count(Product.id).desc(), Product.bill_id).limit(1).scalar()
+
+
+def load_bill(bill_id):
+    """Load a bill the way a page does, from an empty session"""
+    db.session.expunge_all()
+    return Bill.query.options(selectinload(Bill.products).selectinload(Product.members_involved)).get(bill_id)
+
+
+def build_scenarios(app, client, dataset):
+    """Return (name, setup, run) triples; setup is untimed and may be None"""
+    with app.app_context():
+        bill_id = largest_bill_id(dataset.bill_ids)
+    group_id = dataset.group_ids[0]
+
+    def in_app(func):
+        def run():
+            with app.app_context():
+                func()
+        return run
+
+    def get(url, **kwargs):
+        def run():
+            response = client.get(url, **kwargs)
+            assert response.status_code in (200, 202), (url, response.status_code)
+        return run
+
+    def post(url, **kwargs):
+        def run():
+            response = client.post(url, **kwargs)
+            assert response.status_code in (200, 202), (url, response.status_code)
+        return run
+
+    def clear_rollups():
+        with app.app_context():
+            GroupRollup.query.delete()
+            db.session.commit()
+
+    json_headers = {'Accept': 'application/json'}
+    return [
+        ('member_summary', None, in_app(lambda: load_bill(bill_id).get_member_summary())),
+        ('settlement_summary', None, in_app(lambda: load_bill(bill_id).get_settlement_summary())),
+        ('bill_page', None, get(f'/bill/{bill_id}')),
+        ('analytics', None, get('/analytics')),
+        ('analytics_cold_rollups', clear_rollups, get('/analytics')),
+        ('bills_sort_date', None, get('/bills?sort=date_desc')),
+        ('bills_sort_amount', None, get('/bills?sort=amount_desc')),
+        ('bills_sort_title', None, get('/bills?sort=title_asc')),
+        ('export_bill_csv', None, post(f'/bill/{bill_id}/export/csv', headers=json_headers)),
+        ('export_group_csv', None, post(f'/analytics/group/{group_id}/export/csv', headers=json_headers)),
+        ('export_analytics_csv', None, post('/analytics/export/csv', headers=json_headers)),
+    ]
+
+
+def time_scenario(setup, run, runs):
+    """Warm up once, then return the timings of ``runs`` measured calls in ms"""
+    if setup:
+        setup()
+    run()
+    timings = []
+    for _ in range(runs):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def summarize(timings):
+    ordered = sorted(timings)
+    return {
+        'runs': len(ordered),
+        'min_ms': round(ordered[0], 3),
+        'median_ms': round(statistics.median(ordered), 3),
+        'mean_ms': round(statistics.fmean(ordered), 3),
+        'p95_ms': round(ordered[int(0.95 * (len(ordered) - 1))], 3),
+        'max_ms': round(ordered[-1], 3),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, fail_over):
+    """Print the change in median per scenario; return the names that regressed past fail_over percent"""
+    regressions = []
+    print(f"\n{'scenario':<26}{'baseline ms':>14}{'current ms':>14}{'change':>10}")
+    for name, current in results['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if before is None:
+            print(f"{name:<26}{'-':>14}{current['median_ms']:>14.2f}{'new':>10}")
+            continue
+        change = (current['median_ms'] - before['median_ms']) / before['median_ms'] * 100 if before['median_ms'] else 0.0
+        flag = ''
+        if fail_over is not None and change > fail_over:
+            regressions.append(name)
+            flag = '  !'
+        print(f"{name:<26}{before['median_ms']:>14.2f}{current['median_ms']:>14.2f}{change:>+9.1f}%{flag}")
+    if baseline.get('dataset') != results['dataset']:
+        print('\nNote: the baseline was recorded with a different dataset')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--groups', type=int, default=5, help='groups in the benchmark account')
+    parser.add_argument('--members', type=int, default=8, help='members per group')
+    parser.add_argument('--bills', type=int, default=40, help='bills per group')
+    parser.add_argument('--products', type=int, default=25, help='products per bill')
+    parser.add_argument('--max-participants', type=int, default=4, help='most members sharing one product')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--scenario', action='append', help='only run the named scenario (repeatable)')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--fail-over', type=float,
+                        help='exit with status 1 if a median is this many percent slower than the baseline')
+    args = parser.parse_args()
+
+    dataset_params = {'users': 1, 'groups': args.groups, 'members': args.members, 'bills': args.bills,
+                      'products': args.products, 'max_participants': args.max_participants, 'seed': args.seed}
+
+    # Per-request SQL reports would drown out the results table; the hooks still run
+    logging.getLogger('sqlperf').setLevel(logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        app = create_app({
+            'TESTING': True,
+            'WTF_CSRF_ENABLED': False,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tmpdir, 'bench.db'),
+            # Measure the work itself, not the caches in front of it
+            'FRAGMENT_CACHE_BACKEND': 'none',
+            'JOB_WORKERS': 0,
+            'JOB_RECOVER': False,
+            'JOB_RESULTS_PATH': os.path.join(tmpdir, 'jobs'),
+        })
+        with app.app_context():
+            db.create_all()
+            dataset = generate(**dataset_params)
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(dataset.user_ids[0])
+            session['_fresh'] = True
+
+        scenarios = build_scenarios(app, client, dataset)
+        if args.scenario:
+            unknown = set(args.scenario) - {name for name, _, _ in scenarios}
+            if unknown:
+                parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+            scenarios = [s for s in scenarios if s[0] in args.scenario]
+
+        results = {
+            'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'sqlalchemy': sqlalchemy.__version__,
+            'dataset': dict(dataset_params, rows=dataset.counts),
+            'scenarios': {},
+        }
+        print(f"{'scenario':<26}{'median ms':>12}{'p95 ms':>12}{'min ms':>12}")
+        for name, setup, run in scenarios:
+            stats = summarize(time_scenario(setup, run, args.runs))
+            results['scenarios'][name] = stats
+            print(f"{name:<26}{stats['median_ms']:>12.2f}{stats['p95_ms']:>12.2f}{stats['min_ms']:>12.2f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'\nResults written to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.fail_over)
+        if regressions:
+            print(f"\nSlower than the baseline by more than {args.fail_over}%: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Compare the bill summary JSON API against the rendered bill page.
+
+A bill with ``--members`` members and ``--products`` products is created in a
+temporary database, then each endpoint is requested ``--runs`` times with the
+fragment cache and conditional GETs out of the way. Payload size and latency
+are reported per endpoint.
+
+    python -m benchmarks.summary_api --members 20 --products 500 --runs 20
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks.datagen import generate
+from models import db
+from smart_expense_splitter import create_app
+
+
+def measure(client, url, runs):
+    """Request a URL repeatedly and return (bytes, median ms, p95 ms)"""
+    timings = []
+    size = 0
+    for _ in range(runs):
+        start = time.perf_counter()
+        response = client.get(url)
+        timings.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, (url, response.status_code)
+        size = len(response.data)
+    timings.sort()
+    return size, statistics.median(timings), timings[int(0.95 * (len(timings) - 1))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--members', type=int, default=20)
+    parser.add_argument('--products', type=int, default=500)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        app = create_app({
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tmpdir, 'bench.db'),
+            # Measure rendering, not the caches in front of it
+            'FRAGMENT_CACHE_BACKEND': 'none',
+            'JOB_RECOVER': False,
+        })
+        with app.app_context():
+            db.create_all()
+            # Any member may take part in any product, as in a small group of friends
+            dataset = generate(users=1, groups=1, members=args.members, bills=1, products=args.products,
+                               max_participants=args.members)
+            user_id, bill_id = dataset.user_ids[0], dataset.bill_ids[0]
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+
+        urls = [
+            ('html page', f'/bill/{bill_id}'),
+            ('json full', f'/api/bill/{bill_id}/summary'),
+            ('json no breakdown', f'/api/bill/{bill_id}/summary?fields=members,balances,transfers'),
+            ('json balances', f'/api/bill/{bill_id}/summary?fields=balances,transfers'),
+        ]
+        print(f"{'endpoint':<20}{'bytes':>12}{'median ms':>12}{'p95 ms':>12}")
+        for name, url in urls:
+            size, median, p95 = measure(client, url, args.runs)
+            print(f"{name:<20}{size:>12}{median:>12.1f}{p95:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Measure peak memory of Bill.get_member_summary with tracemalloc.
+
+Builds a bill in a large group where each product involves only a few
+members, which is where dense per-member results waste the most. Rows are
+loaded before tracing starts so only the summary's own allocations count.
+
+    python -m benchmarks.summary_memory --members 500 --products 2000
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from sqlalchemy.orm import selectinload
+
+from benchmarks.datagen import generate
+from models import db, Group, Bill, Product
+from smart_expense_splitter import create_app
+
+
+def peak_kib(func):
+    """Run func under tracemalloc and return (peak KiB, elapsed ms)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = (time.perf_counter() - start) * 1000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return peak / 1024, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--members', type=int, default=500)
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--max-participants', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tmpdir, 'bench.db')})
+        with app.app_context():
+            db.create_all()
+            # Only a tenth of the group takes part in the bill
+            bill_id = generate(users=1, groups=1, members=args.members, bills=1, products=args.products,
+                               max_participants=args.max_participants,
+                               active_members=max(1, args.members // 10)).bill_ids[0]
+            db.session.expunge_all()
+
+            bill = Bill.query.options(
+                selectinload(Bill.group).selectinload(Group.members),
+                selectinload(Bill.products).selectinload(Product.members_involved),
+                selectinload(Bill.products).selectinload(Product.payer),
+            ).get(bill_id)
+
+            scenarios = [
+                ('dense', lambda: bill.get_member_summary()),
+                ('sparse', lambda: bill.get_member_summary(sparse=True)),
+                ('settlement', lambda: bill.get_settlement_summary()),
+            ]
+
+            print(f"{'scenario':<14}{'peak KiB':>12}{'ms':>10}")
+            for name, func in scenarios:
+                func()  # warm up lazy loads outside the measurement
+                peak, elapsed = peak_kib(func)
+                print(f"{name:<14}{peak:>12.1f}{elapsed:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
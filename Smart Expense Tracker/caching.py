@@ -0,0 +1,438 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, has_app_context, make_response, request, session
+from markupsafe import Markup
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from models import db, User
+
+
+def make_etag(*parts):
+    """Build a compact ETag value from the parts that identify a representation"""
+    # Keyed on the signed-in user (read from the session, without loading them)
+    # so that one user's copy is never revalidated for another on a shared browser
+    parts = parts + (session.get('_user_id', ''),)
+    raw = '|'.join(str(part) for part in parts)
+    return hashlib.blake2b(raw.encode(), digest_size=12).hexdigest()
+
+
+def not_modified(etag, last_modified=None):
+    """Return a 304 response if the client's cached copy is still current, otherwise None.
+
+    Call this before doing any expensive work so a revalidation costs only the
+    lookups needed to build the ETag.
+    """
+    # Pending flash messages are rendered into the page, so never answer 304 over them
+    if request.method != 'GET' or session.get('_flashes'):
+        return None
+
+    if request.if_none_match:
+        matched = request.if_none_match.contains(etag)
+    elif request.if_modified_since and last_modified is not None:
+        matched = last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)
+    else:
+        matched = False
+
+    if not matched:
+        return None
+    response = make_response('', 304)
+    return with_validators(response, etag, last_modified)
+
+
+def with_validators(response, etag, last_modified=None):
+    """Attach ETag/Last-Modified headers and require revalidation on every use"""
+    response = make_response(response)
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # The representation depends on who is signed in, which the session cookie carries
+    response.vary.add('Cookie')
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+class MemoryFragmentCache:
+    """Bounded in-process LRU cache for rendered template fragments"""
+
+    backend = 'memory'
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (value, bill_id, group_id, size)
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, bill_id=None, group_id=None):
+        size = len(key) + len(value.encode('utf-8'))
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[3]
+            self._entries[key] = (value, bill_id, group_id, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted[3]
+
+    def invalidate(self, bill_id=None, group_id=None):
+        """Drop every fragment rendered for a bill or for any bill of a group"""
+        with self._lock:
+            stale = [key for key, (_, entry_bill, entry_group, _) in self._entries.items()
+                     if (bill_id is not None and entry_bill == bill_id)
+                     or (group_id is not None and entry_group == group_id)]
+            for key in stale:
+                self._bytes -= self._entries.pop(key)[3]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': self.backend,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
+
+
+class SQLiteFragmentCache:
+    """Fragment cache stored in an SQLite file so several worker processes can share it.
+
+    Hits are read-only: the access times that least recently used rows are
+    trimmed by are collected in memory and written in one transaction every
+    ``touch_batch`` hits, or just before this process trims.
+    """
+
+    backend = 'sqlite'
+
+    def __init__(self, path, max_entries=10000, touch_batch=100):
+        self.path = path
+        self.max_entries = max_entries
+        self.touch_batch = touch_batch
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sets = 0
+        self._touched = {}  # key -> time of its latest hit, not yet written
+        self.hits = 0
+        self.misses = 0
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''CREATE TABLE IF NOT EXISTS fragments (
+                            key TEXT PRIMARY KEY,
+                            value TEXT NOT NULL,
+                            bill_id INTEGER,
+                            group_id INTEGER,
+                            size INTEGER NOT NULL,
+                            accessed_at REAL NOT NULL)''')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_fragments_bill ON fragments (bill_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_fragments_group ON fragments (group_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_fragments_accessed ON fragments (accessed_at)')
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key):
+        conn = self._connection()
+        row = conn.execute('SELECT value FROM fragments WHERE key = ?', (key,)).fetchone()
+        self._count(row is not None)
+        if row is None:
+            return None
+        with self._lock:
+            self._touched[key] = time.time()
+            touched = self._take_touched() if len(self._touched) >= self.touch_batch else None
+        if touched:
+            self._write_touched(conn, touched)
+        return row[0]
+
+    def _take_touched(self):
+        # Called with self._lock held
+        touched, self._touched = self._touched, {}
+        return touched
+
+    def _write_touched(self, conn, touched):
+        conn.execute('BEGIN')
+        try:
+            conn.executemany('UPDATE fragments SET accessed_at = ? WHERE key = ?',
+                             [(accessed_at, key) for key, accessed_at in touched.items()])
+            conn.execute('COMMIT')
+        except sqlite3.Error:
+            conn.execute('ROLLBACK')
+            raise
+
+    def set(self, key, value, bill_id=None, group_id=None):
+        conn = self._connection()
+        size = len(key) + len(value.encode('utf-8'))
+        conn.execute('INSERT OR REPLACE INTO fragments (key, value, bill_id, group_id, size, accessed_at) '
+                     'VALUES (?, ?, ?, ?, ?, ?)', (key, value, bill_id, group_id, size, time.time()))
+        with self._lock:
+            self._sets += 1
+            prune = self._sets % 100 == 0
+            touched = self._take_touched() if prune else None
+        if prune:
+            if touched:
+                self._write_touched(conn, touched)
+            # Trim least recently used rows in batches rather than on every write
+            conn.execute('DELETE FROM fragments WHERE key IN (SELECT key FROM fragments '
+                         'ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    def invalidate(self, bill_id=None, group_id=None):
+        """Drop every fragment rendered for a bill or for any bill of a group"""
+        conn = self._connection()
+        if bill_id is not None:
+            conn.execute('DELETE FROM fragments WHERE bill_id = ?', (bill_id,))
+        if group_id is not None:
+            conn.execute('DELETE FROM fragments WHERE group_id = ?', (group_id,))
+
+    def clear(self):
+        self._connection().execute('DELETE FROM fragments')
+
+    def stats(self):
+        entries, size = self._connection().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM fragments').fetchone()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': self.backend,
+                'entries': entries,
+                'max_entries': self.max_entries,
+                'bytes': size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
+
+
+class NullFragmentCache:
+    """Fragment cache that never stores anything"""
+
+    backend = 'none'
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, bill_id=None, group_id=None):
+        pass
+
+    def invalidate(self, bill_id=None, group_id=None):
+        pass
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        return {'backend': self.backend, 'entries': 0, 'bytes': 0, 'hits': 0, 'misses': 0, 'hit_ratio': 0.0}
+
+
+def init_fragment_cache(app):
+    """Create the configured fragment cache backend and expose it to templates"""
+    backend = app.config.get('FRAGMENT_CACHE_BACKEND', 'memory')
+    if backend == 'memory':
+        cache = MemoryFragmentCache(app.config.get('FRAGMENT_CACHE_MAX_ENTRIES', 1024))
+    elif backend == 'sqlite':
+        path = app.config.get('FRAGMENT_CACHE_PATH') or os.path.join(app.instance_path, 'fragment_cache.db')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        cache = SQLiteFragmentCache(path, app.config.get('FRAGMENT_CACHE_MAX_ENTRIES', 1024))
+    elif backend == 'none':
+        cache = NullFragmentCache()
+    else:
+        raise ValueError(f"Unknown FRAGMENT_CACHE_BACKEND '{backend}', expected memory, sqlite or none")
+
+    app.extensions['fragment_cache'] = cache
+    app.add_template_global(cached_fragment)
+    return cache
+
+
+def fragment_cache():
+    """Return the current app's fragment cache"""
+    return current_app.extensions['fragment_cache']
+
+
+def _detached_copy(instance):
+    """Copy a loaded row into a detached instance that can be merged into any session"""
+    if instance is None:
+        return None
+    mapper = inspect(instance).mapper
+    copy = mapper.class_(**{attr.key: getattr(instance, attr.key) for attr in mapper.column_attrs})
+    make_transient_to_detached(copy)
+    return copy
+
+
+class UserCache:
+    """TTL-bounded in-process LRU of users for the Flask-Login user loader.
+
+    Entries are detached copies of the user's columns (and, with ``preload``,
+    of their default currency), merged into the request's session without a
+    query on a hit. Relationships are still loaded lazily. An entry is dropped
+    when a transaction that changed the user's row or currencies commits;
+    writes to their groups leave it alone, since data_version is refreshed
+    where it is read. Other processes keep serving their copy for at most
+    ``ttl`` seconds.
+    """
+
+    def __init__(self, max_entries=1024, ttl=30, preload=True):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.preload = preload
+        self._entries = OrderedDict()  # user_id -> (expires_at, user, currency)
+        self._lock = threading.Lock()
+        # Bumped by every invalidation, so a load that raced one is not stored
+        self._generation = 0
+
+    def load(self, user_id):
+        """Return the user attached to the current session, or None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+            else:
+                entry = None
+            generation = self._generation
+
+        if entry is not None:
+            _, cached_user, cached_currency = entry
+            user = db.session.merge(cached_user, load=False)
+            if self.preload:
+                currency = db.session.merge(cached_currency, load=False) if cached_currency is not None else None
+                user.set_preloaded(currency)
+            return user
+
+        if self.preload:
+            loaded = User.load_with_preloads(user_id)
+            if loaded is None:
+                return None
+            user, currency = loaded
+        else:
+            user = db.session.get(User, user_id)
+            if user is None:
+                return None
+            currency = None
+        self._store(user_id, (now + self.ttl, _detached_copy(user), _detached_copy(currency)), generation)
+        return user
+
+    def _store(self, user_id, entry, generation):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[user_id] = entry
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_ids):
+        with self._lock:
+            self._generation += 1
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+class NullUserCache:
+    """User loader that queries the user on every request"""
+
+    def load(self, user_id):
+        return db.session.get(User, user_id)
+
+    def invalidate(self, user_ids):
+        pass
+
+    def clear(self):
+        pass
+
+
+def _note_changed_users(session, flush_context, instances):
+    # Users whose own columns are about to be written through the ORM
+    for instance in session.dirty:
+        if isinstance(instance, User) and session.is_modified(instance, include_collections=False):
+            session.info.setdefault('changed_users', set()).add(instance.id)
+
+
+def _drop_changed_users(session):
+    # Users whose rows a committed transaction changed (see models.mark_user_changed)
+    changed = session.info.pop('changed_users', None)
+    if changed and has_app_context():
+        current_app.extensions['user_cache'].invalidate(changed)
+
+
+def init_user_cache(app):
+    """Create the user loader cache, or a pass-through loader when USER_CACHE_ENABLED is off"""
+    if app.config.get('USER_CACHE_ENABLED', True):
+        cache = UserCache(app.config.get('USER_CACHE_MAX_ENTRIES', 1024), app.config.get('USER_CACHE_TTL', 30),
+                          app.config.get('USER_CACHE_PRELOAD', True))
+    else:
+        cache = NullUserCache()
+    app.extensions['user_cache'] = cache
+    if not event.contains(Session, 'after_commit', _drop_changed_users):
+        event.listen(Session, 'before_flush', _note_changed_users)
+        event.listen(Session, 'after_commit', _drop_changed_users)
+    return cache
+
+
+def user_cache():
+    """Return the current app's user loader cache"""
+    return current_app.extensions['user_cache']
+
+
+def cached_fragment(*key_parts, bill_id=None, group_id=None, caller=None):
+    """Jinja call block that renders its body once per key.
+
+    Usage in a template::
+
+        {% call cached_fragment('bill-settlement', bill.id, bill.version, currency_code,
+                                bill_id=bill.id, group_id=bill.group_id) %}
+            ...expensive markup...
+        {% endcall %}
+    """
+    cache = fragment_cache()
+    key = ':'.join(str(part) for part in key_parts)
+    html = cache.get(key)
+    # Read directly so that apps without metrics never import the metrics module
+    registry = current_app.extensions.get('metrics')
+    if registry is not None and cache.backend != 'none':
+        registry.record_cache_lookup(html is not None, cache.backend)
+    if html is None:
+        html = str(caller())
+        cache.set(key, html, bill_id=bill_id, group_id=group_id)
+    return Markup(html)
@@ -1,8 +1,10 @@
-from smart_expense_splitter import app, db
-from models import User
+from smart_expense_splitter import create_app
+from models import db, User
+
+app = create_app()
 
 with app.app_context():
     users = User.query.all()
     print(f'Found {len(users)} users')
     for user in users:
-        print(f'Username: {user.username}, Email: {user.email}')
\ No newline at end of file
+        print(f'Username: {user.username}, Email: {user.email}')
@@ -0,0 +1,255 @@
+import json
+import os
+import time
+from bisect import bisect_left, bisect_right
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+
+from models import db, User, Group, Bill, Product, Activity, ROLLUP_VERSION
+from storage import pending_upgrades, upgrade_schema
+
+# App used by a recompute worker process, built once by _init_worker()
+_worker_app = None
+
+
+def _init_worker(config):
+    """Give each worker process its own app, and with it its own engine and connections"""
+    global _worker_app
+    from smart_expense_splitter import create_app
+    _worker_app = create_app(config)
+
+
+def recompute_users(user_ids, chunk_size):
+    """Recompute the rollups of every group owned by the given users, committing every chunk_size groups.
+
+    Must run inside an app context; returns counts for the progress report.
+    """
+    group_ids = [group_id for (group_id,) in db.session.query(Group.id)
+                 .filter(Group.user_id.in_(user_ids)).order_by(Group.id)]
+    bills = 0
+    for i in range(0, len(group_ids), chunk_size):
+        chunk = group_ids[i:i + chunk_size]
+        try:
+            chunk_bills = _refresh_rollups(chunk)
+            db.session.commit()
+        except IntegrityError:
+            # A request stored one of the new rollups first; reload the chunk and update it instead
+            db.session.rollback()
+            db.session.expunge_all()
+            chunk_bills = _refresh_rollups(chunk)
+            db.session.commit()
+        bills += chunk_bills
+        # Release the chunk's rows before loading the next one
+        db.session.expunge_all()
+    return {'users': len(user_ids), 'groups': len(group_ids), 'bills': bills}
+
+
+def _refresh_rollups(group_ids):
+    """Recompute the groups' rollups in the session, without committing; return their bill count"""
+    groups = Group.query.filter(Group.id.in_(group_ids)).options(
+        selectinload(Group.rollup),
+        selectinload(Group.members),
+        selectinload(Group.bills).selectinload(Bill.products).selectinload(Product.members_involved),
+    ).all()
+    # New rollups are inserted together on commit, where a conflict can be retried
+    with db.session.no_autoflush:
+        for group in groups:
+            group.refresh_rollup()
+    return sum(len(group.bills) for group in groups)
+
+
+def _recompute_shard(user_ids, chunk_size):
+    """Worker entry point for one shard of users"""
+    with _worker_app.app_context():
+        return recompute_users(user_ids, chunk_size)
+
+
+def _load_checkpoint(path):
+    """Return the checkpoint's state, or None to start over"""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        data = json.load(f)
+    if data.get('rollup_version') != ROLLUP_VERSION or 'ranges' not in data:
+        # Rollups written by older logic are stale anyway
+        return None
+    return data
+
+
+def _save_checkpoint(path, state):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(dict(state, rollup_version=ROLLUP_VERSION), f)
+    os.replace(tmp_path, path)
+
+
+def _users_done(state, user_ids):
+    """Return the ids in user_ids that a checkpoint's finished ranges still cover.
+
+    Each range is kept with the number of users it held when it finished; a
+    range holding a different number now gained or lost users since, and is
+    recomputed. Owners of groups created after the run started are recomputed
+    too, since their ranges may have finished before the group existed.
+    """
+    done = set()
+    for first, last, count in state['ranges']:
+        ids = user_ids[bisect_left(user_ids, first):bisect_right(user_ids, last)]
+        if len(ids) == count:
+            done.update(ids)
+    owners = db.session.query(Group.user_id).filter(Group.id > state['max_group_id']).distinct()
+    return done - {user_id for (user_id,) in owners}
+
+
+@click.command('recompute-rollups')
+@click.option('--workers', type=int, default=os.cpu_count() or 1, show_default=True,
+              help='Worker processes; 1 recomputes in this process.')
+@click.option('--shard-size', type=int, default=200, show_default=True, help='Users per shard.')
+@click.option('--chunk-size', type=int, default=100, show_default=True, help='Groups per transaction.')
+@click.option('--checkpoint', type=click.Path(dir_okay=False),
+              help='Checkpoint file (default: instance/recompute_rollups.json).')
+@click.option('--restart', is_flag=True, help='Ignore an existing checkpoint and recompute every user.')
+@with_appcontext
+def recompute_rollups_command(workers, shard_size, chunk_size, checkpoint, restart):
+    """Recompute every group's stored rollup, sharding users over worker processes.
+
+    Finished shards are recorded in a checkpoint file, so an interrupted run
+    picks up where it stopped; users and groups added since are picked up
+    too. The file is removed once every shard is done.
+    """
+    app = current_app._get_current_object()
+    checkpoint = checkpoint or os.path.join(app.instance_path, 'recompute_rollups.json')
+    os.makedirs(os.path.dirname(os.path.abspath(checkpoint)), exist_ok=True)
+    state = None if restart else _load_checkpoint(checkpoint)
+    if state is None:
+        state = {'max_group_id': db.session.query(db.func.max(Group.id)).scalar() or 0, 'ranges': []}
+
+    user_ids = [user_id for (user_id,) in db.session.query(User.id).order_by(User.id)]
+    done = _users_done(state, user_ids)
+    pending = [user_id for user_id in user_ids if user_id not in done]
+    if len(pending) < len(user_ids):
+        click.echo(f'Resuming from {checkpoint}: {len(user_ids) - len(pending)} users already done')
+    shards = [pending[i:i + shard_size] for i in range(0, len(pending), shard_size)]
+    if not shards:
+        click.echo('Nothing to recompute.')
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        return
+
+    workers = max(1, min(workers, len(shards)))
+    click.echo(f'Recomputing rollups for {len(pending)} users in {len(shards)} shards on {workers} worker(s)')
+    totals = {'shards': 0, 'users': 0, 'groups': 0, 'bills': 0}
+    start = time.perf_counter()
+
+    def record(shard, counts):
+        # Counted over every user in the range, including those done before this run
+        users = bisect_right(user_ids, shard[-1]) - bisect_left(user_ids, shard[0])
+        state['ranges'].append([shard[0], shard[-1], users])
+        _save_checkpoint(checkpoint, state)
+        totals['shards'] += 1
+        for key in counts:
+            totals[key] += counts[key]
+        elapsed = time.perf_counter() - start
+        click.echo(f"[{totals['shards']}/{len(shards)}] users {shard[0]}-{shard[-1]}: "
+                   f"{totals['users']}/{len(pending)} users, {totals['groups']} groups, "
+                   f"{totals['groups'] / elapsed:.1f} groups/s")
+
+    if workers == 1:
+        for shard in shards:
+            record(shard, recompute_users(shard, chunk_size))
+    else:
+        # Imported here so that building an app for a web worker skips them
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+
+        # Workers are spawned rather than forked so none inherits this process's connections
+        config = {'SQLALCHEMY_DATABASE_URI': app.config['SQLALCHEMY_DATABASE_URI'],
+                  'FRAGMENT_CACHE_BACKEND': 'none', 'JOB_WORKERS': 0, 'JOB_RECOVER': False}
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker, initargs=(config,)) as executor:
+            futures = {executor.submit(_recompute_shard, shard, chunk_size): shard for shard in shards}
+            for future in as_completed(futures):
+                record(futures[future], future.result())
+
+    elapsed = time.perf_counter() - start
+    os.remove(checkpoint)
+    click.echo(f"Done in {elapsed:.1f}s: {totals['users']} users, {totals['groups']} groups, "
+               f"{totals['bills']} bills ({totals['users'] / elapsed:.1f} users/s, "
+               f"{totals['groups'] / elapsed:.1f} groups/s, {totals['bills'] / elapsed:.1f} bills/s)")
+
+
+@click.command('seed-data')
+@click.option('--users', type=int, default=1000, show_default=True, help='Accounts to create.')
+@click.option('--seed', 'random_seed', type=int, default=1, show_default=True, help='Random seed.')
+@click.option('--end-date', type=click.DateTime(formats=['%Y-%m-%d']),
+              help='Date of the newest bill (default: today).')
+@click.option('--days', type=int, default=730, show_default=True, help='Days of history before --end-date.')
+@click.option('--batch-rows', type=int, default=20000, show_default=True, help='Rows per INSERT batch and transaction.')
+@with_appcontext
+def seed_data_command(users, random_seed, end_date, days, batch_rows):
+    """Write synthetic users, groups, members, bills and products straight into the database.
+
+    Rows are generated with realistic category, date and split-size
+    distributions and written with bulk INSERTs. The same --seed and
+    --end-date always produce the same data.
+    """
+    from seeding import SEED_PASSWORD, seed
+
+    db.create_all()
+    start = time.perf_counter()
+    step = max(1, users // 20)
+
+    def progress(done):
+        if done % step == 0 or done == users:
+            click.echo(f'{done}/{users} users ({time.perf_counter() - start:.1f}s)')
+
+    usernames, counts = seed(users, random_seed, end_date.date() if end_date else None, days, batch_rows, progress)
+    elapsed = time.perf_counter() - start
+    rows = sum(counts.values())
+    click.echo(', '.join(f'{count} {table}' for table, count in counts.items()))
+    click.echo(f'Wrote {rows} rows in {elapsed:.1f}s ({rows / elapsed:.0f} rows/s)')
+    if usernames:
+        click.echo(f"Users {usernames[0]} to {usernames[-1]} can log in with password '{SEED_PASSWORD}'")
+
+
+@click.command('prune-activity')
+@click.option('--keep', type=int, help='Entries kept per user (default: ACTIVITY_MAX_PER_USER).')
+@click.option('--batch-size', type=int, default=1000, show_default=True, help='Rows deleted per statement.')
+@with_appcontext
+def prune_activity_command(keep, batch_size):
+    """Cap every user's activity log at its newest --keep entries."""
+    if keep is None:
+        keep = current_app.config['ACTIVITY_MAX_PER_USER']
+    user_ids = Activity.users_over(keep)
+    deleted = 0
+    for user_id in user_ids:
+        deleted += Activity.prune(user_id, keep, batch_size)
+        # One transaction per user keeps write locks short
+        db.session.commit()
+    click.echo(f'Deleted {deleted} activity entries of {len(user_ids)} users')
+
+
+@click.command('upgrade-db')
+@with_appcontext
+def upgrade_db_command():
+    """Bring the database's tables, columns, indexes and foreign keys in line with the models.
+
+    Run it after updating the app; the app answers 503 until it has run.
+    SQLite tables whose foreign keys change are rebuilt, so back up first.
+    """
+    pending = pending_upgrades(db)
+    for item in pending:
+        click.echo(f'Upgrading: {item}')
+    upgrade_schema(db)
+    click.echo('The database is up to date')
+
+
+def init_commands(app):
+    """Register the app's maintenance commands with the flask CLI"""
+    app.cli.add_command(recompute_rollups_command)
+    app.cli.add_command(seed_data_command)
+    app.cli.add_command(prune_activity_command)
+    app.cli.add_command(upgrade_db_command)
@@ -0,0 +1,107 @@
+import os
+
+
+def _env_int(name, default):
+    """Read an integer setting from the environment"""
+    value = os.environ.get(name)
+    if value is None or value == '':
+        return default
+    return int(value)
+
+
+def _env_bool(name, default):
+    """Read a boolean setting from the environment"""
+    value = os.environ.get(name)
+    if value is None or value == '':
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+class Config:
+    """Default application configuration, overridable through environment variables"""
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'default-dev-key')
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///expense_splitter.db')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    WTF_CSRF_ENABLED = True
+    WTF_CSRF_TIME_LIMIT = None  # No time limit for CSRF tokens
+
+    # Storage profile: 'tuned' applies the SQLite pragmas below on every new
+    # connection, 'legacy' keeps SQLite's defaults (rollback journal, FULL sync)
+    STORAGE_PROFILE = os.environ.get('STORAGE_PROFILE', 'tuned')
+
+    # SQLite tuning (only used when the database URI is sqlite)
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_BUSY_TIMEOUT_MS = _env_int('SQLITE_BUSY_TIMEOUT_MS', 5000)
+    SQLITE_MMAP_SIZE = _env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)
+    SQLITE_CACHE_SIZE_KB = _env_int('SQLITE_CACHE_SIZE_KB', 64 * 1024)
+
+    # Connection pool tuning (only used for server databases such as PostgreSQL or MySQL)
+    DB_POOL_SIZE = _env_int('DB_POOL_SIZE', 10)
+    DB_MAX_OVERFLOW = _env_int('DB_MAX_OVERFLOW', 20)
+    DB_POOL_RECYCLE = _env_int('DB_POOL_RECYCLE', 1800)
+    DB_POOL_TIMEOUT = _env_int('DB_POOL_TIMEOUT', 30)
+    DB_POOL_PRE_PING = _env_bool('DB_POOL_PRE_PING', True)
+
+    # Rendered fragment cache for bill summaries: 'memory' (per-process LRU),
+    # 'sqlite' (shared between workers through FRAGMENT_CACHE_PATH) or 'none'
+    FRAGMENT_CACHE_BACKEND = os.environ.get('FRAGMENT_CACHE_BACKEND', 'memory')
+    FRAGMENT_CACHE_MAX_ENTRIES = _env_int('FRAGMENT_CACHE_MAX_ENTRIES', 1024)
+    FRAGMENT_CACHE_PATH = os.environ.get('FRAGMENT_CACHE_PATH')
+
+    # Background jobs (exports): worker threads per process (0 runs jobs inline),
+    # where result files are kept and for how long, and how long a running job
+    # may go without reporting progress before it is considered abandoned
+    JOB_WORKERS = _env_int('JOB_WORKERS', 2)
+    # Whether this process resumes the jobs left queued or abandoned by others.
+    # Recovery runs before the first request a process serves, so commands and
+    # scripts that only build the app never pick up users' jobs
+    JOB_RECOVER = _env_bool('JOB_RECOVER', True)
+    JOB_RESULTS_PATH = os.environ.get('JOB_RESULTS_PATH')
+    JOB_RESULT_MAX_AGE = _env_int('JOB_RESULT_MAX_AGE', 7 * 24 * 3600)
+    JOB_STALE_SECONDS = _env_int('JOB_STALE_SECONDS', 300)
+
+    # Users loaded for each request are cached in-process for USER_CACHE_TTL
+    # seconds, together with their default currency when USER_CACHE_PRELOAD
+    # is on. A change to a user or their currencies is seen at once by the
+    # process that made it and within USER_CACHE_TTL by the others
+    USER_CACHE_ENABLED = _env_bool('USER_CACHE_ENABLED', True)
+    USER_CACHE_TTL = _env_int('USER_CACHE_TTL', 30)
+    USER_CACHE_MAX_ENTRIES = _env_int('USER_CACHE_MAX_ENTRIES', 1024)
+    USER_CACHE_PRELOAD = _env_bool('USER_CACHE_PRELOAD', True)
+
+    # Activity log shown on the dashboard: each user keeps their newest
+    # ACTIVITY_MAX_PER_USER entries. Older ones are pruned in batches, by the
+    # writing user every ACTIVITY_PRUNE_EVERY entries a process records and for
+    # everyone by `flask prune-activity`
+    ACTIVITY_MAX_PER_USER = _env_int('ACTIVITY_MAX_PER_USER', 200)
+    ACTIVITY_PRUNE_EVERY = _env_int('ACTIVITY_PRUNE_EVERY', 50)
+
+    # SQL instrumentation: per-request statement counts and database time are
+    # logged as one JSON line on the 'sqlperf' logger. A statement shape run
+    # SQL_REPEAT_THRESHOLD times in one request is reported as a likely N+1
+    # pattern, and a statement slower than SQL_SLOW_MS turns the line into a
+    # warning. DEBUG_PERF_PAGE keeps the last DEBUG_PERF_HISTORY reports for /debug/perf
+    SQL_INSTRUMENTATION = _env_bool('SQL_INSTRUMENTATION', True)
+    SQL_REPEAT_THRESHOLD = _env_int('SQL_REPEAT_THRESHOLD', 5)
+    SQL_SLOW_MS = _env_int('SQL_SLOW_MS', 100)
+    SQL_KEEP_SLOWEST = _env_int('SQL_KEEP_SLOWEST', 3)
+    DEBUG_PERF_PAGE = _env_bool('DEBUG_PERF_PAGE', False)
+    DEBUG_PERF_HISTORY = _env_int('DEBUG_PERF_HISTORY', 200)
+
+    # Prometheus metrics at /metrics: request latency, status counts, in-flight
+    # requests and database time per endpoint, and fragment cache hit ratios.
+    # Scrapers must send METRICS_TOKEN as a bearer token; without one the
+    # metrics are only served in debug and testing
+    METRICS_ENABLED = _env_bool('METRICS_ENABLED', True)
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+    # On-demand request profiling: when enabled, a request sent with PROFILING_TOKEN
+    # in the X-Profile-Token header is run under cProfile and a stack sampler, and
+    # the results are saved to PROFILING_PATH (default instance/profiles), which is
+    # kept under PROFILING_MAX_BYTES
+    PROFILING_ENABLED = _env_bool('PROFILING_ENABLED', False)
+    PROFILING_TOKEN = os.environ.get('PROFILING_TOKEN')
+    PROFILING_PATH = os.environ.get('PROFILING_PATH')
+    PROFILING_MAX_BYTES = _env_int('PROFILING_MAX_BYTES', 100 * 1024 * 1024)
+    PROFILING_SAMPLE_INTERVAL_MS = _env_int('PROFILING_SAMPLE_INTERVAL_MS', 1)
@@ -0,0 +1,112 @@
+import csv
+from datetime import datetime
+
+from jobs import job_handler
+from sqlalchemy.orm import selectinload
+
+from models import db, Bill, Group
+
+
+@job_handler('bill_csv')
+def export_bill_csv(job):
+    """Write a bill's member summary and settlement as CSV"""
+    bill = db.session.get(Bill, job.params['bill_id'])
+    if bill is None:
+        raise ValueError('The bill no longer exists.')
+    bill.load_contents()
+
+    # Get bill summary and settlement data (served from the snapshot once the bill is settled)
+    member_summary = bill.get_member_summary()
+    settlement = bill.get_settlement_summary(member_summary)
+
+    with job.open_result(f"{bill.title.replace(' ', '_')}_summary.csv", 'text/csv') as out:
+        # Add bill information
+        out.write(f"Bill: {bill.title}\n")
+        out.write(f"Date: {bill.date}\n")
+        out.write(f"Group: {bill.group.name}\n")
+        out.write("\n")
+
+        # Add member summary
+        out.write("Member Summary:\n")
+        out.write("Member,Products,Total Paid,Total Owed,Net Balance\n")
+
+        for done, data in enumerate(member_summary.values()):
+            member = data.member
+            products_info = []
+            for product_data in data.products:
+                product = product_data.product
+                shared_with = [member_summary[m_id].member.name for m_id in product_data.shared_with]
+                shared_info = f"shared with {', '.join(shared_with)}" if shared_with else "independent"
+                products_info.append(f"{product.name} ({shared_info}): ${product_data.share:.2f}")
+
+            products_str = '; '.join(products_info)
+            out.write(f'"{member.name}","{products_str}","${data.paid:.2f}","${data.owes:.2f}","${data.net:.2f}"\n')
+            job.progress(done + 1, len(member_summary))
+
+        out.write("\n")
+
+        # Add settlement summary
+        out.write("Settlement Summary:\n")
+        out.write("From,To,Amount")
+
+        for transaction in settlement:
+            out.write(f'\n"{transaction["from_member"].name}","{transaction["to_member"].name}","${transaction["amount"]:.2f}"')
+
+
+@job_handler('analytics_csv')
+def export_analytics_csv(job):
+    """Write every bill of the user's groups as CSV"""
+    groups = Group.query.filter_by(user_id=job.user_id) \
+        .options(selectinload(Group.bills).selectinload(Bill.products)).all()
+
+    with job.open_result(f'expense_analytics_{datetime.now().strftime("%Y%m%d")}.csv', 'text/csv') as out:
+        writer = csv.writer(out)
+        writer.writerow(['Group Name', 'Bill Title', 'Category', 'Date', 'Total Amount', 'Description'])
+
+        for done, group in enumerate(groups):
+            for bill in group.bills:
+                writer.writerow([
+                    group.name,
+                    bill.title,
+                    bill.category,
+                    bill.date.strftime('%Y-%m-%d'),
+                    f"{bill.get_total_amount():.2f}",
+                    bill.description or ''
+                ])
+            job.progress(done + 1, len(groups))
+
+
+@job_handler('group_csv')
+def export_group_csv(job):
+    """Write a group's bills and its members' balances across all bills as CSV"""
+    group = db.session.get(Group, job.params['group_id'])
+    if group is None:
+        raise ValueError('The group no longer exists.')
+    group.load_bill_contents()
+
+    with job.open_result(f"{group.name.replace(' ', '_')}_expenses.csv", 'text/csv') as out:
+        writer = csv.writer(out)
+        writer.writerow(['Bill Title', 'Category', 'Date', 'Total Amount', 'Settled', 'Description'])
+
+        bills = group.bills
+        for done, bill in enumerate(bills):
+            writer.writerow([
+                bill.title,
+                bill.category,
+                bill.date.strftime('%Y-%m-%d'),
+                f"{bill.get_total_amount():.2f}",
+                'yes' if bill.is_settled else 'no',
+                bill.description or ''
+            ])
+            job.progress(done + 1, len(bills) + 1)
+
+        summary = group.to_summary_dict(['members', 'balances'])
+        writer.writerow([])
+        writer.writerow(['Member', 'Total Paid', 'Total Owed', 'Net Balance'])
+        for balance in summary['balances']:
+            writer.writerow([
+                summary['members'][balance['member']]['name'],
+                f"{balance['paid']:.2f}",
+                f"{balance['owes']:.2f}",
+                f"{balance['net']:.2f}"
+            ])
@@ -62,6 +62,32 @@ class ProductForm(FlaskForm):
     members_involved = SelectMultipleField('Members Involved', coerce=int, validators=[DataRequired()])
     submit = SubmitField('Add Product')
 
+class BulkProductForm(FlaskForm):
+    products = SelectMultipleField('Products', coerce=int, validators=[DataRequired(message='Select at least one product.')])
+    payer = SelectField('Paid By', coerce=int, default=0)
+    members_action = SelectField('Members Involved', choices=[
+        ('keep', 'Keep current members'),
+        ('replace', 'Replace with'),
+        ('add', 'Add'),
+        ('remove', 'Remove')
+    ], default='keep')
+    members = SelectMultipleField('Members', coerce=int)
+    submit = SubmitField('Apply to Selected')
+    
+    def validate_members(self, members):
+        if self.members_action.data != 'keep' and not members.data:
+            raise ValidationError('Select the members to apply.')
+
+class DuplicateBillForm(FlaskForm):
+    title = StringField('Bill Title', validators=[DataRequired(), Length(max=100)])
+    date = DateField('Date', format='%Y-%m-%d', validators=[DataRequired()])
+    group = SelectField('Copy Into Group', coerce=int, validators=[DataRequired()])
+    submit = SubmitField('Duplicate Bill')
+
+class MergeGroupForm(FlaskForm):
+    target = SelectField('Merge Into', coerce=int, validators=[DataRequired()])
+    submit = SubmitField('Merge Groups')
+
 class BillTemplateForm(FlaskForm):
     name = StringField('Template Name', validators=[DataRequired(), Length(max=100)])
     title = StringField('Bill Title', validators=[DataRequired(), Length(max=100)])
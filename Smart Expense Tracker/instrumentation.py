@@ -0,0 +1,213 @@
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from flask import current_app, g, has_app_context, request, session
+from sqlalchemy import event
+
+logger = logging.getLogger('sqlperf')
+
+_APP_ROOT = os.path.dirname(os.path.abspath(__file__)) + os.sep
+
+# Expanded IN lists ("IN (?, ?, ?)") differ only in length; count them as one shape
+_IN_LIST = re.compile(r'IN \((?:[?%][^,()]*, )*[?%][^,()]*\)')
+
+
+def statement_shape(statement):
+    """Return the statement with expanded IN lists collapsed"""
+    if 'IN (' not in statement:
+        return statement
+    return _IN_LIST.sub('IN (...)', statement)
+
+
+def call_site():
+    """Return (code site, template site) of the innermost application frame and template on the stack"""
+    code_site = template_site = None
+    frame = sys._getframe(1)
+    while frame is not None and (code_site is None or template_site is None):
+        template = frame.f_globals.get('__jinja_template__')
+        if template is not None:
+            if template_site is None:
+                template_site = f'{template.name}:{template.get_corresponding_lineno(frame.f_lineno)}'
+        elif code_site is None:
+            filename = frame.f_code.co_filename
+            if filename.startswith(_APP_ROOT) and filename != __file__ and 'site-packages' not in filename:
+                code_site = f'{filename[len(_APP_ROOT):]}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return code_site, template_site
+
+
+class RequestSQLStats:
+    """Statements run while handling one request"""
+
+    __slots__ = ('repeat_threshold', 'keep_slowest', 'count', 'total', 'shapes', 'slowest', 'started')
+
+    def __init__(self, repeat_threshold, keep_slowest):
+        self.repeat_threshold = repeat_threshold
+        self.keep_slowest = keep_slowest
+        self.count = 0
+        self.total = 0.0
+        self.shapes = {}  # shape -> [count, seconds, (code site, template site) once repeated]
+        self.slowest = []  # (seconds, statement), at most keep_slowest
+        self.started = time.perf_counter()
+
+    def record(self, statement, elapsed):
+        self.count += 1
+        self.total += elapsed
+        shape = statement_shape(statement)
+        entry = self.shapes.get(shape)
+        if entry is None:
+            self.shapes[shape] = [1, elapsed, None]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+            # Only shapes that repeat pay for a stack walk, and only once
+            if entry[0] == self.repeat_threshold:
+                entry[2] = call_site()
+
+        if len(self.slowest) < self.keep_slowest:
+            self.slowest.append((elapsed, statement))
+        elif self.slowest and elapsed > min(self.slowest)[0]:
+            self.slowest.remove(min(self.slowest))
+            self.slowest.append((elapsed, statement))
+
+    def repeated(self):
+        """Return the shapes run at least repeat_threshold times, most frequent first"""
+        found = [(shape, entry) for shape, entry in self.shapes.items() if entry[0] >= self.repeat_threshold]
+        found.sort(key=lambda item: item[1][0], reverse=True)
+        return found
+
+
+class SQLMonitor:
+    """Times every statement the app's engine runs and reports the totals per request.
+
+    Each request ends with one JSON log line on the ``sqlperf`` logger: the
+    statement count, total database time, the slowest statements and any
+    statement shape repeated often enough to look like an N+1 pattern, with
+    the code and template line that first crossed the threshold. Requests
+    with repeats or slow statements are logged as warnings, others as info.
+    """
+
+    def __init__(self, repeat_threshold=5, slow_ms=100, keep_slowest=3, history=0):
+        self.repeat_threshold = repeat_threshold
+        self.slow_ms = slow_ms
+        self.keep_slowest = keep_slowest
+        # Recent request reports for /debug/perf; empty when the page is off
+        self.history = deque(maxlen=history) if history else None
+        self._lock = threading.Lock()
+
+    def attach(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        stats = g.get('_sql_stats') if has_app_context() else None
+        if stats is not None:
+            # Kept on the execution context so the after hook needs no lookups
+            context._sql_timing = (stats, time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        timing = getattr(context, '_sql_timing', None)
+        if timing is not None:
+            stats, started = timing
+            stats.record(statement, time.perf_counter() - started)
+
+    def start_request(self):
+        g._sql_stats = RequestSQLStats(self.repeat_threshold, self.keep_slowest)
+
+    def finish_request(self, response):
+        stats = g.pop('_sql_stats', None)
+        if stats is None:
+            return response
+        report = self.report(stats, response.status_code)
+        slow = report['slowest'] and report['slowest'][0]['ms'] >= self.slow_ms
+        level = logging.WARNING if report['repeated'] or slow else logging.INFO
+        if logger.isEnabledFor(level):
+            logger.log(level, json.dumps(report, separators=(',', ':')))
+        if self.history is not None:
+            with self._lock:
+                self.history.append(report)
+        # Exposed for other per-request reporting, such as metrics
+        g.sql_time = stats.total
+        g.sql_count = stats.count
+        return response
+
+    def report(self, stats, status):
+        """Build the structured summary of one request"""
+        repeated = []
+        for shape, (count, seconds, sites) in stats.repeated():
+            code_site, template_site = sites or (None, None)
+            repeated.append({'count': count, 'ms': round(seconds * 1000, 2), 'statement': shape,
+                             'code': code_site, 'template': template_site})
+        # Flask-Login keeps the signed-in user's id in the session; reading current_user
+        # instead could run a query once the view has committed
+        user_id = session.get('_user_id')
+        return {
+            'event': 'sql',
+            'at': datetime.utcnow().isoformat(timespec='seconds'),
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'user_id': int(user_id) if user_id else None,
+            'status': status,
+            'queries': stats.count,
+            'db_ms': round(stats.total * 1000, 2),
+            'request_ms': round((time.perf_counter() - stats.started) * 1000, 2),
+            'slowest': [{'ms': round(seconds * 1000, 2), 'statement': statement}
+                        for seconds, statement in sorted(stats.slowest, reverse=True)],
+            'repeated': repeated,
+        }
+
+    def recent(self, user_id=None):
+        """Return the recorded request reports, newest first; with ``user_id`` only that user's"""
+        if self.history is None:
+            return []
+        with self._lock:
+            reports = list(reversed(self.history))
+        if user_id is not None:
+            reports = [report for report in reports if report['user_id'] == user_id]
+        return reports
+
+    def offenders(self, user_id=None):
+        """Aggregate the repeated statements in the recorded reports by endpoint and call site"""
+        totals = {}
+        for report in self.recent(user_id):
+            for item in report['repeated']:
+                key = (report['endpoint'], item['statement'], item['code'], item['template'])
+                entry = totals.setdefault(key, {'endpoint': report['endpoint'], 'statement': item['statement'],
+                                                'code': item['code'], 'template': item['template'],
+                                                'requests': 0, 'max_count': 0, 'ms': 0.0})
+                entry['requests'] += 1
+                entry['max_count'] = max(entry['max_count'], item['count'])
+                entry['ms'] += item['ms']
+        return sorted(totals.values(), key=lambda entry: (entry['requests'], entry['max_count']), reverse=True)
+
+
+def init_sql_monitor(app, db):
+    """Attach a SQLMonitor to the app's engine, unless SQL_INSTRUMENTATION is off"""
+    if not app.config.get('SQL_INSTRUMENTATION', True):
+        app.extensions['sql_monitor'] = None
+        return None
+    monitor = SQLMonitor(
+        repeat_threshold=app.config.get('SQL_REPEAT_THRESHOLD', 5),
+        slow_ms=app.config.get('SQL_SLOW_MS', 100),
+        keep_slowest=app.config.get('SQL_KEEP_SLOWEST', 3),
+        history=app.config.get('DEBUG_PERF_HISTORY', 200) if app.config.get('DEBUG_PERF_PAGE') else 0,
+    )
+    with app.app_context():
+        monitor.attach(db.engine)
+    app.extensions['sql_monitor'] = monitor
+    app.before_request(monitor.start_request)
+    app.after_request(monitor.finish_request)
+    return monitor
+
+
+def sql_monitor():
+    """Return the current app's SQL monitor, or None when instrumentation is off"""
+    return current_app.extensions.get('sql_monitor')
@@ -0,0 +1,248 @@
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import inspect, or_
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, Job
+
+# Job kind -> handler, filled in by the job_handler decorator
+_handlers = {}
+
+
+def job_handler(kind):
+    """Register a function as the handler for a kind of job.
+
+    The handler is called with a JobContext inside an app context and writes
+    its output through ``context.open_result()``.
+    """
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+class JobCancelled(Exception):
+    """Raised from JobContext.progress() once the job has been cancelled"""
+
+
+class JobContext:
+    """Handed to a job handler to read its parameters, report progress and write its result"""
+
+    def __init__(self, runner, job):
+        self.runner = runner
+        self.job_id = job.id
+        self.user_id = job.user_id
+        self.params = job.get_params()
+        self.result_path = None
+        self.result_name = None
+        self.result_mimetype = None
+        self._last_report = 0.0
+
+    def progress(self, done, total):
+        """Record progress and raise JobCancelled if the job has been cancelled meanwhile"""
+        now = time.monotonic()
+        if now - self._last_report < self.runner.progress_interval:
+            return
+        self._last_report = now
+        percent = min(99, int(done * 100 / total)) if total else 0
+        # A separate connection keeps the handler's session (and its loaded rows) untouched
+        with db.engine.begin() as conn:
+            conn.execute(Job.__table__.update().where(Job.id == self.job_id)
+                         .values(progress=percent, heartbeat_at=datetime.utcnow()))
+            cancelled = conn.execute(db.select(Job.cancel_requested).where(Job.id == self.job_id)).scalar()
+        if cancelled:
+            raise JobCancelled()
+
+    def open_result(self, name, mimetype, mode='w'):
+        """Open the file the job's result is written to; ``name`` is offered on download"""
+        os.makedirs(self.runner.results_path, exist_ok=True)
+        self.result_path = os.path.join(self.runner.results_path, f'job-{self.job_id}-{uuid.uuid4().hex[:8]}')
+        self.result_name = name
+        self.result_mimetype = mimetype
+        if 'b' in mode:
+            return open(self.result_path, mode)
+        return open(self.result_path, mode, encoding='utf-8', newline='')
+
+    def discard(self):
+        """Remove a partially written result"""
+        if self.result_path and os.path.exists(self.result_path):
+            os.remove(self.result_path)
+
+
+class JobRunner:
+    """Runs queued jobs on a thread pool, keeping their state in the jobs table.
+
+    Jobs are claimed with a conditional UPDATE, so several processes can share
+    one database without running a job twice. A running job that stops
+    reporting progress for ``stale_after`` seconds (its worker died) is queued
+    again by the next process that serves a request.
+    """
+
+    def __init__(self, app, workers=2, results_path=None, stale_after=300, max_age=7 * 24 * 3600,
+                 progress_interval=0.5):
+        self.app = app
+        self.workers = workers
+        self.results_path = results_path or os.path.join(app.instance_path, 'job_results')
+        self.stale_after = stale_after
+        self.max_age = max_age
+        self.progress_interval = progress_interval
+        self._executor = None
+        self._lock = threading.Lock()
+        self._recovered = False
+
+    def enqueue(self, kind, user_id, **params):
+        """Queue a job, or return the user's identical job if it is still pending"""
+        if kind not in _handlers:
+            raise ValueError(f"Unknown job kind '{kind}'")
+        payload = json.dumps(params, sort_keys=True)
+        job = Job.query.filter(Job.user_id == user_id, Job.kind == kind, Job.params == payload,
+                               Job.status.in_(Job.ACTIVE_STATES),
+                               Job.cancel_requested.is_(False)).first()
+        if job is not None:
+            return job
+
+        job = Job(user_id=user_id, kind=kind, params=payload)
+        db.session.add(job)
+        db.session.commit()
+        self._submit(job.id)
+        return job
+
+    def cancel(self, job):
+        """Cancel a queued job now, or ask a running one to stop at its next progress report"""
+        now = datetime.utcnow()
+        cancelled = Job.query.filter_by(id=job.id, status=Job.QUEUED).update(
+            {Job.status: Job.CANCELLED, Job.cancel_requested: True, Job.finished_at: now})
+        if not cancelled:
+            cancelled = Job.query.filter_by(id=job.id, status=Job.RUNNING).update({Job.cancel_requested: True})
+        db.session.commit()
+        return bool(cancelled)
+
+    def recover(self):
+        """Requeue jobs abandoned by a stopped worker, resubmit queued ones and prune old results.
+
+        Runs once per process, before the first request it serves. While the
+        jobs table does not exist yet it is retried before each request until
+        the table has been created.
+        """
+        with self._lock:
+            if self._recovered:
+                return
+            if not inspect(db.engine).has_table(Job.__tablename__):
+                return
+            self._recovered = True
+
+        now = datetime.utcnow()
+        stale = or_(Job.heartbeat_at.is_(None), Job.heartbeat_at < now - timedelta(seconds=self.stale_after))
+        try:
+            Job.query.filter(Job.status == Job.RUNNING, stale, Job.cancel_requested.is_(True)).update(
+                {Job.status: Job.CANCELLED, Job.finished_at: now}, synchronize_session=False)
+            Job.query.filter(Job.status == Job.RUNNING, stale).update(
+                {Job.status: Job.QUEUED, Job.progress: 0}, synchronize_session=False)
+            db.session.commit()
+            queued = [job_id for (job_id,) in db.session.query(Job.id).filter_by(status=Job.QUEUED).order_by(Job.id)]
+            self.prune(now)
+        except SQLAlchemyError:
+            # Most likely a database that predates the jobs table; see upgrade_schema()
+            db.session.rollback()
+            current_app.logger.warning('Could not recover background jobs', exc_info=True)
+            return
+
+        for job_id in queued:
+            self._submit(job_id)
+
+    def prune(self, now=None):
+        """Delete finished jobs older than max_age together with their result files"""
+        cutoff = (now or datetime.utcnow()) - timedelta(seconds=self.max_age)
+        old = Job.query.filter(Job.status.notin_(Job.ACTIVE_STATES), Job.finished_at < cutoff).all()
+        for job in old:
+            if job.result_path and os.path.exists(job.result_path):
+                os.remove(job.result_path)
+            db.session.delete(job)
+        db.session.commit()
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _submit(self, job_id):
+        if self.workers <= 0:
+            # Run in the calling thread, e.g. for tests or single-threaded deployments
+            self._run(job_id)
+            return
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='job')
+            executor = self._executor
+        executor.submit(self._run, job_id)
+
+    def _run(self, job_id):
+        with self.app.app_context():
+            now = datetime.utcnow()
+            claimed = Job.query.filter_by(id=job_id, status=Job.QUEUED).update(
+                {Job.status: Job.RUNNING, Job.started_at: now, Job.heartbeat_at: now,
+                 Job.progress: 0, Job.error: None})
+            db.session.commit()
+            if not claimed:
+                # Cancelled before it started, or picked up by another worker
+                return
+
+            job = db.session.get(Job, job_id)
+            handler = _handlers.get(job.kind)
+            context = JobContext(self, job)
+            try:
+                if handler is None:
+                    raise ValueError(f"Unknown job kind '{job.kind}'")
+                handler(context)
+            except JobCancelled:
+                db.session.rollback()
+                context.discard()
+                self._finish(job_id, {Job.status: Job.CANCELLED})
+            except Exception as exc:
+                db.session.rollback()
+                context.discard()
+                current_app.logger.exception('Job %s (%s) failed', job_id, job.kind)
+                self._finish(job_id, {Job.status: Job.FAILED, Job.error: str(exc) or exc.__class__.__name__})
+            else:
+                self._finish(job_id, {Job.status: Job.DONE, Job.progress: 100,
+                                      Job.result_path: context.result_path,
+                                      Job.result_name: context.result_name,
+                                      Job.result_mimetype: context.result_mimetype})
+
+    def _finish(self, job_id, values):
+        values[Job.finished_at] = datetime.utcnow()
+        Job.query.filter_by(id=job_id).update(values)
+        db.session.commit()
+
+
+def init_jobs(app):
+    """Create the app's job runner; with JOB_RECOVER, the first request resumes abandoned jobs"""
+    runner = JobRunner(
+        app,
+        workers=app.config.get('JOB_WORKERS', 2),
+        results_path=app.config.get('JOB_RESULTS_PATH'),
+        stale_after=app.config.get('JOB_STALE_SECONDS', 300),
+        max_age=app.config.get('JOB_RESULT_MAX_AGE', 7 * 24 * 3600),
+    )
+    app.extensions['jobs'] = runner
+
+    # Handlers register themselves on import, before any job is resumed
+    import exports  # noqa: F401
+    if app.config.get('JOB_RECOVER', True):
+        # Only a process serving requests resumes jobs; building the app for a
+        # command, a script or a worker leaves them to the web server
+        app.before_request(runner.recover)
+    return runner
+
+
+def job_runner():
+    """Return the current app's job runner"""
+    return current_app.extensions['jobs']
@@ -0,0 +1,200 @@
+import threading
+import time
+from bisect import bisect_left
+
+from flask import current_app, g, request
+
+# Upper bounds in seconds of the latency and database time histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# name -> (type, help) of every metric written by render()
+METRICS = {
+    'http_requests_total': ('counter', 'Finished requests by endpoint, method and status'),
+    'http_requests_in_flight': ('gauge', 'Requests currently being handled by endpoint'),
+    'http_request_duration_seconds': ('histogram', 'Request latency by endpoint'),
+    'http_request_db_seconds': ('histogram', 'Time spent in database statements per request by endpoint'),
+    'db_statements_total': ('counter', 'Database statements run by endpoint'),
+    'fragment_cache_hits_total': ('counter', 'Fragment cache hits by endpoint'),
+    'fragment_cache_misses_total': ('counter', 'Fragment cache misses by endpoint'),
+    'fragment_cache_hit_ratio': ('gauge', 'Fragment cache hits per lookup since startup'),
+    'fragment_cache_entries': ('gauge', 'Entries in the fragment cache'),
+    'fragment_cache_bytes': ('gauge', 'Approximate size of the fragment cache'),
+}
+
+
+class _Shard:
+    """Values written by one thread"""
+
+    __slots__ = ('thread', 'counters', 'histograms')
+
+    def __init__(self, thread):
+        self.thread = thread
+        self.counters = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [count per bucket..., count over the last bucket, sum]
+
+
+class MetricsRegistry:
+    """Counters, gauges and histograms sharded per thread.
+
+    Each thread only ever writes its own shard, so recording a value takes no
+    lock; a scrape adds the shards up. Shards of finished threads are folded
+    into a retired total, which keeps a thread-per-request server from
+    growing the list without bound.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._local = threading.local()
+        self._shards = []
+        self._retired = _Shard(None)
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = _Shard(threading.current_thread())
+            with self._lock:
+                self._retire_finished()
+                self._shards.append(shard)
+            self._local.shard = shard
+        return shard
+
+    def _retire_finished(self):
+        live = []
+        for shard in self._shards:
+            if shard.thread.is_alive():
+                live.append(shard)
+            else:
+                self._merge(self._retired, shard)
+        self._shards = live
+
+    @staticmethod
+    def _merge(target, shard):
+        for key, value in shard.counters.copy().items():
+            target.counters[key] = target.counters.get(key, 0) + value
+        for key, values in shard.histograms.copy().items():
+            total = target.histograms.get(key)
+            if total is None:
+                target.histograms[key] = list(values)
+            else:
+                for i, value in enumerate(list(values)):
+                    total[i] += value
+
+    def inc(self, name, labels=(), amount=1):
+        """Add amount to a counter or gauge; labels is a tuple of (name, value) pairs"""
+        counters = self._shard().counters
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        """Record a value in a histogram"""
+        histograms = self._shard().histograms
+        key = (name, labels)
+        values = histograms.get(key)
+        if values is None:
+            values = histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        values[bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def collect(self):
+        """Return the totals of every shard as one _Shard"""
+        totals = _Shard(None)
+        with self._lock:
+            self._retire_finished()
+            self._merge(totals, self._retired)
+            for shard in self._shards:
+                self._merge(totals, shard)
+        return totals
+
+    # Request hooks
+    def start_request(self):
+        g._metrics_started = time.perf_counter()
+        g._metrics_endpoint = request.endpoint or 'unmatched'
+        self.inc('http_requests_in_flight', (('endpoint', g._metrics_endpoint),))
+
+    def record_cache_lookup(self, hit, backend):
+        """Count a fragment cache hit or miss against the current request's endpoint"""
+        labels = (('endpoint', g.get('_metrics_endpoint', 'none')), ('backend', backend))
+        self.inc('fragment_cache_hits_total' if hit else 'fragment_cache_misses_total', labels)
+
+    def record_status(self, response):
+        g._metrics_status = response.status_code
+        return response
+
+    def finish_request(self, exc=None):
+        # Runs on teardown, after every after_request hook, so the SQL totals are final
+        started = g.pop('_metrics_started', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        labels = (('endpoint', g._metrics_endpoint),)
+        self.inc('http_requests_in_flight', labels, -1)
+        self.observe('http_request_duration_seconds', labels, elapsed)
+        status = g.pop('_metrics_status', 500)
+        self.inc('http_requests_total', labels + (('method', request.method), ('status', str(status))))
+        sql_time = g.get('sql_time')
+        if sql_time is not None:
+            self.observe('http_request_db_seconds', labels, sql_time)
+            self.inc('db_statements_total', labels, g.sql_count)
+
+    def render(self, cache_stats=None):
+        """Return every metric in the Prometheus text exposition format"""
+        totals = self.collect()
+        series = {name: [] for name in METRICS}
+        for (name, labels), value in sorted(totals.counters.items()):
+            series[name].append(_sample(name, labels, value))
+        for (name, labels), values in sorted(totals.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values):
+                cumulative += count
+                series[name].append(_sample(name + '_bucket', labels + (('le', _format_value(bound)),), cumulative))
+            series[name].append(_sample(name + '_sum', labels, values[-1]))
+            series[name].append(_sample(name + '_count', labels, cumulative))
+        if cache_stats is not None:
+            labels = (('backend', cache_stats['backend']),)
+            series['fragment_cache_hit_ratio'].append(
+                _sample('fragment_cache_hit_ratio', labels, cache_stats['hit_ratio']))
+            series['fragment_cache_entries'].append(_sample('fragment_cache_entries', labels, cache_stats['entries']))
+            series['fragment_cache_bytes'].append(_sample('fragment_cache_bytes', labels, cache_stats['bytes']))
+
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            if series[name]:
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                lines.extend(series[name])
+        return '\n'.join(lines) + '\n'
+
+
+def _format_value(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return f'{value:.1f}'
+    return repr(value)
+
+
+def _sample(name, labels, value):
+    if not labels:
+        return f'{name} {_format_value(value)}'
+    pairs = ','.join('{}="{}"'.format(key, str(label).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+                     for key, label in labels)
+    return f'{name}{{{pairs}}} {_format_value(value)}'
+
+
+def init_metrics(app):
+    """Record per-endpoint request metrics for /metrics, unless METRICS_ENABLED is off"""
+    if not app.config.get('METRICS_ENABLED', True):
+        app.extensions['metrics'] = None
+        return None
+    registry = MetricsRegistry(app.config.get('METRICS_BUCKETS', DEFAULT_BUCKETS))
+    app.extensions['metrics'] = registry
+    app.before_request(registry.start_request)
+    app.after_request(registry.record_status)
+    app.teardown_request(registry.finish_request)
+    return registry
+
+
+def metrics_registry():
+    """Return the current app's metrics registry, or None when metrics are off"""
+    return current_app.extensions.get('metrics')
@@ -1,17 +1,153 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import MetaData, Table
+from sqlalchemy.orm import selectinload
 from flask_login import UserMixin
 from datetime import datetime
+from collections import namedtuple
 import json
+import re
 
 # Create db instance that will be initialized in the main app
 db = SQLAlchemy()
 
+# Read-only stand-ins for Member and Product rows when a bill is served from its snapshot
+SnapshotMember = namedtuple('SnapshotMember', ['id', 'name', 'email', 'mobile_number'])
+SnapshotProduct = namedtuple('SnapshotProduct', ['id', 'name', 'price', 'payer_id', 'payer', 'payer_name', 'members_count'])
+
+# Version of the rollup calculation; bump it when Group.compute_rollup() changes so
+# every stored rollup is treated as stale (and rebuild them with `flask recompute-rollups`)
+ROLLUP_VERSION = 1
+
+# One product in a member's breakdown; shared_with lists the other participants' ids
+ProductShare = namedtuple('ProductShare', ['product', 'share', 'shared_with', 'payer', 'is_payer'])
+
+class MemberSummary:
+    """One member's totals in a bill summary.
+    
+    Shares are kept as (product, share, participant ids) tuples, with the ids
+    tuple shared by every participant of a product; the per-member
+    ``products`` breakdown is only expanded when it is read.
+    """
+    __slots__ = ('member', 'paid', 'owes', 'net', 'paid_products', '_shares')
+    
+    def __init__(self, member, paid=0, owes=0, net=0):
+        self.member = member
+        self.paid = paid  # Total amount paid by this member
+        self.owes = owes  # Total amount this member owes
+        self.net = net  # Net amount (positive means others owe this member)
+        self.paid_products = []  # Products paid by this member
+        self._shares = []
+    
+    def __repr__(self):
+        return f'<MemberSummary {self.member.id} paid={self.paid} owes={self.owes} net={self.net}>'
+    
+    def add_share(self, product, share, involved):
+        """Record this member's share of a product split between the involved member ids"""
+        self._shares.append((product, share, involved))
+    
+    @property
+    def participates(self):
+        """Whether the member paid for or shares any product of the bill"""
+        return bool(self.paid_products or self._shares)
+    
+    @property
+    def shared_products(self):
+        """Products shared by this member"""
+        return [product for product, _, _ in self._shares]
+    
+    @property
+    def products(self):
+        """Products this member is involved in, with their share and co-participants"""
+        member_id = self.member.id
+        return [ProductShare(product, share, [m for m in involved if m != member_id],
+                             product.payer, member_id == product.payer_id)
+                for product, share, involved in self._shares]
+    
+    def products_paid_by(self, payer_id):
+        """Products shared by this member that were paid for by another member"""
+        return [product for product, _, _ in self._shares if product.payer_id == payer_id]
+
+def pair_debts(balances):
+    """Turn (member_id, net) balances into (debtor_id, creditor_id, amount) transfers"""
+    # Extract members with positive and negative balances
+    creditors = []
+    debtors = []
+    
+    for member_id, net in balances:
+        if net > 0:
+            creditors.append((member_id, net))
+        elif net < 0:
+            debtors.append((member_id, abs(net)))
+    
+    # Sort by amount (descending)
+    creditors.sort(key=lambda x: x[1], reverse=True)
+    debtors.sort(key=lambda x: x[1], reverse=True)
+    
+    transfers = []
+    i, j = 0, 0
+    while i < len(debtors) and j < len(creditors):
+        debtor_id, debt = debtors[i]
+        creditor_id, credit = creditors[j]
+        
+        # Calculate transaction amount
+        amount = min(debt, credit)
+        transfers.append((debtor_id, creditor_id, round(amount, 2)))
+        
+        # Update remaining amounts
+        debtors[i] = (debtor_id, debt - amount)
+        creditors[j] = (creditor_id, credit - amount)
+        
+        # Move to next member if their balance is settled
+        if debtors[i][1] < 0.01:  # Using small threshold to handle floating point errors
+            i += 1
+        if creditors[j][1] < 0.01:
+            j += 1
+    
+    return transfers
+
+def member_keys(member, by_name=True):
+    """Keys that identify the same person across groups: the mobile number's digits, the email and optionally the name"""
+    keys = []
+    mobile = re.sub(r'\D', '', member.mobile_number or '')
+    if mobile:
+        keys.append(('mobile', mobile))
+    if member.email and member.email.strip():
+        keys.append(('email', member.email.strip().lower()))
+    if by_name:
+        keys.append(('name', member.name.strip().casefold()))
+    return keys
+
+def match_members(sources, targets, by_name=True):
+    """Map source member ids to the ids of target members sharing one of their member_keys"""
+    by_key = {}
+    for target in targets:
+        for key in member_keys(target, by_name):
+            by_key.setdefault(key, target.id)
+    matches = {}
+    for source in sources:
+        for key in member_keys(source, by_name):
+            if key in by_key:
+                matches[source.id] = by_key[key]
+                break
+    return matches
+
+def mark_user_changed(user_id):
+    """Record that a user's row changed in this transaction, so cached copies are dropped on commit"""
+    db.session.info.setdefault('changed_users', set()).add(user_id)
+
+# Old member id -> the member it is merged into, for one Group.merge_into; created and
+# dropped inside its transaction, and kept out of db.metadata so create_all skips it
+member_merge_map = Table('member_merge_map', MetaData(),
+                         db.Column('old_id', db.Integer, primary_key=True),
+                         db.Column('new_id', db.Integer, nullable=False),
+                         prefixes=['TEMPORARY'])
+
 # Association table for many-to-many relationship between Product and Member
 class ProductMember(db.Model):
     __tablename__ = 'product_members'
     id = db.Column(db.Integer, primary_key=True)
-    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
-    member_id = db.Column(db.Integer, db.ForeignKey('members.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
+    member_id = db.Column(db.Integer, db.ForeignKey('members.id', ondelete='CASCADE'), nullable=False, index=True)
     
     # Define unique constraint to prevent duplicate entries
     __table_args__ = (db.UniqueConstraint('product_id', 'member_id'),)
@@ -19,6 +155,23 @@ class ProductMember(db.Model):
     # Relationships
     product = db.relationship('Product', back_populates='members_involved')
     member = db.relationship('Member', back_populates='products_involved')
+    
+    @staticmethod
+    def sync(current, wanted):
+        """Turn the (product_id, member_id) pairs ``current`` into ``wanted``; return (added, removed).
+
+        Only the pairs that differ are inserted or deleted, so unchanged rows and
+        their index entries are left alone. The caller commits.
+        """
+        added = wanted - current
+        removed = current - wanted
+        if removed:
+            pair = db.tuple_(ProductMember.product_id, ProductMember.member_id)
+            ProductMember.query.filter(pair.in_(sorted(removed))).delete(synchronize_session=False)
+        if added:
+            db.session.execute(db.insert(ProductMember),
+                               [{'product_id': product_id, 'member_id': member_id} for product_id, member_id in sorted(added)])
+        return added, removed
 
 class User(db.Model, UserMixin):
     __tablename__ = 'users'
@@ -27,25 +180,84 @@ class User(db.Model, UserMixin):
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(128), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Aggregate data version, bumped whenever any of the user's groups or settings change
+    data_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    data_updated_at = db.Column(db.DateTime)
     
     # Relationships
-    groups = db.relationship('Group', back_populates='user', cascade='all, delete-orphan')
-    bill_templates = db.relationship('BillTemplate', back_populates='user', cascade='all, delete-orphan')
+    groups = db.relationship('Group', back_populates='user', cascade='all, delete-orphan', passive_deletes=True)
+    bill_templates = db.relationship('BillTemplate', back_populates='user', cascade='all, delete-orphan', passive_deletes=True)
     
     def __repr__(self):
         return f'<User {self.username}>'
     
+    def bump_data_version(self, include_groups=False):
+        """Mark the user's data as changed so cached views are revalidated"""
+        now = datetime.utcnow()
+        # Cached copies keep their data_version; readers call refresh_data_version()
+        User.query.filter_by(id=self.id).update(
+            {User.data_version: User.data_version + 1, User.data_updated_at: now})
+        if include_groups:
+            # Settings such as the default currency change how every group renders,
+            # and the preloaded default currency may be out of date
+            Group.query.filter_by(user_id=self.id).update(
+                {Group.version: Group.version + 1, Group.updated_at: now})
+            self.__dict__.pop('_preloaded', None)
+            mark_user_changed(self.id)
+    
+    @property
+    def data_last_modified(self):
+        """Time of the last recorded write to any of the user's data"""
+        return self.data_updated_at or self.created_at
+    
+    def get_recent_activity(self, limit=10):
+        """The user's latest activity log entries, newest first"""
+        return Activity.query.filter_by(user_id=self.id) \
+            .order_by(Activity.created_at.desc(), Activity.id.desc()).limit(limit).all()
+    
+    def refresh_data_version(self):
+        """Reload data_version and data_updated_at, which a cached user may hold stale copies of"""
+        db.session.refresh(self, ['data_version', 'data_updated_at'])
+    
+    @classmethod
+    def load_with_preloads(cls, user_id):
+        """Load a user with their default currency in one query.
+
+        Returns (user, currency or None), or None if there is no such user. The
+        currency is also kept on the user, so that get_default_currency() needs
+        no query of its own.
+        """
+        row = db.session.query(cls, Currency) \
+            .outerjoin(UserCurrency, db.and_(UserCurrency.user_id == cls.id, UserCurrency.is_default == True,
+                                             UserCurrency.is_active == True)) \
+            .outerjoin(Currency, Currency.id == UserCurrency.currency_id) \
+            .filter(cls.id == user_id).first()
+        if row is None:
+            return None
+        user, currency = row
+        user.set_preloaded(currency)
+        return user, currency
+    
+    def set_preloaded(self, currency):
+        """Keep the default currency for the rest of the request"""
+        self._preloaded = (currency,)
+    
+    def groups_with_bills(self):
+        """The user's groups with their bills and products loaded in three queries"""
+        return Group.query.filter_by(user_id=self.id).order_by(Group.id) \
+            .options(selectinload(Group.bills).selectinload(Bill.products)).all()
+    
     def get_total_expenses(self):
         """Get total expenses across all groups"""
         total = 0
-        for group in self.groups:
+        for group in self.groups_with_bills():
             total += group.get_total_expenses()
         return total
     
     def get_expenses_by_category(self):
         """Get expenses grouped by category across all groups"""
         category_totals = {}
-        for group in self.groups:
+        for group in self.groups_with_bills():
             group_categories = group.get_expenses_by_category()
             for category, amount in group_categories.items():
                 category_totals[category] = category_totals.get(category, 0) + amount
@@ -57,7 +269,7 @@ class User(db.Model, UserMixin):
             year = datetime.now().year
         
         monthly_totals = {}
-        for group in self.groups:
+        for group in self.groups_with_bills():
             group_monthly = group.get_monthly_expenses(year)
             for month_key, amount in group_monthly.items():
                 monthly_totals[month_key] = monthly_totals.get(month_key, 0) + amount
@@ -70,6 +282,9 @@ class User(db.Model, UserMixin):
     
     def get_default_currency(self):
         """Get the user's default currency"""
+        preloaded = self.__dict__.get('_preloaded')
+        if preloaded is not None:
+            return preloaded[0]
         default = UserCurrency.query.filter_by(user_id=self.id, is_default=True, is_active=True).first()
         if default:
             return default.currency
@@ -91,6 +306,7 @@ class User(db.Model, UserMixin):
             if not existing.is_active:
                 existing.is_active = True
                 existing.is_default = is_default
+                self.bump_data_version(include_groups=True)
                 db.session.commit()
             return True
         
@@ -105,6 +321,7 @@ class User(db.Model, UserMixin):
             is_default=is_default or not self.get_active_currencies()
         )
         db.session.add(user_currency)
+        self.bump_data_version(include_groups=True)
         db.session.commit()
         return True
     
@@ -131,6 +348,7 @@ class User(db.Model, UserMixin):
         else:
             user_currency.is_active = False
         
+        self.bump_data_version(include_groups=True)
         db.session.commit()
         return True
     
@@ -145,6 +363,7 @@ class User(db.Model, UserMixin):
         
         # Set new default
         user_currency.is_default = True
+        self.bump_data_version(include_groups=True)
         db.session.commit()
         return True
 
@@ -154,16 +373,172 @@ class Group(db.Model):
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.String(255))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    # Monotonically increasing data version, bumped by every write to the group's bills, products or members
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime)
     
     # Relationships
     user = db.relationship('User', back_populates='groups')
-    members = db.relationship('Member', back_populates='group', cascade='all, delete-orphan')
-    bills = db.relationship('Bill', back_populates='group', cascade='all, delete-orphan')
+    members = db.relationship('Member', back_populates='group', cascade='all, delete-orphan', passive_deletes=True)
+    bills = db.relationship('Bill', back_populates='group', cascade='all, delete-orphan', passive_deletes=True)
+    rollup = db.relationship('GroupRollup', back_populates='group', uselist=False, cascade='all, delete-orphan', passive_deletes=True)
     
     def __repr__(self):
         return f'<Group {self.name}>'
     
+    def bump_version(self, include_bills=False):
+        """Mark the group (and its owner's aggregate) as changed so cached views are revalidated"""
+        now = datetime.utcnow()
+        Group.query.filter_by(id=self.id).update({Group.version: Group.version + 1, Group.updated_at: now})
+        if include_bills:
+            # Member changes show up in every bill summary of the group
+            Bill.query.filter_by(group_id=self.id).update({Bill.version: Bill.version + 1})
+        # Nothing a cached user holds changes with the group, so they are left cached
+        User.query.filter_by(id=self.user_id).update(
+            {User.data_version: User.data_version + 1, User.data_updated_at: now})
+    
+    @property
+    def last_modified(self):
+        """Time of the last recorded write to this group"""
+        return self.updated_at or self.created_at
+    
+    def delete_cascade(self):
+        """Delete the group with its bills, products, members and rollup, one DELETE per table.
+
+        Rows go children first, so nothing is orphaned even where the database
+        does not enforce the ON DELETE CASCADE keys. The caller commits.
+        """
+        bill_ids = db.select(Bill.id).where(Bill.group_id == self.id)
+        product_ids = db.select(Product.id).where(Product.bill_id.in_(bill_ids))
+        ProductMember.query.filter(ProductMember.product_id.in_(product_ids)).delete(synchronize_session=False)
+        Product.query.filter(Product.bill_id.in_(bill_ids)).delete(synchronize_session=False)
+        Bill.query.filter_by(group_id=self.id).delete(synchronize_session=False)
+        Member.query.filter_by(group_id=self.id).delete(synchronize_session=False)
+        GroupRollup.query.filter_by(group_id=self.id).delete(synchronize_session=False)
+        Group.query.filter_by(id=self.id).delete(synchronize_session=False)
+    
+    def member_merge_plan(self, target):
+        """Map the ids of members duplicating one of target's, or an earlier one here, to the id they merge into.
+
+        Members are duplicates when their mobile numbers have the same digits or
+        their emails match, ignoring case. Members not in the map move over as
+        they are.
+        """
+        by_key = {}
+        for member in target.members:
+            for key in member_keys(member, by_name=False):
+                by_key.setdefault(key, member.id)
+        plan = {}
+        for member in sorted(self.members, key=lambda m: m.id):
+            keys = member_keys(member, by_name=False)
+            match = next((by_key[key] for key in keys if key in by_key), None)
+            if match is not None:
+                plan[member.id] = match
+            else:
+                for key in keys:
+                    by_key.setdefault(key, member.id)
+        return plan
+    
+    def merge_into(self, target):
+        """Move this group's bills and members into target, merge duplicate members and delete this group.
+
+        Returns the member_merge_plan() applied. Products and shares of merged
+        members are remapped by set-based UPDATEs through the temporary
+        member_merge_map table; settled bills keep their snapshots. The caller
+        commits, so the whole merge is one transaction.
+        """
+        plan = self.member_merge_plan(target)
+        Bill.query.filter_by(group_id=self.id).update({Bill.group_id: target.id}, synchronize_session=False)
+        if plan:
+            connection = db.session.connection()
+            member_merge_map.create(connection, checkfirst=True)
+            connection.execute(db.insert(member_merge_map),
+                               [{'old_id': old_id, 'new_id': new_id} for old_id, new_id in plan.items()])
+            old_ids = db.select(member_merge_map.c.old_id)
+            
+            def new_id(column):
+                return db.select(member_merge_map.c.new_id).where(member_merge_map.c.old_id == column).scalar_subquery()
+            
+            # A product shared by a member and their duplicate would list the member twice
+            # once remapped; drop the duplicate's share first (the earliest share is kept)
+            shares = ProductMember.__table__
+            other = shares.alias('other')
+            other_map = member_merge_map.alias('other_map')
+            duplicate_shares = db.select(shares.c.id).join(member_merge_map, shares.c.member_id == member_merge_map.c.old_id) \
+                .where(db.select(other.c.id).select_from(other.outerjoin(other_map, other.c.member_id == other_map.c.old_id))
+                       .where(other.c.product_id == shares.c.product_id, other.c.id != shares.c.id,
+                              db.func.coalesce(other_map.c.new_id, other.c.member_id) == member_merge_map.c.new_id,
+                              db.or_(other_map.c.old_id.is_(None), other.c.id < shares.c.id))
+                       .exists())
+            ProductMember.query.filter(ProductMember.id.in_(duplicate_shares)).delete(synchronize_session=False)
+            ProductMember.query.filter(ProductMember.member_id.in_(old_ids)) \
+                .update({ProductMember.member_id: new_id(ProductMember.member_id)}, synchronize_session=False)
+            Product.query.filter(Product.payer_id.in_(old_ids)) \
+                .update({Product.payer_id: new_id(Product.payer_id)}, synchronize_session=False)
+            Member.query.filter(Member.id.in_(old_ids)).delete(synchronize_session=False)
+            member_merge_map.drop(connection)
+        Member.query.filter_by(group_id=self.id).update({Member.group_id: target.id}, synchronize_session=False)
+        GroupRollup.query.filter_by(group_id=self.id).delete(synchronize_session=False)
+        Group.query.filter_by(id=self.id).delete(synchronize_session=False)
+        # Every bill now in target changed group or members
+        target.bump_version(include_bills=True)
+        return plan
+    
+    def bill_page(self, after=None, limit=25):
+        """Return one page of the group's bills, newest first, and whether more follow.
+
+        Rows are (bill, product_count, total), with the figures aggregated in the
+        same query. ``after`` is the (date, id) of the last bill of the previous
+        page; pages are found by keyset, so any page costs the same to fetch.
+        """
+        product_count = db.select(db.func.count(Product.id)).where(Product.bill_id == Bill.id) \
+            .correlate(Bill).scalar_subquery()
+        total = db.select(db.func.coalesce(db.func.sum(Product.price), 0.0)).where(Product.bill_id == Bill.id) \
+            .correlate(Bill).scalar_subquery()
+        query = db.session.query(Bill, product_count, total).filter(Bill.group_id == self.id)
+        if after is not None:
+            after_date, after_id = after
+            query = query.filter(db.or_(Bill.date < after_date, db.and_(Bill.date == after_date, Bill.id < after_id)))
+        rows = query.order_by(Bill.date.desc(), Bill.id.desc()).limit(limit + 1).all()
+        # A settled bill's total is the one frozen in its snapshot
+        page = [(bill, count, bill.get_total_amount() if bill.is_settled else amount)
+                for bill, count, amount in rows[:limit]]
+        return page, len(rows) > limit
+    
+    @classmethod
+    def dashboard_query(cls, user_id):
+        """Query of a user's groups with their counts, newest activity first.
+
+        Each row is (group, member_count, bill_count, total_spend, last_activity);
+        the figures come from correlated subqueries, so paging the query only
+        aggregates the groups on the page.
+        """
+        member_count = db.select(db.func.count(Member.id)).where(Member.group_id == cls.id) \
+            .correlate(cls).scalar_subquery()
+        bill_count = db.select(db.func.count(Bill.id)).where(Bill.group_id == cls.id) \
+            .correlate(cls).scalar_subquery()
+        total_spend = db.select(db.func.coalesce(db.func.sum(Product.price), 0.0)) \
+            .join(Bill, Bill.id == Product.bill_id).where(Bill.group_id == cls.id) \
+            .correlate(cls).scalar_subquery()
+        # updated_at is bumped by every write to the group's bills, products and members
+        last_activity = db.func.coalesce(cls.updated_at, cls.created_at)
+        return db.session.query(
+            cls,
+            member_count.label('member_count'),
+            bill_count.label('bill_count'),
+            total_spend.label('total_spend'),
+            last_activity.label('last_activity'),
+        ).filter(cls.user_id == user_id).order_by(last_activity.desc(), cls.id.desc())
+    
+    def load_bill_contents(self):
+        """Load the group's members and every bill's products and shares in four queries.
+        
+        Walking them lazily would run one query per bill and per product.
+        """
+        Group.query.filter_by(id=self.id).options(selectinload(Group.members),
+                                                  bill_contents(Group.bills)).one()
+    
     def get_total_expenses(self):
         """Get total expenses for this group"""
         total = 0
@@ -197,9 +572,9 @@ class Group(db.Model):
         """Get expenses for a specific member in this group"""
         member_total = 0
         for bill in self.bills:
-            member_summary = bill.get_member_summary()
-            if member_id in member_summary:
-                member_total += member_summary[member_id]['owes']
+            data = bill.get_member_summary(sparse=True).get(member_id)
+            if data is not None:
+                member_total += data.owes
         return member_total
     
     def get_top_categories(self, limit=5):
@@ -213,6 +588,139 @@ class Group(db.Model):
             return 0
         total = self.get_total_expenses()
         return total / len(self.bills)
+    
+    # Sections of the JSON summary that callers can select
+    SUMMARY_FIELDS = ('members', 'balances', 'transfers', 'bills')
+    
+    def to_summary_dict(self, fields=None):
+        """Compact group-wide balances and transfers across all bills for the JSON API"""
+        fields = set(fields or self.SUMMARY_FIELDS)
+        
+        members = {member.id: member for member in self.members}
+        totals = {member.id: [0, 0] for member in self.members}
+        bills = []
+        for bill in self.bills:
+            # Members outside a bill add nothing to the totals, so skip them
+            member_summary = bill.get_member_summary(sparse=True)
+            for member_id, data in member_summary.items():
+                # Settled bills may still reference members removed since
+                members.setdefault(member_id, data.member)
+                paid_owes = totals.setdefault(member_id, [0, 0])
+                paid_owes[0] += data.paid
+                paid_owes[1] += data.owes
+            if 'bills' in fields:
+                bills.append({'id': bill.id, 'title': bill.title,
+                              'date': bill.date.isoformat() if bill.date else None,
+                              'category': bill.category, 'total': round(bill.get_total_amount(), 2),
+                              'settled': bill.is_settled})
+        
+        nets = {member_id: round(paid - owes, 2) for member_id, (paid, owes) in totals.items()}
+        payload = {'group': {'id': self.id, 'name': self.name, 'version': self.version}}
+        if 'members' in fields:
+            payload['members'] = {
+                member_id: {'name': member.name, 'email': member.email, 'mobile_number': member.mobile_number}
+                for member_id, member in members.items()
+            }
+        if 'balances' in fields:
+            payload['balances'] = [
+                {'member': member_id, 'paid': round(paid, 2), 'owes': round(owes, 2), 'net': nets[member_id]}
+                for member_id, (paid, owes) in totals.items()
+            ]
+        if 'transfers' in fields:
+            payload['transfers'] = [
+                {'from': debtor_id, 'to': creditor_id, 'amount': amount}
+                for debtor_id, creditor_id, amount in pair_debts(nets.items())
+            ]
+        if 'bills' in fields:
+            payload['bills'] = bills
+        return payload
+    
+    def compute_rollup(self):
+        """Calculate the group's derived totals, category and monthly rollups and member balances"""
+        total = 0
+        categories = {}
+        monthly = {}
+        balances = {}
+        for bill in self.bills:
+            amount = bill.get_total_amount()
+            total += amount
+            categories[bill.category] = categories.get(bill.category, 0) + amount
+            month_key = f"{bill.date.year}-{bill.date.month:02d}"
+            monthly[month_key] = monthly.get(month_key, 0) + amount
+            for member_id, data in bill.get_member_summary(sparse=True).items():
+                paid_owes = balances.setdefault(member_id, [0, 0])
+                paid_owes[0] += data.paid
+                paid_owes[1] += data.owes
+        
+        return {
+            'total': round(total, 2),
+            'bill_count': len(self.bills),
+            'categories': json.dumps(categories, separators=(',', ':')),
+            'monthly': json.dumps(monthly, separators=(',', ':')),
+            'balances': json.dumps({member_id: [round(paid, 2), round(owes, 2)]
+                                    for member_id, (paid, owes) in balances.items()}, separators=(',', ':')),
+        }
+    
+    def refresh_rollup(self):
+        """Recompute and store the group's rollup; the caller commits"""
+        values = self.compute_rollup()
+        values.update(user_id=self.user_id, group_version=self.version,
+                      logic_version=ROLLUP_VERSION, computed_at=datetime.utcnow())
+        if self.rollup is None:
+            self.rollup = GroupRollup(**values)
+        else:
+            for name, value in values.items():
+                setattr(self.rollup, name, value)
+        return self.rollup
+    
+    def get_rollup(self):
+        """Return the group's rollup, recomputing it if the group changed since; the caller commits"""
+        if self.rollup is not None and self.rollup.is_current(self):
+            return self.rollup
+        self.load_bill_contents()
+        return self.refresh_rollup()
+
+class GroupRollup(db.Model):
+    """Derived totals of a group, stored so analytics need not walk every bill and product"""
+    __tablename__ = 'group_rollups'
+    group_id = db.Column(db.Integer, db.ForeignKey('groups.id', ondelete='CASCADE'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    # Group.version and ROLLUP_VERSION the rollup was computed from
+    group_version = db.Column(db.Integer, nullable=False)
+    logic_version = db.Column(db.Integer, nullable=False)
+    total = db.Column(db.Float, nullable=False, default=0)
+    bill_count = db.Column(db.Integer, nullable=False, default=0)
+    categories = db.Column(db.Text, nullable=False, default='{}')  # JSON {category: amount}
+    monthly = db.Column(db.Text, nullable=False, default='{}')  # JSON {"YYYY-MM": amount}
+    balances = db.Column(db.Text, nullable=False, default='{}')  # JSON {member_id: [paid, owes]}
+    computed_at = db.Column(db.DateTime)
+    
+    # Relationships
+    group = db.relationship('Group', back_populates='rollup')
+    
+    def __repr__(self):
+        return f'<GroupRollup {self.group_id} v{self.group_version}>'
+    
+    def is_current(self, group):
+        return self.group_version == group.version and self.logic_version == ROLLUP_VERSION
+    
+    def get_categories(self):
+        return json.loads(self.categories)
+    
+    def get_monthly_expenses(self, year):
+        """Monthly totals for one year, keyed like Group.get_monthly_expenses()"""
+        prefix = f"{year}-"
+        return {key: amount for key, amount in json.loads(self.monthly).items() if key.startswith(prefix)}
+    
+    def get_top_categories(self, limit=5):
+        return sorted(self.get_categories().items(), key=lambda x: x[1], reverse=True)[:limit]
+    
+    def get_average_bill_amount(self):
+        return self.total / self.bill_count if self.bill_count else 0
+    
+    def get_balances(self):
+        """Member id -> (paid, owes) across the group's bills"""
+        return {int(member_id): tuple(paid_owes) for member_id, paid_owes in json.loads(self.balances).items()}
 
 class Member(db.Model):
     __tablename__ = 'members'
@@ -220,16 +728,29 @@ class Member(db.Model):
     name = db.Column(db.String(100), nullable=False)
     email = db.Column(db.String(120))
     mobile_number = db.Column(db.String(20), nullable=False)
-    group_id = db.Column(db.Integer, db.ForeignKey('groups.id'), nullable=False)
+    group_id = db.Column(db.Integer, db.ForeignKey('groups.id', ondelete='CASCADE'), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
     group = db.relationship('Group', back_populates='members')
-    paid_products = db.relationship('Product', back_populates='payer')
-    products_involved = db.relationship('ProductMember', back_populates='member', cascade='all, delete-orphan')
+    paid_products = db.relationship('Product', back_populates='payer', passive_deletes=True)
+    products_involved = db.relationship('ProductMember', back_populates='member', cascade='all, delete-orphan', passive_deletes=True)
     
     def __repr__(self):
         return f'<Member {self.name} in Group {self.group_id}>'
+    
+    def paid_product_count(self):
+        """Number of products this member paid for"""
+        return Product.query.filter_by(payer_id=self.id).count()
+    
+    def delete_cascade(self):
+        """Delete the member and their shares; the caller commits.
+
+        Products keep their payer (the key is ON DELETE RESTRICT), so the
+        products this member paid for must be given another payer first.
+        """
+        ProductMember.query.filter_by(member_id=self.id).delete(synchronize_session=False)
+        Member.query.filter_by(id=self.id).delete(synchronize_session=False)
 
 class Bill(db.Model):
     __tablename__ = 'bills'
@@ -238,133 +759,377 @@ class Bill(db.Model):
     description = db.Column(db.String(255))
     date = db.Column(db.Date, default=datetime.utcnow().date)
     category = db.Column(db.String(50), default='Other')
-    group_id = db.Column(db.Integer, db.ForeignKey('groups.id'), nullable=False)
+    group_id = db.Column(db.Integer, db.ForeignKey('groups.id', ondelete='CASCADE'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Content version, bumped whenever the bill's products or the group's members change
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Frozen summary and settlement of a settled bill (compact JSON, see settle())
+    settled_at = db.Column(db.DateTime)
+    summary_snapshot = db.Column(db.Text)
+    
+    # Serves the group page's bill table, newest first, one page at a time
+    __table_args__ = (db.Index('ix_bills_group_date', 'group_id', 'date', 'id'),)
     
     # Relationships
     group = db.relationship('Group', back_populates='bills')
-    products = db.relationship('Product', back_populates='bill', cascade='all, delete-orphan')
+    products = db.relationship('Product', back_populates='bill', cascade='all, delete-orphan', passive_deletes=True)
+    
+    # Sections of the JSON summary that callers can select
+    SUMMARY_FIELDS = ('members', 'balances', 'transfers', 'products', 'breakdown')
     
     def __repr__(self):
         return f'<BillTemplate {self.name}>'
     
+    def bump_version(self):
+        """Mark the bill's content (and its group) as changed"""
+        Bill.query.filter_by(id=self.id).update({Bill.version: Bill.version + 1})
+        self.group.bump_version()
+    
+    def delete_cascade(self):
+        """Delete the bill with its products and shares, one DELETE per table; the caller commits"""
+        product_ids = db.select(Product.id).where(Product.bill_id == self.id)
+        ProductMember.query.filter(ProductMember.product_id.in_(product_ids)).delete(synchronize_session=False)
+        Product.query.filter_by(bill_id=self.id).delete(synchronize_session=False)
+        Bill.query.filter_by(id=self.id).delete(synchronize_session=False)
+    
+    def used_member_ids(self):
+        """Ids of the members who paid for or share any of the bill's products"""
+        payers = db.select(Product.payer_id).where(Product.bill_id == self.id)
+        shares = db.select(ProductMember.member_id).join(Product, ProductMember.product_id == Product.id) \
+            .where(Product.bill_id == self.id)
+        return set(db.session.scalars(db.union(payers, shares)))
+    
+    def duplicate(self, group_id=None, member_map=None, title=None, date=None):
+        """Copy the bill, unsettled, with its products and members involved; return the copy.
+
+        Products and their members are copied by INSERT ... SELECT statements,
+        without loading them. When copying into another group, member_map maps
+        every member in used_member_ids() to one of that group's members. The
+        caller commits.
+        """
+        if member_map is not None:
+            missing = self.used_member_ids() - set(member_map)
+            if missing:
+                raise ValueError(f'{len(missing)} member(s) of the bill have no counterpart in the target group')
+        copy = Bill(title=title or self.title, description=self.description, date=date or self.date,
+                    category=self.category, group_id=group_id or self.group_id)
+        db.session.add(copy)
+        db.session.flush()
+        
+        def member(column):
+            return db.case(member_map, value=column) if member_map else column
+        
+        products = db.select(Product.name, Product.price, db.literal(copy.id), member(Product.payer_id),
+                             db.literal(datetime.utcnow())).where(Product.bill_id == self.id).order_by(Product.id)
+        db.session.execute(db.insert(Product).from_select(['name', 'price', 'bill_id', 'payer_id', 'created_at'], products))
+        
+        # Ids are assigned in the order of the SELECT, so the nth product of the copy is
+        # the copy of the nth product of the original
+        def ranked(bill_id):
+            return db.select(Product.id, db.func.row_number().over(order_by=Product.id).label('position')) \
+                .where(Product.bill_id == bill_id).subquery()
+        original = ranked(self.id)
+        first, last, count = db.session.query(db.func.min(Product.id), db.func.max(Product.id), db.func.count(Product.id)) \
+            .filter(Product.bill_id == copy.id).one()
+        if not count:
+            return copy
+        if last - first + 1 == count:
+            # The copies got consecutive ids (always so on SQLite), so the nth one is first + n - 1
+            shares = db.select(original.c.position + (first - 1), member(ProductMember.member_id))
+        else:
+            # Ids interleaved with another writer's; pair the products up by position instead
+            copied = ranked(copy.id)
+            shares = db.select(copied.c.id, member(ProductMember.member_id)) \
+                .join(copied, copied.c.position == original.c.position)
+        shares = shares.distinct().select_from(original).join(ProductMember, ProductMember.product_id == original.c.id)
+        db.session.execute(db.insert(ProductMember).from_select(['product_id', 'member_id'], shares))
+        return copy
+    
+    def bulk_edit_products(self, product_ids, payer_id=None, member_ids=None, mode='replace'):
+        """Reassign the payer and/or members involved of several of the bill's products; return how many were edited.
+
+        ``mode`` says what member_ids do to each product's members: ``replace``
+        them, ``add`` to them or ``remove`` from them. Raises ValueError, before
+        writing anything, if a product would be left with no members. The
+        caller commits.
+        """
+        product_ids = [product_id for product_id, in db.session.query(Product.id)
+                       .filter(Product.bill_id == self.id, Product.id.in_(product_ids))]
+        if not product_ids:
+            return 0
+        if member_ids is not None:
+            current = set(db.session.query(ProductMember.product_id, ProductMember.member_id)
+                          .filter(ProductMember.product_id.in_(product_ids)))
+            given = {(product_id, member_id) for product_id in product_ids for member_id in member_ids}
+            if mode == 'add':
+                wanted = current | given
+            elif mode == 'remove':
+                wanted = current - given
+            elif mode == 'replace':
+                wanted = given
+            else:
+                raise ValueError(f"Unknown mode '{mode}'")
+            if len({product_id for product_id, _ in wanted}) < len(product_ids):
+                raise ValueError('Every product needs at least one member involved')
+            ProductMember.sync(current, wanted)
+        if payer_id is not None:
+            Product.query.filter(Product.id.in_(product_ids)).update({Product.payer_id: payer_id}, synchronize_session=False)
+        self.bump_version()
+        return len(product_ids)
+    
+    @property
+    def is_settled(self):
+        """Whether the bill has been closed and its summary frozen"""
+        return self.summary_snapshot is not None
+    
+    def settle(self):
+        """Close the bill, storing its computed summary and settlement as a snapshot.
+        
+        The snapshot refers to members and products by id, each listed once:
+        ``m`` members, ``p`` products with payer and participant ids, ``s`` per-member
+        totals, ``t`` settlement transfers and ``tot`` the bill total.
+        """
+        member_summary = self.get_member_summary()
+        settlement = self.get_settlement_summary(member_summary)
+        snapshot = {
+            'm': [[data.member.id, data.member.name, data.member.email, data.member.mobile_number]
+                  for data in member_summary.values()],
+            'p': [[product.id, product.name, product.price, product.payer_id,
+                   [pm.member_id for pm in product.members_involved]]
+                  for product in self.products],
+            's': [[member_id, data.paid, data.owes, data.net]
+                  for member_id, data in member_summary.items()],
+            't': [[t['from_member'].id, t['to_member'].id, t['amount'], [p.id for p in t['shared_products']]]
+                  for t in settlement],
+            'tot': self.get_total_amount(),
+        }
+        self.summary_snapshot = json.dumps(snapshot, separators=(',', ':'))
+        self.settled_at = datetime.utcnow()
+        self.bump_version()
+    
+    def reopen(self):
+        """Reopen a settled bill, discarding its snapshot"""
+        self.summary_snapshot = None
+        self.settled_at = None
+        self.bump_version()
+    
+    def _load_snapshot(self):
+        """Expand the stored snapshot into (member_summary, settlement, total)"""
+        cached = getattr(self, '_snapshot_cache', None)
+        if cached is not None and cached[0] is self.summary_snapshot:
+            return cached[1]
+        
+        data = json.loads(self.summary_snapshot)
+        members = {row[0]: SnapshotMember(*row) for row in data['m']}
+        summary = {member_id: MemberSummary(members[member_id], paid, owes, net)
+                   for member_id, paid, owes, net in data['s']}
+        
+        products = {}
+        for product_id, name, price, payer_id, involved_members in data['p']:
+            payer = members.get(payer_id)
+            product = SnapshotProduct(product_id, name, price, payer_id, payer,
+                                      payer.name if payer else 'Unknown', len(involved_members))
+            products[product_id] = product
+            summary[payer_id].paid_products.append(product)
+            if involved_members:
+                share_per_member = round(price / len(involved_members), 2)
+                involved_members = tuple(involved_members)
+                for member_id in involved_members:
+                    summary[member_id].add_share(product, share_per_member, involved_members)
+        
+        settlement = [{
+            'from_member': members[debtor_id],
+            'to_member': members[creditor_id],
+            'amount': amount,
+            'shared_products': [products[product_id] for product_id in product_ids],
+            'debtor_total_owed': summary[debtor_id].owes,
+            'creditor_total_paid': summary[creditor_id].paid,
+            'transaction_id': f"T-{debtor_id}-{creditor_id}"
+        } for debtor_id, creditor_id, amount, product_ids in data['t']]
+        
+        result = (summary, settlement, data['tot'])
+        self._snapshot_cache = (self.summary_snapshot, result)
+        return result
+    
+    def load_contents(self):
+        """Load the bill's products, their shares and the group's members in three queries.
+        
+        Walking them lazily would run one query per product.
+        """
+        Bill.query.filter_by(id=self.id).options(bill_contents()).one()
+        Group.query.filter_by(id=self.group_id).options(selectinload(Group.members)).one()
+    
     def get_total_amount(self):
+        if self.is_settled:
+            return self._load_snapshot()[2]
         return sum(product.price for product in self.products)
     
-    def get_member_summary(self):
-        """Calculate what each member owes or is owed with detailed breakdown"""
-        summary = {}
+    def to_summary_dict(self, fields=None):
+        """Compact summary for the JSON API; members and products are referenced by id"""
+        fields = set(fields or self.SUMMARY_FIELDS)
+        member_summary = self.get_member_summary()
         
-        # Initialize summary for each member in the group
-        for member in self.group.members:
-            summary[member.id] = {
-                'member': member,
-                'paid': 0,  # Total amount paid by this member
-                'owes': 0,  # Total amount this member owes
-                'products': [],  # Products this member is involved in
-                'net': 0,  # Net amount (positive means others owe this member)
-                'paid_products': [],  # Products paid by this member
-                'shared_products': []  # Products shared by this member
+        payload = {
+            'bill': {
+                'id': self.id,
+                'title': self.title,
+                'date': self.date.isoformat() if self.date else None,
+                'category': self.category,
+                'total': round(self.get_total_amount(), 2),
+                'settled': self.is_settled,
+                'version': self.version
+            }
+        }
+        if 'members' in fields:
+            payload['members'] = {
+                member_id: {'name': data.member.name, 'email': data.member.email,
+                            'mobile_number': data.member.mobile_number}
+                for member_id, data in member_summary.items()
+            }
+        if 'balances' in fields:
+            payload['balances'] = [
+                {'member': member_id, 'paid': data.paid, 'owes': data.owes, 'net': data.net}
+                for member_id, data in member_summary.items()
+            ]
+        if 'transfers' in fields:
+            payload['transfers'] = [
+                {'from': t['from_member'].id, 'to': t['to_member'].id, 'amount': t['amount'],
+                 'products': [p.id for p in t['shared_products']]}
+                for t in self.get_settlement_summary(member_summary)
+            ]
+        if 'products' in fields:
+            # Built from the summary so settled bills are served from their snapshot
+            participants = {}
+            for member_id, data in member_summary.items():
+                for product in data.shared_products:
+                    participants.setdefault(product.id, []).append(member_id)
+            payload['products'] = [
+                {'id': p.id, 'name': p.name, 'price': p.price, 'payer': p.payer_id,
+                 'members': participants.get(p.id, [])}
+                for data in member_summary.values() for p in data.paid_products
+            ]
+        if 'breakdown' in fields:
+            payload['breakdown'] = {
+                member_id: [[entry.product.id, entry.share] for entry in data.products]
+                for member_id, data in member_summary.items()
             }
+        return payload
+    
+    def get_js_member_summary(self, member_summary=None):
+        """Build a JSON-serializable version of the member summary for JavaScript"""
+        if member_summary is None:
+            member_summary = self.get_member_summary()
+        
+        js_member_summary = {}
+        for member_id, data in member_summary.items():
+            js_member_summary[member_id] = {
+                'member': {
+                    'id': data.member.id,
+                    'name': data.member.name,
+                    'email': data.member.email,
+                    'mobile_number': data.member.mobile_number
+                },
+                'paid': data.paid,
+                'owes': data.owes,
+                'net': data.net,
+                'paid_products': [{
+                    'id': p.id,
+                    'name': p.name,
+                    'price': p.price,
+                    'members_count': p.members_count
+                } for p in data.paid_products],
+                'shared_products': [{
+                    'id': p.id,
+                    'name': p.name,
+                    'price': p.price,
+                    'members_count': p.members_count,
+                    'payer_name': p.payer_name
+                } for p in data.shared_products]
+            }
+        return js_member_summary
+    
+    def get_member_summary(self, sparse=False):
+        """Calculate what each member owes or is owed with detailed breakdown.
+        
+        With ``sparse`` only members who paid for or share a product are listed,
+        still in group order; the others would all have zero balances.
+        """
+        if self.is_settled:
+            summary = self._load_snapshot()[0]
+            if sparse:
+                return {member_id: data for member_id, data in summary.items() if data.participates}
+            return summary
+        
+        # Participant ids are read once per product and shared by all its participants
+        products = [(product, tuple(pm.member_id for pm in product.members_involved))
+                    for product in self.products]
+        
+        members = self.group.members
+        if sparse:
+            participants = {product.payer_id for product, _ in products}
+            for _, involved_members in products:
+                participants.update(involved_members)
+            members = [member for member in members if member.id in participants]
+        
+        # Initialize summary for each member in the group
+        summary = {member.id: MemberSummary(member) for member in members}
         
         # Calculate amounts for each product
-        for product in self.products:
+        for product, involved_members in products:
             # Add to payer's paid amount
-            payer_id = product.payer_id
-            summary[payer_id]['paid'] += product.price
-            summary[payer_id]['paid_products'].append(product)
+            payer = summary[product.payer_id]
+            payer.paid += product.price
+            payer.paid_products.append(product)
             
             # Calculate each member's share for this product
-            involved_members = [pm.member_id for pm in product.members_involved]
             if involved_members:
                 share_per_member = round(product.price / len(involved_members), 2)
                 
                 # Add share to each involved member's owed amount
                 for member_id in involved_members:
-                    summary[member_id]['owes'] += share_per_member
-                    summary[member_id]['shared_products'].append(product)
-                    
-                    # Add product details to member's products list
-                    other_members = [m for m in involved_members if m != member_id]
-                    summary[member_id]['products'].append({
-                        'product': product,
-                        'share': share_per_member,
-                        'shared_with': other_members,
-                        'payer': product.payer,
-                        'is_payer': member_id == payer_id
-                    })
+                    data = summary[member_id]
+                    data.owes += share_per_member
+                    data.add_share(product, share_per_member, involved_members)
         
         # Calculate net amount for each member
-        for member_id, data in summary.items():
-            data['net'] = round(data['paid'] - data['owes'], 2)
-            data['paid'] = round(data['paid'], 2)
-            data['owes'] = round(data['owes'], 2)
+        for data in summary.values():
+            data.net = round(data.paid - data.owes, 2)
+            data.paid = round(data.paid, 2)
+            data.owes = round(data.owes, 2)
         
         return summary
     
-    def get_settlement_summary(self):
+    def get_settlement_summary(self, member_summary=None):
         """Generate a list of transactions to settle all debts with detailed information"""
-        member_summary = self.get_member_summary()
-        
-        # Extract members with positive and negative balances
-        creditors = []
-        debtors = []
+        if self.is_settled:
+            return self._load_snapshot()[1]
         
-        for member_id, data in member_summary.items():
-            if data['net'] > 0:
-                creditors.append((member_id, data['net']))
-            elif data['net'] < 0:
-                debtors.append((member_id, abs(data['net'])))
+        if member_summary is None:
+            # Members with zero balances never appear in a transfer
+            member_summary = self.get_member_summary(sparse=True)
         
-        # Sort by amount (descending)
-        creditors.sort(key=lambda x: x[1], reverse=True)
-        debtors.sort(key=lambda x: x[1], reverse=True)
+        # Pair debtors with creditors, largest balances first
+        balances = [(member_id, data.net) for member_id, data in member_summary.items()]
         
         # Generate settlement transactions
         transactions = []
         
-        i, j = 0, 0
-        while i < len(debtors) and j < len(creditors):
-            debtor_id, debt = debtors[i]
-            creditor_id, credit = creditors[j]
-            
-            # Calculate transaction amount
-            amount = min(debt, credit)
-            
+        for debtor_id, creditor_id, amount in pair_debts(balances):
             # Get the members involved
-            debtor = member_summary[debtor_id]['member']
-            creditor = member_summary[creditor_id]['member']
-            
-            # Find shared products between these members
-            shared_products = []
-            for product in self.products:
-                debtor_involved = any(pm.member_id == debtor_id for pm in product.members_involved)
-                creditor_involved = any(pm.member_id == creditor_id for pm in product.members_involved)
-                creditor_paid = product.payer_id == creditor_id
-                
-                if debtor_involved and creditor_paid:
-                    shared_products.append(product)
+            debtor = member_summary[debtor_id]
+            creditor = member_summary[creditor_id]
             
-            # Create transaction with detailed information
+            # Create transaction with detailed information; the shared products are
+            # the debtor's shares that the creditor paid for, in bill order
             transactions.append({
-                'from_member': debtor,
-                'to_member': creditor,
-                'amount': round(amount, 2),
-                'shared_products': shared_products,
-                'debtor_total_owed': member_summary[debtor_id]['owes'],
-                'creditor_total_paid': member_summary[creditor_id]['paid'],
+                'from_member': debtor.member,
+                'to_member': creditor.member,
+                'amount': amount,
+                'shared_products': debtor.products_paid_by(creditor_id),
+                'debtor_total_owed': debtor.owes,
+                'creditor_total_paid': creditor.paid,
                 'transaction_id': f"T-{debtor_id}-{creditor_id}"
             })
-            
-            # Update remaining amounts
-            debtors[i] = (debtor_id, debt - amount)
-            creditors[j] = (creditor_id, credit - amount)
-            
-            # Move to next member if their balance is settled
-            if debtors[i][1] < 0.01:  # Using small threshold to handle floating point errors
-                i += 1
-            if creditors[j][1] < 0.01:
-                j += 1
         
         return transactions
 
@@ -375,20 +1140,20 @@ class BillTemplate(db.Model):
     title = db.Column(db.String(100), nullable=False)
     description = db.Column(db.String(255))
     category = db.Column(db.String(50), default='Other')
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
     user = db.relationship('User', back_populates='bill_templates')
-    template_products = db.relationship('TemplateProduct', back_populates='bill_template', cascade='all, delete-orphan')
+    template_products = db.relationship('TemplateProduct', back_populates='bill_template', cascade='all, delete-orphan', passive_deletes=True)
 
 class TemplateProduct(db.Model):
     __tablename__ = 'template_products'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     price = db.Column(db.Float, nullable=False)
-    bill_template_id = db.Column(db.Integer, db.ForeignKey('bill_templates.id'), nullable=False)
+    bill_template_id = db.Column(db.Integer, db.ForeignKey('bill_templates.id', ondelete='CASCADE'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
@@ -522,14 +1287,14 @@ class Product(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     price = db.Column(db.Float, nullable=False)
-    bill_id = db.Column(db.Integer, db.ForeignKey('bills.id'), nullable=False)
-    payer_id = db.Column(db.Integer, db.ForeignKey('members.id'), nullable=False)
+    bill_id = db.Column(db.Integer, db.ForeignKey('bills.id', ondelete='CASCADE'), nullable=False, index=True)
+    payer_id = db.Column(db.Integer, db.ForeignKey('members.id', ondelete='RESTRICT'), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
     bill = db.relationship('Bill', back_populates='products')
     payer = db.relationship('Member', back_populates='paid_products')
-    members_involved = db.relationship('ProductMember', back_populates='product', cascade='all, delete-orphan')
+    members_involved = db.relationship('ProductMember', back_populates='product', cascade='all, delete-orphan', passive_deletes=True)
     
     def __repr__(self):
         return f'<Product {self.name} in Bill {self.id}>'
@@ -543,6 +1308,22 @@ class Product(db.Model):
     def payer_name(self):
         """Get the name of the member who paid for this product"""
         return self.payer.name if self.payer else 'Unknown'
+    
+    def set_members(self, member_ids):
+        """Make member_ids the members involved, writing only the added and removed ones; the caller commits"""
+        current = {(self.id, pm.member_id) for pm in self.members_involved}
+        return ProductMember.sync(current, {(self.id, member_id) for member_id in member_ids})
+
+def bill_contents(*path):
+    """Loader option reading bills' products and the products' shares with one query each.
+    
+    ``path`` leads from the queried model to its bills, e.g. ``bill_contents(Group.bills)``;
+    a Bill query needs none.
+    """
+    option = None
+    for attribute in path + (Bill.products, Product.members_involved):
+        option = selectinload(attribute) if option is None else option.selectinload(attribute)
+    return option
 
 class Currency(db.Model):
     __tablename__ = 'currencies'
@@ -607,7 +1388,7 @@ class Currency(db.Model):
 class UserCurrency(db.Model):
     __tablename__ = 'user_currencies'
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     currency_id = db.Column(db.Integer, db.ForeignKey('currencies.id'), nullable=False)
     is_default = db.Column(db.Boolean, default=False)
     is_active = db.Column(db.Boolean, default=True)
@@ -623,7 +1404,7 @@ class UserCurrency(db.Model):
         return f'<UserCurrency User:{self.user_id} Currency:{self.currency_id} Default:{self.is_default}>'
 
 # Add currency relationship to User model
-User.currencies = db.relationship('UserCurrency', back_populates='user', cascade='all, delete-orphan')
+User.currencies = db.relationship('UserCurrency', back_populates='user', cascade='all, delete-orphan', passive_deletes=True)
 
 def populate_initial_currencies():
     """Populate the database with common currencies"""
@@ -656,4 +1437,106 @@ def populate_initial_currencies():
             currency = Currency(**currency_data)
             db.session.add(currency)
     
-    db.session.commit()
\ No newline at end of file
+    db.session.commit()
+
+
+class Job(db.Model):
+    """A background job, such as a large export, run outside the request thread"""
+    __tablename__ = 'jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    kind = db.Column(db.String(50), nullable=False)
+    params = db.Column(db.Text, nullable=False, default='{}')  # JSON arguments for the job handler
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)
+    progress = db.Column(db.Integer, nullable=False, default=0)  # Percent complete
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    result_path = db.Column(db.String(255))
+    result_name = db.Column(db.String(255))  # File name offered on download
+    result_mimetype = db.Column(db.String(100))
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    # Refreshed while the job runs; a running job that stops heartbeating is requeued
+    heartbeat_at = db.Column(db.DateTime)
+    
+    # Job states
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    ACTIVE_STATES = (QUEUED, RUNNING)
+    
+    user = db.relationship('User')
+    
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} {self.status}>'
+    
+    @property
+    def is_finished(self):
+        """Whether the job has stopped for good"""
+        return self.status not in self.ACTIVE_STATES
+    
+    def get_params(self):
+        return json.loads(self.params or '{}')
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': self.progress,
+            'cancel_requested': self.cancel_requested,
+            'result_name': self.result_name,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+class Activity(db.Model):
+    """Append-only log of what a user added, shown on the dashboard"""
+    __tablename__ = 'activities'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    type = db.Column(db.String(20), nullable=False)  # group_created, group_merged, member_added, bill_added or product_added
+    description = db.Column(db.String(255), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    # The dashboard reads, and pruning walks, one user's entries newest first
+    __table_args__ = (db.Index('ix_activities_user_created', 'user_id', 'created_at'),)
+    
+    @classmethod
+    def record(cls, user_id, type, description):
+        """Add an entry to the current transaction"""
+        entry = cls(user_id=user_id, type=type, description=description[:255])
+        db.session.add(entry)
+        return entry
+    
+    @classmethod
+    def prune(cls, user_id, keep, batch_size=1000):
+        """Delete all but the newest ``keep`` entries of a user, batch_size rows per statement; return the count.
+
+        The caller commits.
+        """
+        cutoff = db.session.query(cls.created_at, cls.id).filter_by(user_id=user_id) \
+            .order_by(cls.created_at.desc(), cls.id.desc()).offset(keep).limit(1).first()
+        if cutoff is None:
+            return 0
+        older = db.or_(cls.created_at < cutoff.created_at,
+                       db.and_(cls.created_at == cutoff.created_at, cls.id <= cutoff.id))
+        deleted = 0
+        while True:
+            ids = db.session.query(cls.id).filter(cls.user_id == user_id, older).limit(batch_size).subquery()
+            count = cls.query.filter(cls.id.in_(db.select(ids.c.id))).delete(synchronize_session=False)
+            deleted += count
+            if count < batch_size:
+                return deleted
+    
+    @classmethod
+    def users_over(cls, keep):
+        """Ids of the users with more than ``keep`` entries"""
+        return [user_id for user_id, in db.session.query(cls.user_id).group_by(cls.user_id)
+                .having(db.func.count(cls.id) > keep).order_by(cls.user_id)]
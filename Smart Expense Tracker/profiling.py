@@ -0,0 +1,163 @@
+import cProfile
+import hmac
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Header that carries PROFILING_TOKEN
+HEADER = 'HTTP_X_PROFILE_TOKEN'
+
+PROFILE_SUFFIXES = ('.pstats', '.collapsed')
+
+
+class StackSampler:
+    """Samples one thread's stack on a timer and counts identical stacks"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        """Return the samples as collapsed stacks, one "frame;frame;frame count" line each"""
+        return ''.join(f'{stack} {count}\n' for stack, count in sorted(self.stacks.items()))
+
+
+class RequestProfiler:
+    """WSGI middleware that profiles the requests carrying the profiling token.
+
+    A flagged request runs under cProfile while a sampler thread records its
+    stack every ``sample_interval`` seconds. The results are written to
+    ``path`` as a .pstats file and a flame-graph-ready .collapsed file, whose
+    shared name is returned in the X-Profile-Id header. The oldest files are
+    removed once the directory grows past ``max_bytes``.
+    """
+
+    def __init__(self, wsgi_app, token, path, max_bytes=100 * 1024 * 1024, sample_interval=0.001):
+        self.wsgi_app = wsgi_app
+        self.token = token
+        self.path = path
+        self.max_bytes = max_bytes
+        self.sample_interval = sample_interval
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def __call__(self, environ, start_response):
+        if not self._requested(environ):
+            return self.wsgi_app(environ, start_response)
+
+        name = self._profile_name(environ)
+
+        def start_profiled_response(status, headers, exc_info=None):
+            return start_response(status, headers + [('X-Profile-Id', name)], exc_info)
+
+        def run():
+            body = self.wsgi_app(environ, start_profiled_response)
+            try:
+                # Buffer the body so producing it is profiled too
+                return list(body)
+            finally:
+                # Releases files opened by send_file and runs request teardown
+                if hasattr(body, 'close'):
+                    body.close()
+
+        profiler = cProfile.Profile()
+        sampler = StackSampler(threading.get_ident(), self.sample_interval)
+        sampler.start()
+        started = time.perf_counter()
+        try:
+            result = profiler.runcall(run)
+        finally:
+            elapsed = time.perf_counter() - started
+            sampler.stop()
+            self._save(name, profiler, sampler)
+            logger.info('Profiled %s %s in %.0f ms as %s', environ.get('REQUEST_METHOD'),
+                        environ.get('PATH_INFO'), elapsed * 1000, name)
+        return result
+
+    def _requested(self, environ):
+        supplied = environ.get(HEADER)
+        if supplied is None:
+            return False
+        return hmac.compare_digest(supplied.encode(), self.token.encode())
+
+    @staticmethod
+    def _profile_name(environ):
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', environ.get('PATH_INFO', '')).strip('_') or 'root'
+        stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')
+        return f"{stamp}-{environ.get('REQUEST_METHOD', 'GET')}-{slug[:80]}"
+
+    def _save(self, name, profiler, sampler):
+        base = os.path.join(self.path, name)
+        profiler.dump_stats(base + '.pstats')
+        with open(base + '.collapsed', 'w') as f:
+            f.write(sampler.collapsed())
+        with self._lock:
+            self._rotate()
+
+    def _rotate(self):
+        """Remove the oldest profiles until the directory fits in max_bytes"""
+        profiles = {}  # name -> [newest mtime, total size, paths]
+        for entry in os.scandir(self.path):
+            name, suffix = os.path.splitext(entry.name)
+            if entry.is_file() and suffix in PROFILE_SUFFIXES:
+                stat = entry.stat()
+                profile = profiles.setdefault(name, [0, 0, []])
+                profile[0] = max(profile[0], stat.st_mtime)
+                profile[1] += stat.st_size
+                profile[2].append(entry.path)
+        total = sum(size for _, size, _ in profiles.values())
+        for _, size, paths in sorted(profiles.values()):
+            if total <= self.max_bytes:
+                break
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+
+
+def init_profiler(app):
+    """Wrap the app in a RequestProfiler when PROFILING_ENABLED is on; otherwise leave it untouched"""
+    if not app.config.get('PROFILING_ENABLED'):
+        return None
+    token = app.config.get('PROFILING_TOKEN')
+    if not token:
+        raise ValueError('PROFILING_TOKEN must be set when PROFILING_ENABLED is on')
+    profiler = RequestProfiler(
+        app.wsgi_app,
+        token,
+        app.config.get('PROFILING_PATH') or os.path.join(app.instance_path, 'profiles'),
+        max_bytes=app.config.get('PROFILING_MAX_BYTES', 100 * 1024 * 1024),
+        sample_interval=app.config.get('PROFILING_SAMPLE_INTERVAL_MS', 1) / 1000.0,
+    )
+    app.wsgi_app = profiler
+    return profiler
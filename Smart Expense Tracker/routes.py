@@ -1,48 +1,70 @@
-from flask import render_template, redirect, url_for, flash, request, jsonify, send_file
+from flask import Blueprint, Response, current_app, render_template, redirect, url_for, flash, request, jsonify, send_file, abort
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from smart_expense_splitter import app, db
-from models import User, Group, Member, Bill, Product, ProductMember, BillTemplate, TemplateProduct
-from forms import LoginForm, RegistrationForm, GroupForm, MemberForm, BillForm, ProductForm, BillTemplateForm, TemplateProductForm
+from models import db, User, Group, Member, Bill, Product, ProductMember, BillTemplate, TemplateProduct, Job, Activity, match_members
+from forms import LoginForm, RegistrationForm, GroupForm, MemberForm, BillForm, ProductForm, BulkProductForm, DuplicateBillForm, MergeGroupForm, BillTemplateForm, TemplateProductForm
+from caching import fragment_cache, make_etag, not_modified, with_validators
+from jobs import job_runner
+from instrumentation import sql_monitor
+from sqlalchemy import func
+from sqlalchemy.orm import selectinload
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
 # import pandas as pd
+import hmac
 import io
+import itertools
+import os
+
+bp = Blueprint('main', __name__)
+
+# Bills per page of the group page's bill table
+GROUP_BILLS_PAGE_SIZE = 25
+
+# Activity entries recorded by this process, for pruning every ACTIVITY_PRUNE_EVERY entries
+_activity_writes = itertools.count(1)
+
+def _log_activity(type, description):
+    """Add an activity entry to the current transaction; every so often also cap the user's log"""
+    Activity.record(current_user.id, type, description)
+    if next(_activity_writes) % current_app.config['ACTIVITY_PRUNE_EVERY'] == 0:
+        Activity.prune(current_user.id, current_app.config['ACTIVITY_MAX_PER_USER'])
 
 # Index route
-@app.route('/')
+@bp.route('/')
 def index():
     return render_template('index.html')
 
 # Authentication routes
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(username=form.username.data).first()
         if user is None or not check_password_hash(user.password_hash, form.password.data):
             flash('Invalid username or password', 'danger')
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
         login_user(user)
         next_page = request.args.get('next')
         if not next_page or not next_page.startswith('/'):
-            next_page = url_for('dashboard')
+            next_page = url_for('main.dashboard')
         return redirect(next_page)
     return render_template('login.html', title='Sign In', form=form)
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     logout_user()
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
 # Settings route
-@app.route('/settings')
+@bp.route('/settings')
 @login_required
 def settings():
     return render_template('settings.html', title='Settings')
 
-@app.route('/settings/currency', methods=['GET', 'POST'])
+@bp.route('/settings/currency', methods=['GET', 'POST'])
 @login_required
 def currency_settings():
     from models import Currency, UserCurrency, populate_initial_currencies
@@ -73,7 +95,7 @@ def currency_settings():
         if form.default_currency.data:
             current_user.set_default_currency(form.default_currency.data)
             flash('Default currency updated successfully!', 'success')
-        return redirect(url_for('currency_settings'))
+        return redirect(url_for('main.currency_settings'))
     
     if add_form.submit.data and add_form.validate_on_submit():
         # Add new currency
@@ -83,7 +105,7 @@ def currency_settings():
                 flash('Default currency updated!', 'success')
         else:
             flash('Failed to add currency. Please try again.', 'danger')
-        return redirect(url_for('currency_settings'))
+        return redirect(url_for('main.currency_settings'))
     
     # Set form defaults
     if default_currency:
@@ -100,28 +122,28 @@ def currency_settings():
                            default_currency=default_currency,
                            available_currencies=available_currencies)
 
-@app.route('/settings/currency/remove/<int:currency_id>', methods=['POST'])
+@bp.route('/settings/currency/remove/<int:currency_id>', methods=['POST'])
 @login_required
 def remove_currency(currency_id):
     if current_user.remove_currency(currency_id):
         flash('Currency removed successfully!', 'success')
     else:
         flash('Cannot remove currency. You must have at least one active currency.', 'danger')
-    return redirect(url_for('currency_settings'))
+    return redirect(url_for('main.currency_settings'))
 
-@app.route('/settings/currency/set-default/<int:currency_id>', methods=['POST'])
+@bp.route('/settings/currency/set-default/<int:currency_id>', methods=['POST'])
 @login_required
 def set_default_currency_route(currency_id):
     if current_user.set_default_currency(currency_id):
         flash('Default currency updated successfully!', 'success')
     else:
         flash('Failed to update default currency.', 'danger')
-    return redirect(url_for('currency_settings'))
+    return redirect(url_for('main.currency_settings'))
 
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     if current_user.is_authenticated:
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
     form = RegistrationForm()
     if form.validate_on_submit():
         user = User(username=form.username.data, email=form.email.data)
@@ -129,18 +151,21 @@ def register():
         db.session.add(user)
         db.session.commit()
         flash('Congratulations, you are now a registered user!', 'success')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     return render_template('register.html', title='Register', form=form)
 
 # Dashboard route
-@app.route('/dashboard')
+@bp.route('/dashboard')
 @login_required
 def dashboard():
-    groups = Group.query.filter_by(user_id=current_user.id).all()
-    return render_template('dashboard.html', title='Dashboard', groups=groups)
+    # One aggregated query per page of groups instead of loading every member and bill to count them
+    page = request.args.get('page', 1, type=int)
+    groups = Group.dashboard_query(current_user.id).paginate(page=page, per_page=12, error_out=False)
+    recent_activity = current_user.get_recent_activity()
+    return render_template('dashboard.html', title='Dashboard', groups=groups, recent_activity=recent_activity)
 
 # Group routes
-@app.route('/group/new', methods=['GET', 'POST'])
+@bp.route('/group/new', methods=['GET', 'POST'])
 @login_required
 def new_group():
     form = GroupForm()
@@ -151,56 +176,112 @@ def new_group():
             user_id=current_user.id
         )
         db.session.add(group)
+        current_user.bump_data_version()
+        _log_activity('group_created', f'Created group "{group.name}"')
         db.session.commit()
         flash(f'Group "{form.name.data}" created successfully!', 'success')
-        return redirect(url_for('group_detail', group_id=group.id))
+        return redirect(url_for('main.group_detail', group_id=group.id))
     return render_template('create_group.html', title='New Group', form=form, group=None)
 
-@app.route('/group/<int:group_id>')
+@bp.route('/group/<int:group_id>')
 @login_required
 def group_detail(group_id):
     group = Group.query.get_or_404(group_id)
     if group.user_id != current_user.id:
         flash('You do not have permission to view this group.', 'danger')
-        return redirect(url_for('dashboard'))
-    return render_template('group_detail.html', title=group.name, group=group)
+        return redirect(url_for('main.dashboard'))
+    default_currency = current_user.get_default_currency()
+    etag = make_etag('group', group.id, group.version, default_currency.code if default_currency else '')
+    cached = not_modified(etag, group.last_modified)
+    if cached:
+        return cached
+    # Only the first page of bills is rendered; the rest is fetched from api_group_bills on scroll
+    bill_rows, has_more = group.bill_page(limit=GROUP_BILLS_PAGE_SIZE)
+    return with_validators(render_template('group_detail.html', title=group.name, group=group, bill_rows=bill_rows,
+                                           next_url=_next_bills_url(group, bill_rows, has_more)),
+                           etag, group.last_modified)
+
+def _next_bills_url(group, bill_rows, has_more):
+    """URL of the page of bills after bill_rows, or None on the last page"""
+    if not has_more:
+        return None
+    last = bill_rows[-1][0]
+    return url_for('main.api_group_bills', group_id=group.id, after=f'{last.date.isoformat()}.{last.id}')
 
-@app.route('/group/<int:group_id>/edit', methods=['GET', 'POST'])
+@bp.route('/group/<int:group_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_group(group_id):
     group = Group.query.get_or_404(group_id)
     if group.user_id != current_user.id:
         flash('You do not have permission to edit this group.', 'danger')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
     form = GroupForm(obj=group)
     if form.validate_on_submit():
         group.name = form.name.data
         group.description = form.description.data
+        group.bump_version()
         db.session.commit()
         flash(f'Group "{form.name.data}" updated successfully!', 'success')
-        return redirect(url_for('group_detail', group_id=group.id))
+        return redirect(url_for('main.group_detail', group_id=group.id))
     return render_template('edit_group.html', title='Edit Group', form=form, group=group)
 
-@app.route('/group/<int:group_id>/delete', methods=['POST'])
+@bp.route('/group/<int:group_id>/delete', methods=['POST'])
 @login_required
 def delete_group(group_id):
     group = Group.query.get_or_404(group_id)
     if group.user_id != current_user.id:
         flash('You do not have permission to delete this group.', 'danger')
-        return redirect(url_for('dashboard'))
-    db.session.delete(group)
+        return redirect(url_for('main.dashboard'))
+    group_id, name = group.id, group.name
+    group.delete_cascade()
+    current_user.bump_data_version()
     db.session.commit()
-    flash(f'Group "{group.name}" deleted successfully!', 'success')
-    return redirect(url_for('dashboard'))
+    fragment_cache().invalidate(group_id=group_id)
+    flash(f'Group "{name}" deleted successfully!', 'success')
+    return redirect(url_for('main.dashboard'))
+
+@bp.route('/group/<int:group_id>/merge', methods=['GET', 'POST'])
+@login_required
+def merge_group(group_id):
+    group = Group.query.get_or_404(group_id)
+    if group.user_id != current_user.id:
+        flash('You do not have permission to merge this group.', 'danger')
+        return redirect(url_for('main.dashboard'))
+    others = Group.query.filter(Group.user_id == current_user.id, Group.id != group.id).order_by(Group.name).all()
+    if not others:
+        flash('You need another group to merge this one into.', 'warning')
+        return redirect(url_for('main.group_detail', group_id=group.id))
+    form = MergeGroupForm()
+    form.target.choices = [(g.id, g.name) for g in others]
+    if request.method == 'GET':
+        form.target.data = request.args.get('target', others[0].id, type=int)
+    target = next((g for g in others if g.id == form.target.data), others[0])
+    
+    if form.validate_on_submit():
+        name = group.name
+        plan = group.merge_into(target)
+        current_user.bump_data_version()
+        _log_activity('group_merged', f'Merged "{name}" into "{target.name}"')
+        db.session.commit()
+        fragment_cache().invalidate(group_id=group_id)
+        fragment_cache().invalidate(group_id=target.id)
+        flash(f'Group "{name}" merged into "{target.name}"; {len(plan)} duplicate member(s) combined.', 'success')
+        return redirect(url_for('main.group_detail', group_id=target.id))
+    
+    plan = group.member_merge_plan(target)
+    members = {m.id: m for m in group.members + target.members}
+    merges = [(members[old_id], members[new_id]) for old_id, new_id in plan.items()]
+    return render_template('merge_group.html', title='Merge Group', form=form, group=group, target=target, merges=merges,
+                           moved=[m for m in group.members if m.id not in plan])
 
 # Member routes
-@app.route('/group/<int:group_id>/member/new', methods=['GET', 'POST'])
+@bp.route('/group/<int:group_id>/member/new', methods=['GET', 'POST'])
 @login_required
 def new_member(group_id):
     group = Group.query.get_or_404(group_id)
     if group.user_id != current_user.id:
         flash('You do not have permission to add members to this group.', 'danger')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
     form = MemberForm()
     if form.validate_on_submit():
         member = Member(
@@ -210,49 +291,61 @@ def new_member(group_id):
             group_id=group.id
         )
         db.session.add(member)
+        group.bump_version(include_bills=True)
+        _log_activity('member_added', f'Added {member.name} to "{group.name}"')
         db.session.commit()
+        fragment_cache().invalidate(group_id=group.id)
         flash(f'Member "{form.name.data}" added successfully!', 'success')
-        return redirect(url_for('group_detail', group_id=group.id))
+        return redirect(url_for('main.group_detail', group_id=group.id))
     return render_template('create_member.html', title='New Member', form=form, group=group)
 
-@app.route('/member/<int:member_id>/edit', methods=['GET', 'POST'])
+@bp.route('/member/<int:member_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_member(member_id):
     member = Member.query.get_or_404(member_id)
     if member.group.user_id != current_user.id:
         flash('You do not have permission to edit this member.', 'danger')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
     form = MemberForm(obj=member)
     if form.validate_on_submit():
         member.name = form.name.data
         member.email = form.email.data
         member.mobile_number = form.mobile_number.data
+        member.group.bump_version(include_bills=True)
         db.session.commit()
+        fragment_cache().invalidate(group_id=member.group_id)
         flash(f'Member "{form.name.data}" updated successfully!', 'success')
-        return redirect(url_for('group_detail', group_id=member.group_id))
+        return redirect(url_for('main.group_detail', group_id=member.group_id))
     return render_template('edit_member.html', title='Edit Member', form=form, member=member)
 
-@app.route('/member/<int:member_id>/delete', methods=['POST'])
+@bp.route('/member/<int:member_id>/delete', methods=['POST'])
 @login_required
 def delete_member(member_id):
     member = Member.query.get_or_404(member_id)
     if member.group.user_id != current_user.id:
         flash('You do not have permission to delete this member.', 'danger')
-        return redirect(url_for('dashboard'))
-    group_id = member.group_id
-    db.session.delete(member)
+        return redirect(url_for('main.dashboard'))
+    group_id, name = member.group_id, member.name
+    # Deleting a payer would drop expenses the other members share in
+    paid = member.paid_product_count()
+    if paid:
+        flash(f'"{name}" paid for {paid} product(s). Choose another payer for them before deleting this member.', 'warning')
+        return redirect(url_for('main.group_detail', group_id=group_id))
+    member.group.bump_version(include_bills=True)
+    member.delete_cascade()
     db.session.commit()
-    flash(f'Member "{member.name}" deleted successfully!', 'success')
-    return redirect(url_for('group_detail', group_id=group_id))
+    fragment_cache().invalidate(group_id=group_id)
+    flash(f'Member "{name}" deleted successfully!', 'success')
+    return redirect(url_for('main.group_detail', group_id=group_id))
 
 # Bill routes
-@app.route('/group/<int:group_id>/bill/new', methods=['GET', 'POST'])
+@bp.route('/group/<int:group_id>/bill/new', methods=['GET', 'POST'])
 @login_required
 def new_bill(group_id):
     group = Group.query.get_or_404(group_id)
     if group.user_id != current_user.id:
         flash('You do not have permission to add bills to this group.', 'danger')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
     form = BillForm()
     if form.validate_on_submit():
         bill = Bill(
@@ -263,92 +356,153 @@ def new_bill(group_id):
             group_id=group.id
         )
         db.session.add(bill)
+        group.bump_version()
+        _log_activity('bill_added', f'Added bill "{bill.title}" to "{group.name}"')
         db.session.commit()
         flash(f'Bill "{form.title.data}" created successfully!', 'success')
-        return redirect(url_for('bill_detail', bill_id=bill.id))
+        return redirect(url_for('main.bill_detail', bill_id=bill.id))
     return render_template('create_bill.html', title='New Bill', form=form, group=group)
 
-@app.route('/bill/<int:bill_id>')
+@bp.route('/bill/<int:bill_id>')
 @login_required
 def bill_detail(bill_id):
     bill = Bill.query.get_or_404(bill_id)
     if bill.group.user_id != current_user.id:
         flash('You do not have permission to view this bill.', 'danger')
-        return redirect(url_for('dashboard'))
-    member_summary = bill.get_member_summary()
-    settlement = bill.get_settlement_summary()
-    
-    # Create a JSON-serializable version of member_summary for JavaScript
-    js_member_summary = {}
-    for member_id, data in member_summary.items():
-        js_member_summary[member_id] = {
-            'member': {
-                'id': data['member'].id,
-                'name': data['member'].name,
-                'email': data['member'].email,
-                'mobile_number': data['member'].mobile_number
-            },
-            'paid': data['paid'],
-            'owes': data['owes'],
-            'net': data['net'],
-            'paid_products': [{
-                'id': p.id,
-                'name': p.name,
-                'price': p.price,
-                'members_count': len(p.members_involved)
-            } for p in data['paid_products']],
-            'shared_products': [{
-                'id': p.id,
-                'name': p.name,
-                'price': p.price,
-                'members_count': len(p.members_involved),
-                'payer_name': p.payer.name if p.payer else 'Unknown'
-            } for p in data['shared_products']]
-        }
-    
-    return render_template('bill_detail.html', title=bill.title, bill=bill, 
-                           member_summary=member_summary, settlement=settlement, 
-                           js_member_summary=js_member_summary, abs=abs)
-
-@app.route('/bill/<int:bill_id>/edit', methods=['GET', 'POST'])
+        return redirect(url_for('main.dashboard'))
+    group = bill.group
+    # The member summary and settlement sections are cached fragments keyed by the
+    # bill's content version and the currency they were formatted in, so summaries
+    # are only computed when one of them misses
+    default_currency = current_user.get_default_currency()
+    currency_code = default_currency.code if default_currency else ''
+    etag = make_etag('bill', bill.id, group.id, group.version, currency_code)
+    cached = not_modified(etag, group.last_modified)
+    if cached:
+        return cached
+    bill.load_contents()
+    
+    return with_validators(render_template('bill_detail.html', title=bill.title, bill=bill, 
+                                           currency_code=currency_code, abs=abs),
+                           etag, group.last_modified)
+
+@bp.route('/bill/<int:bill_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_bill(bill_id):
     bill = Bill.query.get_or_404(bill_id)
     if bill.group.user_id != current_user.id:
         flash('You do not have permission to edit this bill.', 'danger')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
     form = BillForm(obj=bill)
     if form.validate_on_submit():
         bill.title = form.title.data
         bill.description = form.description.data
         bill.date = form.date.data
         bill.category = form.category.data
+        bill.bump_version()
         db.session.commit()
         flash(f'Bill "{form.title.data}" updated successfully!', 'success')
-        return redirect(url_for('bill_detail', bill_id=bill.id))
+        return redirect(url_for('main.bill_detail', bill_id=bill.id))
     return render_template('edit_bill.html', title='Edit Bill', form=form, bill=bill)
 
-@app.route('/bill/<int:bill_id>/delete', methods=['POST'])
+@bp.route('/bill/<int:bill_id>/delete', methods=['POST'])
 @login_required
 def delete_bill(bill_id):
     bill = Bill.query.get_or_404(bill_id)
     if bill.group.user_id != current_user.id:
         flash('You do not have permission to delete this bill.', 'danger')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
+    bill_id, title = bill.id, bill.title
     group_id = bill.group_id
-    db.session.delete(bill)
+    bill.group.bump_version()
+    bill.delete_cascade()
     db.session.commit()
-    flash(f'Bill "{bill.title}" deleted successfully!', 'success')
-    return redirect(url_for('group_detail', group_id=group_id))
+    fragment_cache().invalidate(bill_id=bill_id)
+    flash(f'Bill "{title}" deleted successfully!', 'success')
+    return redirect(url_for('main.group_detail', group_id=group_id))
+
+@bp.route('/bill/<int:bill_id>/duplicate', methods=['GET', 'POST'])
+@login_required
+def duplicate_bill(bill_id):
+    bill = Bill.query.get_or_404(bill_id)
+    if bill.group.user_id != current_user.id:
+        flash('You do not have permission to duplicate this bill.', 'danger')
+        return redirect(url_for('main.dashboard'))
+    form = DuplicateBillForm()
+    groups = Group.query.filter_by(user_id=current_user.id).order_by(Group.name).all()
+    form.group.choices = [(g.id, g.name) for g in groups]
+    if request.method == 'GET':
+        form.title.data = bill.title
+        form.date.data = datetime.utcnow().date()
+        form.group.data = request.args.get('group', bill.group_id, type=int)
+    target = next((g for g in groups if g.id == form.group.data), bill.group)
+    
+    # Into another group, every member on the bill needs a counterpart there; suggest
+    # the member with the same mobile number, email or name
+    sources, member_map = [], None
+    if target.id != bill.group_id:
+        used = bill.used_member_ids()
+        sources = [m for m in bill.group.members if m.id in used]
+        if request.method == 'POST':
+            target_ids = {m.id for m in target.members}
+            chosen = {m.id: request.form.get(f'member_{m.id}', type=int) for m in sources}
+            member_map = {source_id: target_id for source_id, target_id in chosen.items() if target_id in target_ids}
+        else:
+            member_map = match_members(sources, target.members)
+    
+    if form.validate_on_submit():
+        try:
+            copy = bill.duplicate(target.id, member_map, title=form.title.data, date=form.date.data)
+        except ValueError as e:
+            flash(str(e), 'danger')
+        else:
+            target.bump_version()
+            _log_activity('bill_added', f'Added bill "{copy.title}" to "{target.name}" as a copy of "{bill.title}"')
+            db.session.commit()
+            flash(f'Bill "{bill.title}" duplicated into "{target.name}"!', 'success')
+            return redirect(url_for('main.bill_detail', bill_id=copy.id))
+    return render_template('duplicate_bill.html', title='Duplicate Bill', form=form, bill=bill, target=target,
+                           sources=sources, member_map=member_map or {})
+
+@bp.route('/bill/<int:bill_id>/settle', methods=['POST'])
+@login_required
+def settle_bill(bill_id):
+    bill = Bill.query.get_or_404(bill_id)
+    if bill.group.user_id != current_user.id:
+        flash('You do not have permission to settle this bill.', 'danger')
+        return redirect(url_for('main.dashboard'))
+    if not bill.is_settled:
+        bill.settle()
+        db.session.commit()
+        fragment_cache().invalidate(bill_id=bill.id)
+    flash(f'Bill "{bill.title}" is settled. Reopen it to make changes.', 'success')
+    return redirect(url_for('main.bill_detail', bill_id=bill.id))
+
+@bp.route('/bill/<int:bill_id>/reopen', methods=['POST'])
+@login_required
+def reopen_bill(bill_id):
+    bill = Bill.query.get_or_404(bill_id)
+    if bill.group.user_id != current_user.id:
+        flash('You do not have permission to reopen this bill.', 'danger')
+        return redirect(url_for('main.dashboard'))
+    if bill.is_settled:
+        bill.reopen()
+        db.session.commit()
+        fragment_cache().invalidate(bill_id=bill.id)
+    flash(f'Bill "{bill.title}" reopened.', 'success')
+    return redirect(url_for('main.bill_detail', bill_id=bill.id))
 
 # Product routes
-@app.route('/bill/<int:bill_id>/product/new', methods=['GET', 'POST'])
+@bp.route('/bill/<int:bill_id>/product/new', methods=['GET', 'POST'])
 @login_required
 def new_product(bill_id):
     bill = Bill.query.get_or_404(bill_id)
     if bill.group.user_id != current_user.id:
         flash('You do not have permission to add products to this bill.', 'danger')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
+    if bill.is_settled:
+        flash('This bill is settled. Reopen it to add products.', 'warning')
+        return redirect(url_for('main.bill_detail', bill_id=bill.id))
     form = ProductForm()
     # Populate the payer and members_involved select fields
     form.payer.choices = [(m.id, m.name) for m in bill.group.members]
@@ -372,18 +526,24 @@ def new_product(bill_id):
             )
             db.session.add(product_member)
         
+        bill.bump_version()
+        _log_activity('product_added', f'Added {product.name} to bill "{bill.title}"')
         db.session.commit()
+        fragment_cache().invalidate(bill_id=bill.id)
         flash(f'Product "{form.name.data}" added successfully!', 'success')
-        return redirect(url_for('bill_detail', bill_id=bill.id))
+        return redirect(url_for('main.bill_detail', bill_id=bill.id))
     return render_template('create_product.html', title='New Product', form=form, bill=bill)
 
-@app.route('/product/<int:product_id>/edit', methods=['GET', 'POST'])
+@bp.route('/product/<int:product_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_product(product_id):
     product = Product.query.get_or_404(product_id)
     if product.bill.group.user_id != current_user.id:
         flash('You do not have permission to edit this product.', 'danger')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
+    if product.bill.is_settled:
+        flash('This bill is settled. Reopen it to edit products.', 'warning')
+        return redirect(url_for('main.bill_detail', bill_id=product.bill_id))
     form = ProductForm(obj=product)
     # Populate the payer and members_involved select fields
     form.payer.choices = [(m.id, m.name) for m in product.bill.group.members]
@@ -399,101 +559,81 @@ def edit_product(product_id):
         product.name = form.name.data
         product.price = form.price.data
         product.payer_id = form.payer.data
-        
-        # Remove existing product_member associations
-        ProductMember.query.filter_by(product_id=product.id).delete()
-        
-        # Add new members involved
-        for member_id in form.members_involved.data:
-            product_member = ProductMember(
-                product_id=product.id,
-                member_id=member_id
-            )
-            db.session.add(product_member)
-        
+        # Only the members added or removed are written
+        product.set_members(form.members_involved.data)
+        product.bill.bump_version()
         db.session.commit()
+        fragment_cache().invalidate(bill_id=product.bill_id)
         flash(f'Product "{form.name.data}" updated successfully!', 'success')
-        return redirect(url_for('bill_detail', bill_id=product.bill_id))
+        return redirect(url_for('main.bill_detail', bill_id=product.bill_id))
     return render_template('edit_product.html', title='Edit Product', form=form, product=product)
 
-@app.route('/product/<int:product_id>/delete', methods=['POST'])
+@bp.route('/bill/<int:bill_id>/products/edit', methods=['GET', 'POST'])
+@login_required
+def bulk_edit_products(bill_id):
+    bill = Bill.query.get_or_404(bill_id)
+    if bill.group.user_id != current_user.id:
+        flash('You do not have permission to edit this bill.', 'danger')
+        return redirect(url_for('main.dashboard'))
+    if bill.is_settled:
+        flash('This bill is settled. Reopen it to edit products.', 'warning')
+        return redirect(url_for('main.bill_detail', bill_id=bill.id))
+    form = BulkProductForm()
+    members = bill.group.members
+    form.products.choices = [(p.id, p.name) for p in bill.products]
+    form.payer.choices = [(0, 'Keep current payer')] + [(m.id, m.name) for m in members]
+    form.members.choices = [(m.id, m.name) for m in members]
+    
+    if form.validate_on_submit():
+        member_ids = None if form.members_action.data == 'keep' else form.members.data
+        try:
+            count = bill.bulk_edit_products(form.products.data, payer_id=form.payer.data or None,
+                                            member_ids=member_ids, mode=form.members_action.data)
+        except ValueError as e:
+            flash(str(e), 'danger')
+        else:
+            db.session.commit()
+            fragment_cache().invalidate(bill_id=bill.id)
+            flash(f'{count} product(s) updated successfully!', 'success')
+            return redirect(url_for('main.bill_detail', bill_id=bill.id))
+    return render_template('bulk_edit_products.html', title='Edit Products', form=form, bill=bill, members=members)
+
+@bp.route('/product/<int:product_id>/delete', methods=['POST'])
 @login_required
 def delete_product(product_id):
     product = Product.query.get_or_404(product_id)
     if product.bill.group.user_id != current_user.id:
         flash('You do not have permission to delete this product.', 'danger')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
+    if product.bill.is_settled:
+        flash('This bill is settled. Reopen it to delete products.', 'warning')
+        return redirect(url_for('main.bill_detail', bill_id=product.bill_id))
     bill_id = product.bill_id
+    product.bill.bump_version()
     db.session.delete(product)
     db.session.commit()
+    fragment_cache().invalidate(bill_id=bill_id)
     flash(f'Product "{product.name}" deleted successfully!', 'success')
-    return redirect(url_for('bill_detail', bill_id=bill_id))
+    return redirect(url_for('main.bill_detail', bill_id=bill_id))
 
 # Export routes - simple CSV export without pandas
-@app.route('/bill/<int:bill_id>/export/csv')
+@bp.route('/bill/<int:bill_id>/export/csv', methods=['POST'])
 @login_required
 def export_bill_csv(bill_id):
     bill = Bill.query.get_or_404(bill_id)
     if bill.group.user_id != current_user.id:
         flash('You do not have permission to export this bill.', 'danger')
-        return redirect(url_for('dashboard'))
-    
-    # Get bill summary and settlement data
-    member_summary = bill.get_member_summary()
-    settlement = bill.get_settlement_summary()
-    
-    # Create CSV content manually
-    csv_content = []
-    
-    # Add bill information
-    csv_content.append(f"Bill: {bill.title}")
-    csv_content.append(f"Date: {bill.date}")
-    csv_content.append(f"Group: {bill.group.name}")
-    csv_content.append("")
-    
-    # Add member summary
-    csv_content.append("Member Summary:")
-    csv_content.append("Member,Products,Total Paid,Total Owed,Net Balance")
-    
-    for member_id, data in member_summary.items():
-        member = data['member']
-        products_info = []
-        for product_data in data['products']:
-            product = product_data['product']
-            shared_with = [Member.query.get(m_id).name for m_id in product_data['shared_with']]
-            shared_info = f"shared with {', '.join(shared_with)}" if shared_with else "independent"
-            products_info.append(f"{product.name} ({shared_info}): ${product_data['share']:.2f}")
-        
-        products_str = '; '.join(products_info)
-        csv_content.append(f'"{member.name}","{products_str}","${data["paid"]:.2f}","${data["owes"]:.2f}","${data["net"]:.2f}"')
-    
-    csv_content.append("")
+        return redirect(url_for('main.dashboard'))
     
-    # Add settlement summary
-    csv_content.append("Settlement Summary:")
-    csv_content.append("From,To,Amount")
-    
-    for transaction in settlement:
-        csv_content.append(f'"{transaction["from_member"].name}","{transaction["to_member"].name}","${transaction["amount"]:.2f}"')
-    
-    # Join all lines with newlines
-    csv_string = '\n'.join(csv_content)
-    
-    # Create a response with the CSV file
-    return send_file(
-        io.BytesIO(csv_string.encode()),
-        mimetype='text/csv',
-        as_attachment=True,
-        download_name=f"{bill.title.replace(' ', '_')}_summary.csv"
-    )
+    return _start_job('bill_csv', bill_id=bill.id)
 
-# @app.route('/bill/<int:bill_id>/export/excel')
+# @bp.route('/bill/<int:bill_id>/export/excel')
 # @login_required
 # def export_bill_excel(bill_id):
 #     bill = Bill.query.get_or_404(bill_id)
 #     if bill.group.user_id != current_user.id:
 #         flash('You do not have permission to export this bill.', 'danger')
-#         return redirect(url_for('dashboard'))
+#         return redirect(url_for('main.dashboard'))
 #     
 #     # Create a DataFrame for the bill summary
 #     member_summary = bill.get_member_summary()
@@ -577,30 +717,31 @@ def export_bill_csv(bill_id):
 #     )
 
 # Static pages
-@app.route('/about')
+@bp.route('/about')
 def about():
     return render_template('about.html', title='About Us')
 
-@app.route('/privacy')
+@bp.route('/privacy')
 def privacy():
     return render_template('privacy.html', title='Privacy Policy')
 
-@app.route('/terms')
+@bp.route('/terms')
 def terms():
     return render_template('terms.html', title='Terms of Service')
 
-@app.route('/contact')
+@bp.route('/contact')
 def contact():
     return render_template('contact.html', title='Contact Us')
 
 # Bill Template routes
-@app.route('/templates')
+@bp.route('/templates')
 @login_required
 def bill_templates():
-    templates = BillTemplate.query.filter_by(user_id=current_user.id).order_by(BillTemplate.created_at.desc()).all()
+    templates = BillTemplate.query.filter_by(user_id=current_user.id).order_by(BillTemplate.created_at.desc()) \
+        .options(selectinload(BillTemplate.template_products)).all()
     return render_template('bill_templates.html', title='Bill Templates', templates=templates)
 
-@app.route('/template/new', methods=['GET', 'POST'])
+@bp.route('/template/new', methods=['GET', 'POST'])
 @login_required
 def new_bill_template():
     form = BillTemplateForm()
@@ -615,25 +756,25 @@ def new_bill_template():
         db.session.add(template)
         db.session.commit()
         flash(f'Template "{form.name.data}" created successfully!', 'success')
-        return redirect(url_for('bill_template_detail', template_id=template.id))
+        return redirect(url_for('main.bill_template_detail', template_id=template.id))
     return render_template('create_bill_template.html', title='New Bill Template', form=form)
 
-@app.route('/template/<int:template_id>')
+@bp.route('/template/<int:template_id>')
 @login_required
 def bill_template_detail(template_id):
     template = BillTemplate.query.get_or_404(template_id)
     if template.user_id != current_user.id:
         flash('You do not have permission to view this template.', 'danger')
-        return redirect(url_for('bill_templates'))
+        return redirect(url_for('main.bill_templates'))
     return render_template('bill_template_detail.html', title=template.name, template=template)
 
-@app.route('/template/<int:template_id>/edit', methods=['GET', 'POST'])
+@bp.route('/template/<int:template_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_bill_template(template_id):
     template = BillTemplate.query.get_or_404(template_id)
     if template.user_id != current_user.id:
         flash('You do not have permission to edit this template.', 'danger')
-        return redirect(url_for('bill_templates'))
+        return redirect(url_for('main.bill_templates'))
     form = BillTemplateForm(obj=template)
     if form.validate_on_submit():
         template.name = form.name.data
@@ -642,28 +783,28 @@ def edit_bill_template(template_id):
         template.category = form.category.data
         db.session.commit()
         flash(f'Template "{form.name.data}" updated successfully!', 'success')
-        return redirect(url_for('bill_template_detail', template_id=template.id))
+        return redirect(url_for('main.bill_template_detail', template_id=template.id))
     return render_template('edit_bill_template.html', title='Edit Template', form=form, template=template)
 
-@app.route('/template/<int:template_id>/delete', methods=['POST'])
+@bp.route('/template/<int:template_id>/delete', methods=['POST'])
 @login_required
 def delete_bill_template(template_id):
     template = BillTemplate.query.get_or_404(template_id)
     if template.user_id != current_user.id:
         flash('You do not have permission to delete this template.', 'danger')
-        return redirect(url_for('bill_templates'))
+        return redirect(url_for('main.bill_templates'))
     db.session.delete(template)
     db.session.commit()
     flash(f'Template "{template.name}" deleted successfully!', 'success')
-    return redirect(url_for('bill_templates'))
+    return redirect(url_for('main.bill_templates'))
 
-@app.route('/template/<int:template_id>/product/new', methods=['GET', 'POST'])
+@bp.route('/template/<int:template_id>/product/new', methods=['GET', 'POST'])
 @login_required
 def new_template_product(template_id):
     template = BillTemplate.query.get_or_404(template_id)
     if template.user_id != current_user.id:
         flash('You do not have permission to add products to this template.', 'danger')
-        return redirect(url_for('bill_templates'))
+        return redirect(url_for('main.bill_templates'))
     form = TemplateProductForm()
     if form.validate_on_submit():
         template_product = TemplateProduct(
@@ -674,23 +815,23 @@ def new_template_product(template_id):
         db.session.add(template_product)
         db.session.commit()
         flash(f'Product "{form.name.data}" added to template!', 'success')
-        return redirect(url_for('bill_template_detail', template_id=template.id))
+        return redirect(url_for('main.bill_template_detail', template_id=template.id))
     return render_template('create_template_product.html', title='Add Template Product', form=form, template=template)
 
-@app.route('/template/product/<int:product_id>/delete', methods=['POST'])
+@bp.route('/template/product/<int:product_id>/delete', methods=['POST'])
 @login_required
 def delete_template_product(product_id):
     template_product = TemplateProduct.query.get_or_404(product_id)
     template = template_product.bill_template
     if template.user_id != current_user.id:
         flash('You do not have permission to delete this template product.', 'danger')
-        return redirect(url_for('bill_templates'))
+        return redirect(url_for('main.bill_templates'))
     db.session.delete(template_product)
     db.session.commit()
     flash(f'Product "{template_product.name}" removed from template!', 'success')
-    return redirect(url_for('bill_template_detail', template_id=template.id))
+    return redirect(url_for('main.bill_template_detail', template_id=template.id))
 
-@app.route('/template/<int:template_id>/use/<int:group_id>')
+@bp.route('/template/<int:template_id>/use/<int:group_id>')
 @login_required
 def use_bill_template(template_id, group_id):
     template = BillTemplate.query.get_or_404(template_id)
@@ -698,11 +839,11 @@ def use_bill_template(template_id, group_id):
     
     if template.user_id != current_user.id:
         flash('You do not have permission to use this template.', 'danger')
-        return redirect(url_for('bill_templates'))
+        return redirect(url_for('main.bill_templates'))
     
     if group.user_id != current_user.id:
         flash('You do not have permission to add bills to this group.', 'danger')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
     
     # Create a new bill from template
     bill = Bill(
@@ -726,11 +867,14 @@ def use_bill_template(template_id, group_id):
         db.session.add(product)
         db.session.commit()
     
+    group.bump_version()
+    _log_activity('bill_added', f'Added bill "{bill.title}" to "{group.name}" from template "{template.name}"')
+    db.session.commit()
     flash(f'Bill created from template "{template.name}"!', 'success')
-    return redirect(url_for('edit_bill', bill_id=bill.id))
+    return redirect(url_for('main.edit_bill', bill_id=bill.id))
 
 # Bill Search and Filter routes
-@app.route('/bills')
+@bp.route('/bills')
 @login_required
 def bills():
     # Get filter parameters
@@ -813,30 +957,56 @@ def bills():
                          sort_by=sort_by)
 
 # Analytics routes
-@app.route('/analytics')
+def _current_rollups(groups):
+    """Return each group's current rollup, storing the ones that had to be recomputed"""
+    # New rollups are inserted together on commit rather than flushed one by one
+    with db.session.no_autoflush:
+        rollups = [group.get_rollup() for group in groups]
+    if not (db.session.new or db.session.dirty):
+        # Every rollup was current; committing would only expire the loaded groups
+        return rollups
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent request stored the same new rollup first; use what it stored
+        db.session.rollback()
+        rollups = [group.get_rollup() for group in groups]
+        db.session.commit()
+    return rollups
+
+@bp.route('/analytics')
 @login_required
 def analytics():
     """Main analytics dashboard"""
     # Get user's groups
-    groups = Group.query.filter_by(user_id=current_user.id).all()
+    groups = Group.query.filter_by(user_id=current_user.id) \
+        .options(selectinload(Group.rollup), selectinload(Group.members)).all()
+    
+    # Per-group totals come from the stored rollups; stale ones are recomputed here
+    rollups = _current_rollups(groups)
     
     # Overall statistics
-    total_expenses = current_user.get_total_expenses()
+    total_expenses = sum(rollup.total for rollup in rollups)
     total_groups = len(groups)
-    total_bills = sum(len(group.bills) for group in groups)
+    total_bills = sum(rollup.bill_count for rollup in rollups)
     average_bill_amount = total_expenses / total_bills if total_bills > 0 else 0
     
     # Category breakdown
-    category_totals = current_user.get_expenses_by_category()
+    category_totals = {}
+    for rollup in rollups:
+        for category, amount in rollup.get_categories().items():
+            category_totals[category] = category_totals.get(category, 0) + amount
     
     # Monthly expenses for current year
     current_year = datetime.now().year
-    monthly_expenses = current_user.get_monthly_expenses(current_year)
+    monthly_expenses = {}
+    for rollup in rollups:
+        for month_key, amount in rollup.get_monthly_expenses(current_year).items():
+            monthly_expenses[month_key] = monthly_expenses.get(month_key, 0) + amount
     
     # Top categories
-    all_categories = []
-    for group in groups:
-        all_categories.extend(group.get_top_categories())
+    group_top_categories = [rollup.get_top_categories() for rollup in rollups]
+    all_categories = [item for top in group_top_categories for item in top]
     
     # Combine and sort categories
     category_summary = {}
@@ -848,7 +1018,7 @@ def analytics():
     # Format top categories for template
     formatted_top_categories = []
     for category, total in top_categories:
-        count = sum(1 for group in groups for cat, amt in group.get_top_categories() if cat == category)
+        count = sum(1 for top in group_top_categories for cat, amt in top if cat == category)
         formatted_top_categories.append({
             'category': category,
             'total': total,
@@ -856,7 +1026,8 @@ def analytics():
         })
     
     # Recent activity (last 5 bills)
-    recent_bills = Bill.query.join(Group).filter(Group.user_id == current_user.id).order_by(Bill.created_at.desc()).limit(5).all()
+    recent_bills = Bill.query.join(Group).filter(Group.user_id == current_user.id).order_by(Bill.created_at.desc()) \
+        .options(selectinload(Bill.products)).limit(5).all()
     
     # Format monthly data for charts
     months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
@@ -873,18 +1044,13 @@ def analytics():
     
     # Create group analytics list
     group_analytics_list = []
-    for group in groups:
-        group_total = group.get_total_expenses()
-        group_bills = len(group.bills)
-        group_avg = group.get_average_bill_amount()
-        group_top_categories = group.get_top_categories()
-        
+    for group, rollup, top in zip(groups, rollups, group_top_categories):
         group_analytics_list.append({
             'group': group,
-            'total_expenses': group_total,
-            'total_bills': group_bills,
-            'average_bill_amount': group_avg,
-            'top_categories': group_top_categories
+            'total_expenses': rollup.total,
+            'total_bills': rollup.bill_count,
+            'average_bill_amount': rollup.get_average_bill_amount(),
+            'top_categories': top
         })
     
     return render_template('analytics.html',
@@ -903,99 +1069,111 @@ def analytics():
                            category_data=category_data,
                            group_analytics_list=group_analytics_list)
 
-@app.route('/analytics/group/<int:group_id>')
+@bp.route('/analytics/group/<int:group_id>')
 @login_required
 def group_analytics(group_id):
     """Group-specific analytics"""
     group = Group.query.get_or_404(group_id)
     if group.user_id != current_user.id:
         flash('You do not have permission to view analytics for this group.', 'danger')
-        return redirect(url_for('analytics'))
+        return redirect(url_for('main.analytics'))
     
-    # Group statistics
-    total_expenses = group.get_total_expenses()
-    total_bills = len(group.bills)
-    average_bill = group.get_average_bill_amount()
-    
-    # Category breakdown for group
-    category_totals = group.get_expenses_by_category()
-    
-    # Monthly expenses for current year
+    # Monthly figures are for the current year, so the year is part of the representation
     current_year = datetime.now().year
-    monthly_expenses = group.get_monthly_expenses(current_year)
-    
-    # Top categories for group
-    top_categories = group.get_top_categories()
+    etag = make_etag('group-analytics', group.id, group.version, current_year)
+    cached = not_modified(etag, group.last_modified)
+    if cached:
+        return cached
+    
+    # Totals, category and monthly figures and balances come from the stored rollup
+    rollup = _current_rollups([group])[0]
+    category_totals = rollup.get_categories()
+    monthly_expenses = rollup.get_monthly_expenses(current_year)
+    balances = rollup.get_balances()
+    
+    # Bills per category and per member are counted in the database
+    category_bills = dict(db.session.query(Bill.category, func.count(Bill.id))
+                          .filter(Bill.group_id == group.id).group_by(Bill.category))
+    member_bills = dict(db.session.query(ProductMember.member_id, func.count(func.distinct(Product.bill_id)))
+                        .join(Product, ProductMember.product_id == Product.id)
+                        .join(Bill, Product.bill_id == Bill.id)
+                        .filter(Bill.group_id == group.id).group_by(ProductMember.member_id))
+    
+    group_stats = {
+        'total_expenses': rollup.total,
+        'total_bills': rollup.bill_count,
+        'average_bill_amount': rollup.get_average_bill_amount(),
+        'top_categories': [{'category': category, 'count': category_bills.get(category, 0), 'total': total}
+                           for category, total in rollup.get_top_categories()],
+    }
     
     # Member expenses
     member_expenses = []
     for member in group.members:
-        member_total = group.get_member_expenses(member.id)
+        paid, owes = balances.get(member.id, (0, 0))
+        bill_count = member_bills.get(member.id, 0)
         member_expenses.append({
             'member': member,
-            'total_expense': member_total
+            'total_expenses': owes,
+            'bill_count': bill_count,
+            'average_contribution': owes / bill_count if bill_count else 0,
+            'balance': round(paid - owes, 2),
         })
     
     # Sort by expense amount
-    member_expenses.sort(key=lambda x: x['total_expense'], reverse=True)
+    member_expenses.sort(key=lambda x: x['total_expenses'], reverse=True)
     
     # Recent bills for this group
     recent_bills = Bill.query.filter_by(group_id=group.id).order_by(Bill.created_at.desc()).limit(5).all()
     
-    return render_template('group_analytics.html',
-                           title=f'Analytics - {group.name}',
-                           group=group,
-                           total_expenses=total_expenses,
-                           total_bills=total_bills,
-                           average_bill=average_bill,
-                           category_totals=category_totals,
-                           monthly_expenses=monthly_expenses,
-                           top_categories=top_categories,
-                           member_expenses=member_expenses,
-                           recent_bills=recent_bills,
-                           current_year=current_year)
+    months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+    monthly_data = {
+        'labels': months,
+        'data': [monthly_expenses.get(f"{current_year}-{month:02d}", 0) for month in range(1, 13)]
+    }
+    category_data = {
+        'labels': list(category_totals.keys()),
+        'data': list(category_totals.values())
+    }
+    
+    return with_validators(render_template('group_analytics.html',
+                                           title=f'Analytics - {group.name}',
+                                           group=group,
+                                           group_analytics=group_stats,
+                                           member_expenses=member_expenses,
+                                           recent_bills=recent_bills,
+                                           monthly_data=monthly_data,
+                                           category_data=category_data,
+                                           current_year=current_year),
+                           etag, group.last_modified)
 
-@app.route('/analytics/export/csv')
+@bp.route('/analytics/export/csv', methods=['POST'])
 @login_required
 def export_analytics_csv():
     """Export analytics data as CSV"""
-    import csv
+    return _start_job('analytics_csv')
+
+@bp.route('/analytics/group/<int:group_id>/export/csv', methods=['POST'])
+@login_required
+def export_group_csv(group_id):
+    """Export a group's bills and member balances as CSV"""
+    group = Group.query.get_or_404(group_id)
+    if group.user_id != current_user.id:
+        flash('You do not have permission to export this group.', 'danger')
+        return redirect(url_for('main.dashboard'))
     
-    # Get user's groups
-    groups = Group.query.filter_by(user_id=current_user.id).all()
-    
-    # Create CSV in memory
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Write header
-    writer.writerow(['Group Name', 'Bill Title', 'Category', 'Date', 'Total Amount', 'Description'])
-    
-    # Write data
-    for group in groups:
-        for bill in group.bills:
-            writer.writerow([
-                group.name,
-                bill.title,
-                bill.category,
-                bill.date.strftime('%Y-%m-%d'),
-                f"{bill.get_total_amount():.2f}",
-                bill.description or ''
-            ])
-    
-    # Prepare response
-    output.seek(0)
-    return send_file(
-        io.BytesIO(output.getvalue().encode('utf-8')),
-        mimetype='text/csv',
-        as_attachment=True,
-        download_name=f'expense_analytics_{datetime.now().strftime("%Y%m%d")}.csv'
-    )
+    return _start_job('group_csv', group_id=group.id)
 
-@app.route('/api/analytics/monthly-data/<int:year>')
+@bp.route('/api/analytics/monthly-data/<int:year>')
 @login_required
 def api_monthly_data(year):
     """API endpoint for monthly expense data"""
+    # The cached user may be behind writes made by other worker processes
+    current_user.refresh_data_version()
+    etag = make_etag('monthly-data', current_user.id, current_user.data_version, year)
+    cached = not_modified(etag, current_user.data_last_modified)
+    if cached:
+        return cached
     monthly_data = current_user.get_monthly_expenses(year)
     
     # Format data for charts
@@ -1010,15 +1188,21 @@ def api_monthly_data(year):
             'amount': amount
         })
     
-    return jsonify({
+    return with_validators(jsonify({
         'year': year,
         'data': data
-    })
+    }), etag, current_user.data_last_modified)
 
-@app.route('/api/analytics/category-data')
+@bp.route('/api/analytics/category-data')
 @login_required
 def api_category_data():
     """API endpoint for category expense data"""
+    # The cached user may be behind writes made by other worker processes
+    current_user.refresh_data_version()
+    etag = make_etag('category-data', current_user.id, current_user.data_version)
+    cached = not_modified(etag, current_user.data_last_modified)
+    if cached:
+        return cached
     category_data = current_user.get_expenses_by_category()
     
     # Format data for charts
@@ -1029,6 +1213,200 @@ def api_category_data():
             'amount': amount
         })
     
-    return jsonify({
+    return with_validators(jsonify({
         'data': data
-    })
\ No newline at end of file
+    }), etag, current_user.data_last_modified)
+
+def _requested_fields(allowed):
+    """Parse the ?fields= selection of a summary endpoint, returning (fields, error)"""
+    raw = request.args.get('fields')
+    if not raw:
+        return list(allowed), None
+    fields = [field.strip() for field in raw.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        return None, f"Unknown field(s): {', '.join(unknown)}. Allowed: {', '.join(allowed)}"
+    return fields, None
+
+@bp.route('/api/bill/<int:bill_id>/summary')
+@login_required
+def api_bill_summary(bill_id):
+    """API endpoint for a bill's member balances and settlement transfers"""
+    bill = Bill.query.get_or_404(bill_id)
+    if bill.group.user_id != current_user.id:
+        return jsonify({'error': 'You do not have permission to view this bill.'}), 403
+    fields, error = _requested_fields(Bill.SUMMARY_FIELDS)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    group = bill.group
+    etag = make_etag('bill-summary', bill.id, bill.version, ','.join(sorted(fields)))
+    cached = not_modified(etag, group.last_modified)
+    if cached:
+        return cached
+    bill.load_contents()
+    return with_validators(jsonify(bill.to_summary_dict(fields)), etag, group.last_modified)
+
+@bp.route('/api/group/<int:group_id>/summary')
+@login_required
+def api_group_summary(group_id):
+    """API endpoint for group-wide member balances and settlement transfers"""
+    group = Group.query.get_or_404(group_id)
+    if group.user_id != current_user.id:
+        return jsonify({'error': 'You do not have permission to view this group.'}), 403
+    fields, error = _requested_fields(Group.SUMMARY_FIELDS)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    etag = make_etag('group-summary', group.id, group.version, ','.join(sorted(fields)))
+    cached = not_modified(etag, group.last_modified)
+    if cached:
+        return cached
+    group.load_bill_contents()
+    return with_validators(jsonify(group.to_summary_dict(fields)), etag, group.last_modified)
+
+@bp.route('/api/group/<int:group_id>/bills')
+@login_required
+def api_group_bills(group_id):
+    """API endpoint for the next page of a group's bills, as data and as table rows"""
+    group = Group.query.get_or_404(group_id)
+    if group.user_id != current_user.id:
+        return jsonify({'error': 'You do not have permission to view this group.'}), 403
+    after = request.args.get('after')
+    if after:
+        # Keyset cursor: date and id of the last bill already shown
+        try:
+            after_date, after_id = after.split('.')
+            after = (datetime.strptime(after_date, '%Y-%m-%d').date(), int(after_id))
+        except ValueError:
+            return jsonify({'error': "after must look like 'YYYY-MM-DD.<bill id>'."}), 400
+    limit = min(max(request.args.get('limit', GROUP_BILLS_PAGE_SIZE, type=int), 1), 100)
+    
+    default_currency = current_user.get_default_currency()
+    etag = make_etag('group-bills', group.id, group.version, request.query_string.decode(),
+                     default_currency.code if default_currency else '')
+    cached = not_modified(etag, group.last_modified)
+    if cached:
+        return cached
+    bill_rows, has_more = group.bill_page(after or None, limit)
+    return with_validators(jsonify({
+        'bills': [{
+            'id': bill.id,
+            'title': bill.title,
+            'date': bill.date.isoformat(),
+            'product_count': product_count,
+            'total': total,
+            'settled': bill.is_settled,
+        } for bill, product_count, total in bill_rows],
+        'html': render_template('group_bill_rows.html', bill_rows=bill_rows),
+        'next_url': _next_bills_url(group, bill_rows, has_more),
+    }), etag, group.last_modified)
+
+def _check_metrics_access():
+    """Abort unless metrics are enabled and the request carries METRICS_TOKEN.
+
+    Without a token the metrics are only served by debug and testing apps,
+    so a deployment that forgets to set one does not publish them.
+    """
+    from metrics import metrics_registry
+    registry = metrics_registry()
+    if registry is None:
+        abort(404)
+    token = current_app.config.get('METRICS_TOKEN')
+    if not token:
+        if not (current_app.debug or current_app.testing):
+            abort(404)
+    elif not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        abort(401)
+    return registry
+
+@bp.route('/api/cache/stats')
+def api_cache_stats():
+    """API endpoint for fragment cache hit ratio and memory use; guarded like /metrics"""
+    _check_metrics_access()
+    return jsonify(fragment_cache().stats())
+
+@bp.route('/debug/perf')
+@login_required
+def debug_perf():
+    """The current user's recent SQL reports and repeated statements; only served when DEBUG_PERF_PAGE is on"""
+    monitor = sql_monitor()
+    if not current_app.config.get('DEBUG_PERF_PAGE') or monitor is None:
+        abort(404)
+    return render_template('debug_perf.html', reports=monitor.recent(current_user.id),
+                           offenders=monitor.offenders(current_user.id),
+                           repeat_threshold=monitor.repeat_threshold)
+
+@bp.route('/metrics')
+def metrics():
+    """Request, database and cache metrics in the Prometheus text format"""
+    registry = _check_metrics_access()
+    return Response(registry.render(fragment_cache().stats()), mimetype='text/plain; version=0.0.4')
+
+# Background jobs
+def _wants_json():
+    """Whether the client asked for JSON rather than a page"""
+    return request.accept_mimetypes.best == 'application/json'
+
+def _start_job(kind, **params):
+    """Queue a background job for the current user and point the client at its status"""
+    job = job_runner().enqueue(kind, current_user.id, **params)
+    if _wants_json():
+        response = jsonify(job.to_dict())
+        response.status_code = 202
+        response.headers['Location'] = url_for('main.api_job_status', job_id=job.id)
+        return response
+    return redirect(url_for('main.job_detail', job_id=job.id))
+
+def _get_user_job(job_id):
+    job = Job.query.get_or_404(job_id)
+    if job.user_id != current_user.id:
+        abort(404)
+    return job
+
+@bp.route('/jobs/<int:job_id>')
+@login_required
+def job_detail(job_id):
+    """Status page for a background job, polling until it finishes"""
+    job = _get_user_job(job_id)
+    return render_template('job_detail.html', title='Export', job=job)
+
+@bp.route('/api/jobs/<int:job_id>')
+@login_required
+def api_job_status(job_id):
+    """Status and progress of a background job"""
+    job = _get_user_job(job_id)
+    data = job.to_dict()
+    if job.status == Job.DONE:
+        data['download_url'] = url_for('main.download_job_result', job_id=job.id)
+    return jsonify(data)
+
+@bp.route('/jobs/<int:job_id>/download')
+@login_required
+def download_job_result(job_id):
+    job = _get_user_job(job_id)
+    if job.status != Job.DONE or not job.result_path or not os.path.exists(job.result_path):
+        flash('This export is not available for download.', 'warning')
+        return redirect(url_for('main.job_detail', job_id=job.id))
+    
+    return send_file(
+        job.result_path,
+        mimetype=job.result_mimetype,
+        as_attachment=True,
+        download_name=job.result_name
+    )
+
+@bp.route('/jobs/<int:job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_job(job_id):
+    job = _get_user_job(job_id)
+    cancelled = job_runner().cancel(job)
+    if _wants_json():
+        db.session.refresh(job)
+        return jsonify(job.to_dict())
+    
+    if cancelled:
+        flash('The export has been cancelled.', 'success')
+    else:
+        flash('The export has already finished.', 'info')
+    return redirect(url_for('main.job_detail', job_id=job.id))
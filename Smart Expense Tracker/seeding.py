@@ -0,0 +1,184 @@
+import math
+import random
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import insert, select
+from werkzeug.security import generate_password_hash
+
+from models import db, User, Group, Member, Bill, Product, ProductMember
+
+# Same choices as BillForm, weighted by how often each turns up in shared expenses,
+# with the median price of a single item in that category
+CATEGORY_WEIGHTS = {
+    'Food & Dining': (30, 14),
+    'Transportation': (12, 18),
+    'Entertainment': (10, 25),
+    'Shopping': (12, 30),
+    'Travel': (8, 90),
+    'Utilities': (8, 60),
+    'Healthcare': (4, 40),
+    'Education': (3, 50),
+    'Business': (3, 45),
+    'Other': (10, 20),
+}
+
+FIRST_NAMES = ['Aarav', 'Alex', 'Ana', 'Ben', 'Chen', 'Diya', 'Emma', 'Farah', 'Hiro', 'Isla', 'Jon', 'Kavya',
+               'Leo', 'Maya', 'Nia', 'Omar', 'Priya', 'Ravi', 'Sara', 'Tom', 'Uma', 'Vik', 'Yara', 'Zoe']
+
+# Every seeded user can log in with this password
+SEED_PASSWORD = 'password123'
+
+
+class PendingRow:
+    """A queued row; ``id`` is filled in once the database has inserted it"""
+
+    __slots__ = ('values', 'id')
+
+    def __init__(self, values):
+        self.values = values
+        self.id = None
+
+
+class BulkWriter:
+    """Writes rows with batched multi-row INSERTs and lets the database assign their ids.
+
+    ``add`` returns a PendingRow that later rows can use as a column value
+    before anything is written. Every batch inserts parents before children
+    with INSERT ... RETURNING, so children pick up their parents' real ids,
+    sequences stay in step and concurrent writers never collide. Each batch
+    is committed on its own.
+    """
+
+    TABLES = (User, Group, Member, Bill, Product, ProductMember)
+    # Nothing references these rows, so their ids are never read back
+    LEAVES = (ProductMember,)
+
+    def __init__(self, batch_rows=20000):
+        self.batch_rows = batch_rows
+        self.rows = {model: [] for model in self.TABLES}
+        self.counts = {model.__tablename__: 0 for model in self.TABLES}
+        self.pending = 0
+
+    def add(self, model, **values):
+        """Queue a row and return it; its ``id`` is set by the next flush"""
+        row = PendingRow(values)
+        self.rows[model].append(row)
+        self.counts[model.__tablename__] += 1
+        self.pending += 1
+        if self.pending >= self.batch_rows:
+            self.flush()
+        return row
+
+    def flush(self):
+        """Insert and commit every queued row"""
+        for model in self.TABLES:
+            rows = self.rows[model]
+            if not rows:
+                continue
+            params = [{key: value.id if isinstance(value, PendingRow) else value
+                       for key, value in row.values.items()} for row in rows]
+            if model in self.LEAVES:
+                db.session.execute(insert(model.__table__), params)
+            else:
+                for row, row_id in zip(rows, self._insert_returning_ids(model.__table__, params)):
+                    row.id = row_id
+                    row.values = None
+            self.rows[model] = []
+        db.session.commit()
+        self.pending = 0
+
+    @staticmethod
+    def _insert_returning_ids(table, params):
+        """Insert ``params`` and return the new ids in the same order"""
+        if db.session.get_bind().dialect.insert_executemany_returning_sort_by_parameter_order:
+            statement = insert(table).returning(table.c.id, sort_by_parameter_order=True)
+            return db.session.execute(statement, params).scalars().all()
+        # MySQL has no INSERT ... RETURNING; fall back to one statement per row
+        return [db.session.execute(insert(table).values(**values)).inserted_primary_key[0] for values in params]
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+
+def free_logins(prefix, count):
+    """Return ``count`` (username, email) pairs ``<prefix><n>`` that no account uses yet.
+
+    Numbering starts at 1 and skips any name or ``@example.com`` address that
+    is already taken, so seeding never collides with real or earlier accounts.
+    """
+    taken = set(db.session.execute(select(User.username).where(User.username.like(f'{prefix}%'))).scalars())
+    taken.update(email.split('@')[0] for email in db.session.execute(
+        select(User.email).where(User.email.like(f'{prefix}%@example.com'))).scalars())
+    logins = []
+    n = 0
+    while len(logins) < count:
+        n += 1
+        name = f'{prefix}{n}'
+        if name not in taken:
+            logins.append((name, f'{name}@example.com'))
+    return logins
+
+
+def seed_users(writer, users, rng, end_date, days=730, progress=None):
+    """Queue ``users`` accounts with realistically distributed groups, bills and splits.
+
+    Most users have a couple of groups of three to six people; bill counts per
+    group are long-tailed, most bills have a handful of items, and most items
+    are split between everyone present. Users are named ``user<n>``, skipping
+    names already in use. Returns the usernames.
+    """
+    categories = list(CATEGORY_WEIGHTS)
+    category_weights = [weight for weight, _ in CATEGORY_WEIGHTS.values()]
+    password_hash = generate_password_hash(SEED_PASSWORD)
+    now = datetime.utcnow()
+    usernames = []
+
+    for n, (username, email) in enumerate(free_logins('user', users)):
+        user = writer.add(User, username=username, email=email, password_hash=password_hash, created_at=now)
+        usernames.append(username)
+        for g in range(min(12, 1 + int(rng.expovariate(0.6)))):
+            group = writer.add(Group, name=f'Group {g + 1}', user_id=user, created_at=now)
+            size = rng.choices(range(2, 13), weights=[10, 18, 20, 16, 12, 8, 6, 4, 3, 2, 1])[0]
+            members = []
+            for m in range(size):
+                name = rng.choice(FIRST_NAMES)
+                members.append(writer.add(Member, name=name, email=f'{name.lower()}{m}@example.com',
+                                             mobile_number=f'+1{rng.randrange(10 ** 9, 10 ** 10)}',
+                                             group_id=group, created_at=now))
+
+            for b in range(min(300, max(1, int(rng.lognormvariate(2.7, 0.8))))):
+                category = rng.choices(categories, weights=category_weights)[0]
+                median_price = CATEGORY_WEIGHTS[category][1]
+                # Recent months are busier than older ones
+                bill_date = end_date - timedelta(days=int(days * rng.random() ** 1.5))
+                bill = writer.add(Bill, title=f'{category} {b + 1}', category=category, date=bill_date,
+                                     group_id=group, created_at=datetime.combine(bill_date, time(12)))
+                for p in range(rng.choices(range(1, 16), weights=[20, 18, 15, 12, 9, 7, 5, 4, 3, 2, 2, 1, 1, 1, 1])[0]):
+                    price = round(min(5000, rng.lognormvariate(math.log(median_price), 0.7)), 2)
+                    product = writer.add(Product, name=f'Item {p + 1}', price=price, bill_id=bill,
+                                            payer_id=rng.choice(members), created_at=now)
+                    split = rng.random()
+                    if split < 0.6:
+                        involved = members
+                    elif split < 0.85 and size > 2:
+                        involved = rng.sample(members, rng.randint(2, size - 1))
+                    else:
+                        involved = [rng.choice(members)]
+                    for member in involved:
+                        writer.add(ProductMember, product_id=product, member_id=member)
+        if progress is not None:
+            progress(n + 1)
+    return usernames
+
+
+def seed(users, seed=1, end_date=None, days=730, batch_rows=20000, progress=None):
+    """Write ``users`` seeded accounts and return (usernames, row counts per table).
+
+    The same ``seed`` and ``end_date`` always produce the same rows, apart from
+    ids and the usernames skipped because they were already taken.
+    """
+    writer = BulkWriter(batch_rows)
+    usernames = seed_users(writer, users, random.Random(seed), end_date or date.today(), days, progress)
+    writer.flush()
+    return usernames, writer.counts
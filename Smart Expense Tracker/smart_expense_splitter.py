@@ -1,71 +1,39 @@
-import os
-from flask import Flask, render_template, redirect, url_for, flash, request, jsonify, send_file
-from flask_sqlalchemy import SQLAlchemy
-from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
+from flask import Flask
+from flask_login import LoginManager, current_user
 from flask_wtf import CSRFProtect
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
-# import pandas as pd
-import io
-import json
-
-# Install email_validator package if not already installed
-try:
-    import email_validator
-except ImportError:
-    import subprocess
-    subprocess.check_call(["pip", "install", "email_validator"])
-
-# Initialize Flask app
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'default-dev-key')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///expense_splitter.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['WTF_CSRF_ENABLED'] = True
-app.config['WTF_CSRF_TIME_LIMIT'] = None  # No time limit for CSRF tokens
-
-# Initialize CSRF protection
-csrf = CSRFProtect(app)
-
-# Import models and initialize database
+
+from caching import init_fragment_cache, init_user_cache, user_cache
+from instrumentation import init_sql_monitor
+from jobs import init_jobs
 from models import db
-db.init_app(app)
+from storage import init_storage, upgrade_schema
 
-# Initialize login manager
+# Extensions are created unbound and attached to each app in create_app()
+csrf = CSRFProtect()
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
-
-# Import forms after initializing db to avoid circular imports
-from forms import LoginForm, RegistrationForm, GroupForm, BillForm, ProductForm
+login_manager.login_view = 'main.login'
 
 @login_manager.user_loader
 def load_user(user_id):
-    from models import User
-    return User.query.get(int(user_id))
-
-# Import routes
-from routes import *
+    return user_cache().load(int(user_id))
 
 # Currency formatting utility functions
-@app.template_filter('currency_format')
 def currency_format_filter(amount, currency=None):
     """Template filter to format currency amounts"""
     if currency is None and current_user.is_authenticated:
         currency = current_user.get_default_currency()
-    
+
     if currency:
         return currency.format_amount(amount)
     else:
         # Default fallback formatting
         return f"${amount:,.2f}"
 
-@app.template_filter('currency_format_simple')
 def currency_format_simple_filter(amount, currency=None):
     """Template filter to format currency amounts without symbol"""
     if currency is None and current_user.is_authenticated:
         currency = current_user.get_default_currency()
-    
+
     if currency:
         return currency.format_amount_simple(amount)
     else:
@@ -76,17 +44,57 @@ def format_amount_for_user(amount, user=None):
     """Helper function to format amount for a specific user"""
     if user is None:
         user = current_user
-    
+
     if user and user.is_authenticated:
         currency = user.get_default_currency()
         if currency:
             return currency.format_amount(amount)
-    
+
     # Default fallback
     return f"${amount:,.2f}"
 
+def create_app(config=None):
+    """Create and configure a Flask app.
+
+    ``config`` may be a mapping of settings or an object/import path accepted by
+    ``app.config.from_object``; it is applied on top of ``config.Config``.
+    """
+    app = Flask(__name__)
+    app.config.from_object('config.Config')
+    if isinstance(config, dict):
+        app.config.update(config)
+    elif config is not None:
+        app.config.from_object(config)
+
+    csrf.init_app(app)
+    init_storage(app, db)
+    init_sql_monitor(app, db)
+    # Optional subsystems are imported only by the apps that turn them on
+    if app.config.get('METRICS_ENABLED', True):
+        from metrics import init_metrics
+        init_metrics(app)
+    login_manager.init_app(app)
+    init_fragment_cache(app)
+    init_user_cache(app)
+    init_jobs(app)
+
+    # Routes pull in forms and WTForms validators, so import them only when an app is built
+    from routes import bp as main_bp
+    app.register_blueprint(main_bp)
+    from commands import init_commands
+    init_commands(app)
+
+    app.add_template_filter(currency_format_filter, 'currency_format')
+    app.add_template_filter(currency_format_simple_filter, 'currency_format_simple')
+    if app.config.get('PROFILING_ENABLED'):
+        from profiling import init_profiler
+        init_profiler(app)
+
+    return app
+
 # Run the application
 if __name__ == '__main__':
+    app = create_app()
     with app.app_context():
-        db.create_all()
-    app.run(debug=True)
\ No newline at end of file
+        upgrade_schema(db)
+    app.run(debug=True)
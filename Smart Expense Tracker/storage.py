@@ -0,0 +1,233 @@
+import logging
+import threading
+
+from sqlalchemy import Column, ForeignKeyConstraint, Integer, MetaData, Table, event, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.schema import AddConstraint, CreateColumn, CreateTable, DropConstraint
+
+logger = logging.getLogger(__name__)
+
+# Storage profiles understood by STORAGE_PROFILE
+STORAGE_PROFILES = ('tuned', 'legacy')
+
+
+def is_sqlite(uri):
+    """Check whether a database URI points at SQLite"""
+    return make_url(uri).get_backend_name() == 'sqlite'
+
+
+def engine_options(config):
+    """Build SQLAlchemy engine options for the configured database"""
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    if is_sqlite(uri):
+        # The driver-level timeout is what pysqlite waits on a locked database
+        # before raising "database is locked"; keep it in step with busy_timeout
+        timeout_ms = config.get('SQLITE_BUSY_TIMEOUT_MS', 5000)
+        return {'connect_args': {'timeout': timeout_ms / 1000.0}}
+
+    return {
+        'pool_size': config.get('DB_POOL_SIZE', 10),
+        'max_overflow': config.get('DB_MAX_OVERFLOW', 20),
+        'pool_recycle': config.get('DB_POOL_RECYCLE', 1800),
+        'pool_timeout': config.get('DB_POOL_TIMEOUT', 30),
+        'pool_pre_ping': config.get('DB_POOL_PRE_PING', True),
+    }
+
+
+def sqlite_pragmas(config):
+    """Return the (pragma, value) pairs applied to each new SQLite connection"""
+    profile = config.get('STORAGE_PROFILE', 'tuned')
+    if profile not in STORAGE_PROFILES:
+        raise ValueError(f"Unknown STORAGE_PROFILE '{profile}', expected one of {', '.join(STORAGE_PROFILES)}")
+    if profile == 'legacy':
+        return []
+
+    return [
+        ('journal_mode', config.get('SQLITE_JOURNAL_MODE', 'WAL')),
+        ('synchronous', config.get('SQLITE_SYNCHRONOUS', 'NORMAL')),
+        ('busy_timeout', int(config.get('SQLITE_BUSY_TIMEOUT_MS', 5000))),
+        ('mmap_size', int(config.get('SQLITE_MMAP_SIZE', 0))),
+        # A negative cache_size is interpreted by SQLite as KiB rather than pages
+        ('cache_size', -int(config.get('SQLITE_CACHE_SIZE_KB', 2000))),
+    ]
+
+
+def apply_sqlite_pragmas(engine, config):
+    """Register a connect hook that applies the profile's pragmas to an SQLite engine.
+
+    Foreign keys are enforced under every profile: SQLite leaves them off by
+    default, and deletes rely on their ON DELETE CASCADE actions.
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = [('foreign_keys', 'ON')] + sqlite_pragmas(config)
+
+    @event.listens_for(engine, 'connect')
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas:
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+
+
+def init_storage(app, db):
+    """Configure the engine for the app's storage profile and initialize the database"""
+    options = engine_options(app.config)
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+    db.init_app(app)
+
+    with app.app_context():
+        apply_sqlite_pragmas(db.engine, app.config)
+    require_upgraded_schema(app, db)
+
+
+def _stale_foreign_keys(table, inspector):
+    """Return the table's reflected foreign keys whose ON DELETE action differs from the model's"""
+    wanted = {(tuple(column.name for column in fk.columns), fk.referred_table.name): (fk.ondelete or '').upper()
+              for fk in table.foreign_key_constraints}
+    stale = []
+    for fk in inspector.get_foreign_keys(table.name):
+        key = (tuple(fk['constrained_columns']), fk['referred_table'])
+        if key in wanted and wanted[key] != (fk['options'].get('ondelete') or '').upper():
+            stale.append(fk)
+    return stale
+
+
+def _rebuild_sqlite_tables(engine, tables):
+    """Recreate SQLite tables from their model definitions, keeping their rows.
+
+    SQLite cannot alter a constraint, so each table is copied into a new one
+    with foreign keys switched off, as SQLite's documentation describes; the
+    whole rebuild is one transaction.
+    """
+    preparer = engine.dialect.identifier_preparer
+    with engine.connect() as conn:
+        conn.exec_driver_sql('PRAGMA foreign_keys=OFF')
+        dbapi_connection = conn.connection.driver_connection
+        # Let the statements below manage the transaction, DDL included
+        isolation_level, dbapi_connection.isolation_level = dbapi_connection.isolation_level, None
+        try:
+            conn.exec_driver_sql('BEGIN')
+            try:
+                for table in tables:
+                    name = preparer.format_table(table)
+                    temporary = preparer.quote(f'_rebuild_{table.name}')
+                    ddl = str(CreateTable(table).compile(dialect=engine.dialect))
+                    conn.exec_driver_sql(ddl.replace(f'CREATE TABLE {name} (', f'CREATE TABLE {temporary} (', 1))
+                    columns = ', '.join(preparer.quote(column['name']) for column in inspect(conn).get_columns(table.name)
+                                        if column['name'] in table.columns)
+                    conn.exec_driver_sql(f'INSERT INTO {temporary} ({columns}) SELECT {columns} FROM {name}')
+                    conn.exec_driver_sql(f'DROP TABLE {name}')
+                    conn.exec_driver_sql(f'ALTER TABLE {temporary} RENAME TO {name}')
+                    for index in table.indexes:
+                        index.create(conn)
+                orphans = conn.exec_driver_sql('PRAGMA foreign_key_check').fetchall()
+                conn.exec_driver_sql('COMMIT')
+            except Exception:
+                conn.exec_driver_sql('ROLLBACK')
+                raise
+        finally:
+            dbapi_connection.isolation_level = isolation_level
+            conn.exec_driver_sql('PRAGMA foreign_keys=ON')
+    if orphans:
+        logger.warning('%d rows reference rows that no longer exist; see PRAGMA foreign_key_check', len(orphans))
+
+
+def upgrade_foreign_keys(db):
+    """Give existing tables the ON DELETE actions of the models' foreign keys"""
+    engine = db.engine
+    inspector = inspect(engine)
+    stale = {table: _stale_foreign_keys(table, inspector) for table in db.metadata.sorted_tables}
+    stale = {table: fks for table, fks in stale.items() if fks}
+    if not stale:
+        return
+    logger.info('Updating foreign keys of %s', ', '.join(table.name for table in stale))
+    if engine.dialect.name == 'sqlite':
+        _rebuild_sqlite_tables(engine, list(stale))
+        return
+    with engine.begin() as conn:
+        for table, fks in stale.items():
+            for reflected in fks:
+                old = ForeignKeyConstraint(reflected['constrained_columns'],
+                                           [f"{reflected['referred_table']}.{column}" for column in reflected['referred_columns']],
+                                           name=reflected['name'])
+                # DropConstraint only needs the constraint's name and its table
+                Table(table.name, MetaData(), *(Column(column, Integer) for column in reflected['constrained_columns']), old)
+                conn.execute(DropConstraint(old))
+                for fk in table.foreign_key_constraints:
+                    if [column.name for column in fk.columns] == reflected['constrained_columns']:
+                        conn.execute(AddConstraint(fk))
+
+
+def pending_upgrades(db):
+    """Describe the missing tables and columns and outdated foreign keys upgrade_schema() would fix"""
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    pending = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            pending.append(f'missing table {table.name}')
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        pending.extend(f'missing column {table.name}.{column.name}' for column in table.columns
+                       if column.name not in existing)
+        pending.extend(f"outdated foreign key {table.name}({', '.join(fk['constrained_columns'])})"
+                       for fk in _stale_foreign_keys(table, inspector))
+    return pending
+
+
+def require_upgraded_schema(app, db):
+    """Answer requests with 503 until the database has been upgraded to the models' schema.
+
+    Deletes rely on the foreign keys' ON DELETE actions, so serving an older
+    database would fail or leave orphaned rows. The check runs before the
+    first request a process serves rather than when the app is built, so
+    ``flask upgrade-db`` and scripts can still build the app; once the
+    database is current it is not repeated.
+    """
+    lock = threading.Lock()
+    state = {'current': False}
+
+    def check_schema():
+        if state['current']:
+            return None
+        with lock:
+            if not state['current']:
+                pending = pending_upgrades(db)
+                if pending:
+                    logger.error('The database needs upgrading, run `flask upgrade-db`: %s', '; '.join(pending))
+                    return 'The database needs upgrading; run `flask upgrade-db`.', 503
+                state['current'] = True
+        return None
+
+    app.before_request(check_schema)
+
+
+def upgrade_schema(db):
+    """Create missing tables and add columns and indexes introduced since the database was created.
+
+    New columns must be nullable or carry a server default so existing rows
+    stay valid. Foreign keys are then brought in line with the models, see
+    upgrade_foreign_keys.
+    """
+    db.create_all()
+    engine = db.engine
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN {ddl}'))
+            indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(conn)
+    upgrade_foreign_keys(db)
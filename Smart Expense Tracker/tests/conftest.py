@@ -0,0 +1,45 @@
+import logging
+
+import pytest
+
+from benchmarks.datagen import generate
+from models import db
+from smart_expense_splitter import create_app
+
+
+@pytest.fixture
+def app(tmp_path):
+    """An app on a fresh SQLite database, with CSRF off and jobs run inline"""
+    # Per-request SQL reports would flood the captured log
+    logging.getLogger('sqlperf').setLevel(logging.ERROR)
+    app = create_app({
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'test.db'),
+        'FRAGMENT_CACHE_BACKEND': 'none',
+        'JOB_WORKERS': 0,
+        'JOB_RESULTS_PATH': str(tmp_path / 'jobs'),
+    })
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def dataset(app):
+    """One account with two groups of four members, six bills each and three products per bill"""
+    with app.app_context():
+        return generate(users=1, groups=2, members=4, bills=6, products=3, seed=3)
+
+
+@pytest.fixture
+def client(app, dataset):
+    """A test client signed in as the dataset's user"""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(dataset.user_ids[0])
+        session['_fresh'] = True
+    return client
@@ -0,0 +1,86 @@
+from flask import session
+
+from caching import make_etag
+from models import db, Bill, Product
+
+
+def edit_product(client, app, bill_id, **changes):
+    """Post the edit form of the bill's first product with ``changes`` applied"""
+    with app.app_context():
+        product = Product.query.filter_by(bill_id=bill_id).order_by(Product.id).first()
+        data = {'name': product.name, 'price': product.price, 'payer': product.payer_id,
+                'members_involved': [pm.member_id for pm in product.members_involved]}
+        product_id = product.id
+    data.update(changes)
+    response = client.post(f'/product/{product_id}/edit', data=data)
+    assert response.status_code == 302
+    # Render the flash message, which would otherwise prevent the next 304
+    client.get('/dashboard')
+
+
+def current_etag(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    return response.headers['ETag']
+
+
+def test_bill_detail_is_not_modified_until_its_group_changes(client, app, dataset):
+    url = f'/bill/{dataset.bill_ids[0]}'
+    # The first view renders the session's CSRF token, which must not change the ETag
+    first = client.get(url)
+    assert first.headers['Cache-Control'] == 'private, no-cache'
+    assert first.headers['Vary'] == 'Cookie'
+    etag = first.headers['ETag']
+
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+
+    edit_product(client, app, dataset.bill_ids[0], price=123.45)
+    changed = client.get(url, headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert b'123.45' in changed.data
+    assert client.get(url, headers={'If-None-Match': changed.headers['ETag']}).status_code == 304
+
+
+def test_bill_detail_ignores_changes_to_other_groups(client, app, dataset):
+    url = f'/bill/{dataset.bill_ids[0]}'
+    etag = current_etag(client, url)
+    with app.app_context():
+        other_bill = Bill.query.filter(Bill.group_id == dataset.group_ids[1]).order_by(Bill.id).first().id
+
+    edit_product(client, app, other_bill, price=99.0)
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_user_data_endpoints_change_with_any_group(client, app, dataset):
+    with app.app_context():
+        year = db.session.get(Bill, dataset.bill_ids[0]).date.year
+    url = f'/api/analytics/monthly-data/{year}'
+    etag = current_etag(client, url)
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+
+    with app.app_context():
+        other_bill = Bill.query.filter(Bill.group_id == dataset.group_ids[1]).order_by(Bill.id).first().id
+    edit_product(client, app, other_bill, price=99.0)
+    changed = client.get(url, headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+
+
+def test_flash_messages_are_never_answered_with_304(client, app, dataset):
+    url = f'/bill/{dataset.bill_ids[0]}'
+    etag = current_etag(client, url)
+    with client.session_transaction() as session:
+        session['_flashes'] = [('success', 'Saved')]
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert b'Saved' in response.data
+
+
+def test_etags_are_keyed_on_the_signed_in_user(app):
+    etags = []
+    for user_id in ('1', '2'):
+        with app.test_request_context('/'):
+            session['_user_id'] = user_id
+            etags.append(make_etag('bill', 1, 1))
+    assert etags[0] != etags[1]
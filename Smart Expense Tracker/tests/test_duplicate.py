@@ -0,0 +1,89 @@
+from datetime import date
+
+import pytest
+
+from models import db, Bill, Group, Product, match_members
+
+
+def contents(bill_id, member_map=None):
+    """The bill's products in id order as (name, price, payer, sorted member ids)"""
+    member_map = member_map or {}
+    products = Product.query.filter_by(bill_id=bill_id).order_by(Product.id)
+    return [(product.name, product.price, member_map.get(product.payer_id, product.payer_id),
+             sorted(member_map.get(pm.member_id, pm.member_id) for pm in product.members_involved))
+            for product in products]
+
+
+def test_duplicate_within_the_group_copies_products_and_members(app, dataset):
+    with app.app_context():
+        bill = db.session.get(Bill, dataset.bill_ids[0])
+        original = contents(bill.id)
+        copy = bill.duplicate(title='Copy', date=date(2025, 12, 1))
+        db.session.commit()
+
+        assert (copy.title, copy.date, copy.group_id, copy.category) == ('Copy', date(2025, 12, 1),
+                                                                          bill.group_id, bill.category)
+        assert contents(copy.id) == original
+        assert contents(bill.id) == original
+        assert not {p.id for p in copy.products} & {p.id for p in bill.products}
+
+
+def test_duplicate_into_another_group_maps_every_member(app, dataset):
+    with app.app_context():
+        bill = db.session.get(Bill, dataset.bill_ids[0])
+        target = db.session.get(Group, dataset.group_ids[1])
+        used = bill.used_member_ids()
+        # Generated groups repeat the same people, so they match by mobile number and email
+        member_map = match_members([m for m in bill.group.members if m.id in used], target.members)
+        assert set(member_map) == used
+        assert {member.id for member in target.members} >= set(member_map.values())
+
+        copy = bill.duplicate(target.id, member_map)
+        db.session.commit()
+
+        assert copy.group_id == target.id
+        assert contents(copy.id) == contents(bill.id, member_map)
+
+
+def test_duplicate_refuses_an_incomplete_member_map(app, dataset):
+    with app.app_context():
+        bill = db.session.get(Bill, dataset.bill_ids[0])
+        target = db.session.get(Group, dataset.group_ids[1])
+        member_map = match_members(bill.group.members, target.members)
+        member_map.pop(next(iter(bill.used_member_ids())))
+        bills_before = Bill.query.count()
+
+        with pytest.raises(ValueError):
+            bill.duplicate(target.id, member_map)
+        db.session.rollback()
+        assert Bill.query.count() == bills_before
+
+
+def test_duplicate_of_a_settled_bill_is_open(client, app, dataset):
+    bill_id = dataset.bill_ids[0]
+    client.post(f'/bill/{bill_id}/settle')
+    response = client.post(f'/bill/{bill_id}/duplicate', data={
+        'title': 'Next month', 'date': '2025-12-01', 'group': dataset.group_ids[0]})
+    assert response.status_code == 302
+    with app.app_context():
+        copy = Bill.query.filter_by(title='Next month').one()
+        assert not copy.is_settled
+        assert db.session.get(Bill, bill_id).is_settled
+        assert contents(copy.id) == contents(bill_id)
+
+
+def test_duplicate_route_uses_the_chosen_members(client, app, dataset):
+    with app.app_context():
+        bill = db.session.get(Bill, dataset.bill_ids[0])
+        target = db.session.get(Group, dataset.group_ids[1])
+        # Send every member of the bill to the target's first member
+        first_target = min(member.id for member in target.members)
+        member_map = {member_id: first_target for member_id in bill.used_member_ids()}
+    data = {'title': 'Moved', 'date': '2025-12-01', 'group': dataset.group_ids[1]}
+    data.update({f'member_{member_id}': target_id for member_id, target_id in member_map.items()})
+    assert client.post(f'/bill/{dataset.bill_ids[0]}/duplicate', data=data).status_code == 302
+    with app.app_context():
+        copy = Bill.query.filter_by(title='Moved').one()
+        assert copy.group_id == dataset.group_ids[1]
+        assert {pm.member_id for product in copy.products for pm in product.members_involved} == {first_target}
+        assert {product.payer_id for product in copy.products} == {first_target}
@@ -0,0 +1,106 @@
+import pytest
+
+from caching import MemoryFragmentCache, SQLiteFragmentCache, fragment_cache
+from models import db, Currency, User, populate_initial_currencies
+from smart_expense_splitter import create_app
+from tests.test_caching import edit_product
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def cache(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryFragmentCache(max_entries=50)
+    return SQLiteFragmentCache(str(tmp_path / 'fragments.db'), max_entries=50, touch_batch=10)
+
+
+def test_fragments_are_stored_and_invalidated_by_bill_or_group(cache):
+    cache.set('a', '<p>a</p>', bill_id=1, group_id=10)
+    cache.set('b', '<p>b</p>', bill_id=2, group_id=10)
+    cache.set('c', '<p>c</p>', bill_id=3, group_id=20)
+    assert cache.get('a') == '<p>a</p>'
+    assert cache.get('missing') is None
+
+    cache.invalidate(bill_id=1)
+    assert cache.get('a') is None
+    assert cache.get('b') == '<p>b</p>'
+    cache.invalidate(group_id=10)
+    assert cache.get('b') is None
+    assert cache.get('c') == '<p>c</p>'
+
+    stats = cache.stats()
+    assert (stats['entries'], stats['hits'], stats['misses']) == (1, 3, 3)
+    cache.clear()
+    assert cache.stats()['entries'] == 0
+
+
+def test_least_recently_used_fragments_are_trimmed(cache):
+    for i in range(100):
+        cache.set(f'k{i}', 'x')
+        if i in (40, 80):
+            assert cache.get('k0') == 'x'
+    # The SQLite backend trims every hundredth write; both keep the 50 most recently used
+    assert cache.stats()['entries'] == 50
+    assert cache.get('k0') == 'x'
+    assert cache.get('k1') is None
+    assert cache.get('k99') == 'x'
+
+
+def test_sqlite_hits_do_not_write_until_a_batch_is_full(tmp_path):
+    cache = SQLiteFragmentCache(str(tmp_path / 'fragments.db'), touch_batch=3)
+    cache.set('a', 'x')
+    statements = []
+    cache._connection().set_trace_callback(statements.append)
+
+    cache.get('a')
+    cache.get('a')
+    cache.set('b', 'x')
+    cache.set('c', 'x')
+    assert not [statement for statement in statements if statement.startswith('UPDATE')]
+
+    statements.clear()
+    cache.get('b')
+    cache.get('c')
+    # The third distinct key fills the batch; one transaction writes all three access times
+    updates = [statement for statement in statements if statement.startswith('UPDATE')]
+    assert len(updates) == 3
+    assert statements.index('BEGIN') < statements.index(updates[0])
+    assert statements.index('COMMIT') > statements.index(updates[-1])
+
+
+@pytest.fixture
+def cached_client(app, dataset):
+    """A signed-in client of an app sharing the test database, with the memory fragment cache"""
+    cached_app = create_app({**app.config, 'FRAGMENT_CACHE_BACKEND': 'memory'})
+    client = cached_app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(dataset.user_ids[0])
+        session['_fresh'] = True
+    return cached_app, client
+
+
+def test_bill_page_fragments_follow_the_bill_version(cached_client, dataset):
+    cached_app, client = cached_client
+    url = f'/bill/{dataset.bill_ids[0]}'
+    client.get(url)
+    with cached_app.app_context():
+        stats = fragment_cache().stats()
+        assert stats['entries'] == 2
+    client.get(url)
+    with cached_app.app_context():
+        assert fragment_cache().stats()['hits'] == stats['hits'] + 2
+
+    edit_product(client, cached_app, dataset.bill_ids[0], price=4321.5)
+    page = client.get(url).get_data(as_text=True)
+    # The member summary is rendered again for the new version, not served from the cache
+    assert '"paid": 4321.5' in page
+
+
+def test_bill_page_fragments_follow_the_currency(cached_client, dataset):
+    cached_app, client = cached_client
+    url = f'/bill/{dataset.bill_ids[0]}'
+    assert '€' not in client.get(url).get_data(as_text=True)
+    with cached_app.app_context():
+        populate_initial_currencies()
+        euro = Currency.query.filter_by(code='EUR').one()
+        db.session.get(User, dataset.user_ids[0]).add_currency(euro.id, is_default=True)
+    assert '€' in client.get(url).get_data(as_text=True)
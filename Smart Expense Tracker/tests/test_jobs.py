@@ -0,0 +1,73 @@
+import json
+import re
+
+import pytest
+
+from models import db, Job
+from smart_expense_splitter import create_app
+
+
+@pytest.fixture
+def queued_job(app, dataset):
+    """Id of a bill export left queued by another process"""
+    with app.app_context():
+        job = Job(user_id=dataset.user_ids[0], kind='bill_csv', params=json.dumps({'bill_id': dataset.bill_ids[0]}))
+        db.session.add(job)
+        db.session.commit()
+        return job.id
+
+
+def other_process(app, tmp_path, **config):
+    """A second app on the same database, as another process would build it"""
+    return create_app({**app.config, 'JOB_RESULTS_PATH': str(tmp_path / 'other-jobs'), **config})
+
+
+def job_status(app, job_id):
+    with app.app_context():
+        return db.session.get(Job, job_id).status
+
+
+def test_building_an_app_leaves_queued_jobs_alone(app, tmp_path, queued_job):
+    other = other_process(app, tmp_path)
+    with other.app_context():
+        db.session.query(Job).count()
+    other.test_cli_runner().invoke(args=['prune-activity'])
+    assert job_status(app, queued_job) == Job.QUEUED
+
+
+def test_serving_a_request_resumes_queued_jobs(app, tmp_path, queued_job):
+    other = other_process(app, tmp_path)
+    other.test_client().get('/login')
+    assert job_status(app, queued_job) == Job.DONE
+
+
+def test_job_recover_off_leaves_jobs_to_other_processes(app, tmp_path, queued_job):
+    other = other_process(app, tmp_path, JOB_RECOVER=False)
+    other.test_client().get('/login')
+    assert job_status(app, queued_job) == Job.QUEUED
+
+
+def test_exports_are_only_started_by_a_post(client, app, dataset):
+    url = f'/bill/{dataset.bill_ids[0]}/export/csv'
+    assert client.get(url).status_code == 405
+    response = client.post(url)
+    assert response.status_code == 302
+    assert '/jobs/' in response.headers['Location']
+
+
+def test_exports_require_the_csrf_token(app, tmp_path, dataset):
+    other = other_process(app, tmp_path, WTF_CSRF_ENABLED=True)
+    client = other.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(dataset.user_ids[0])
+        session['_fresh'] = True
+    url = f'/analytics/group/{dataset.group_ids[0]}/export/csv'
+    assert client.post(url).status_code == 400
+    with app.app_context():
+        assert Job.query.count() == 0
+
+    page = client.get(f'/analytics/group/{dataset.group_ids[0]}').get_data(as_text=True)
+    token = re.search(r'name="csrf_token" value="([^"]+)"', page).group(1)
+    assert client.post(url, data={'csrf_token': token}).status_code == 302
+    with app.app_context():
+        assert Job.query.count() == 1
@@ -0,0 +1,110 @@
+from collections import defaultdict
+
+import pytest
+
+from models import db, Bill, Group, GroupRollup, Member, Product, ProductMember
+
+
+def shares(group_id):
+    """{product_id: sorted member ids} of every product in the group"""
+    rows = db.session.query(ProductMember.product_id, ProductMember.member_id) \
+        .join(Product).join(Bill).filter(Bill.group_id == group_id)
+    result = defaultdict(list)
+    for product_id, member_id in rows:
+        result[product_id].append(member_id)
+    return {product_id: sorted(member_ids) for product_id, member_ids in result.items()}
+
+
+def payers(group_id):
+    """{product_id: payer id} of every product in the group"""
+    return dict(db.session.query(Product.id, Product.payer_id).join(Bill).filter(Bill.group_id == group_id))
+
+
+def add_twins(group):
+    """Add two members of group who are one person, and a product both share and the second paid"""
+    first = Member(name='Twin', email='twin@example.com', mobile_number='+44 7000 000001', group_id=group.id)
+    second = Member(name='Twin again', email='TWIN@example.com', mobile_number='+44 7000 000002', group_id=group.id)
+    db.session.add_all([first, second])
+    db.session.flush()
+    product = Product(name='Shared', price=12.0, bill_id=group.bills[0].id, payer_id=second.id)
+    db.session.add(product)
+    db.session.flush()
+    db.session.add_all([ProductMember(product_id=product.id, member_id=first.id),
+                        ProductMember(product_id=product.id, member_id=second.id)])
+    db.session.commit()
+    return first.id, second.id, product.id
+
+
+def test_merge_combines_members_matching_by_mobile_or_email(app, dataset):
+    with app.app_context():
+        source, target = (db.session.get(Group, group_id) for group_id in dataset.group_ids)
+        # Generated groups repeat the same people, so every member has a duplicate in target
+        plan = source.member_merge_plan(target)
+        assert set(plan) == {member.id for member in source.members}
+        assert set(plan.values()) <= {member.id for member in target.members}
+        target_members = {member.id for member in target.members}
+        expected_shares = {**shares(target.id), **{product_id: sorted({plan[m] for m in member_ids})
+                                                   for product_id, member_ids in shares(source.id).items()}}
+        expected_payers = {**payers(target.id), **{product_id: plan[payer_id]
+                                                   for product_id, payer_id in payers(source.id).items()}}
+        source_id, target_id = source.id, target.id
+
+        assert source.merge_into(target) == plan
+        db.session.commit()
+
+        assert db.session.get(Group, source_id) is None
+        assert db.session.get(GroupRollup, source_id) is None
+        assert Bill.query.filter_by(group_id=source_id).count() == 0
+        assert {member.id for member in Member.query.filter_by(group_id=target_id)} == target_members
+        assert shares(target_id) == expected_shares
+        assert payers(target_id) == expected_payers
+
+
+def test_merge_keeps_totals_and_balances(app, dataset):
+    with app.app_context():
+        source, target = (db.session.get(Group, group_id) for group_id in dataset.group_ids)
+        plan = source.member_merge_plan(target)
+        rollups = [source.get_rollup(), target.get_rollup()]
+        db.session.commit()
+        expected_total = sum(rollup.total for rollup in rollups)
+        expected_balances = defaultdict(lambda: [0, 0])
+        for rollup in rollups:
+            for member_id, (paid, owes) in rollup.get_balances().items():
+                balance = expected_balances[plan.get(member_id, member_id)]
+                balance[0] += paid
+                balance[1] += owes
+
+        source.merge_into(target)
+        db.session.commit()
+        rollup = db.session.get(Group, dataset.group_ids[1]).get_rollup()
+        db.session.commit()
+
+        assert rollup.total == pytest.approx(expected_total)
+        assert rollup.bill_count == len(dataset.bill_ids)
+        assert rollup.get_balances() == {member_id: pytest.approx(tuple(balance))
+                                         for member_id, balance in expected_balances.items()}
+
+
+def test_merge_drops_the_share_of_a_duplicate_sharing_the_same_product(app, dataset):
+    with app.app_context():
+        source, target = (db.session.get(Group, group_id) for group_id in dataset.group_ids)
+        first, second, product_id = add_twins(source)
+        assert source.member_merge_plan(target)[second] == first
+
+        source.merge_into(target)
+        db.session.commit()
+
+        assert db.session.get(Member, second) is None
+        assert db.session.get(Member, first).group_id == target.id
+        assert [pm.member_id for pm in ProductMember.query.filter_by(product_id=product_id)] == [first]
+        assert db.session.get(Product, product_id).payer_id == first
+
+
+def test_merge_route_moves_everything_into_the_target(client, app, dataset):
+    source_id, target_id = dataset.group_ids
+    response = client.post(f'/group/{source_id}/merge', data={'target': target_id})
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith(f'/group/{target_id}')
+    with app.app_context():
+        assert db.session.get(Group, source_id) is None
+        assert Bill.query.filter_by(group_id=target_id).count() == len(dataset.bill_ids)
@@ -0,0 +1,37 @@
+import pytest
+
+from smart_expense_splitter import create_app
+
+GUARDED = ['/metrics', '/api/cache/stats']
+
+
+def production_app(app, **config):
+    """An app on the test database as a deployment runs it, out of testing mode"""
+    return create_app({**app.config, 'TESTING': False, **config})
+
+
+@pytest.mark.parametrize('url', GUARDED)
+def test_metrics_are_hidden_without_a_token(app, url):
+    assert production_app(app).test_client().get(url).status_code == 404
+
+
+@pytest.mark.parametrize('url', GUARDED)
+def test_metrics_require_the_configured_token(app, url):
+    client = production_app(app, METRICS_TOKEN='s3cret').test_client()
+    assert client.get(url).status_code == 401
+    assert client.get(url, headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    assert client.get(url, headers={'Authorization': 'Bearer s3cret'}).status_code == 200
+
+
+@pytest.mark.parametrize('url', GUARDED)
+def test_metrics_are_open_in_testing_and_debug(app, url):
+    assert app.test_client().get(url).status_code == 200
+    debug = production_app(app)
+    debug.debug = True
+    assert debug.test_client().get(url).status_code == 200
+
+
+def test_metrics_disabled_are_not_found(app):
+    client = production_app(app, METRICS_ENABLED=False, METRICS_TOKEN='s3cret').test_client()
+    for url in GUARDED:
+        assert client.get(url, headers={'Authorization': 'Bearer s3cret'}).status_code == 404
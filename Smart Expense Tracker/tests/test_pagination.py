@@ -0,0 +1,69 @@
+from datetime import date
+
+from benchmarks.datagen import generate
+from models import db, Bill, Group
+
+
+def expected_order(group_id):
+    bills = Bill.query.filter_by(group_id=group_id).all()
+    return [bill.id for bill in sorted(bills, key=lambda bill: (bill.date, bill.id), reverse=True)]
+
+
+def walk(group, limit):
+    """Collect every page of the group's bills, following the keyset cursor"""
+    seen, after = [], None
+    while True:
+        rows, has_more = group.bill_page(after, limit)
+        seen.append([bill.id for bill, _, _ in rows])
+        if not has_more:
+            return seen
+        last = rows[-1][0]
+        after = (last.date, last.id)
+
+
+def test_pages_cover_every_bill_once_newest_first(app, dataset):
+    with app.app_context():
+        group = db.session.get(Group, dataset.group_ids[0])
+        pages = walk(group, limit=4)
+        assert [len(page) for page in pages] == [4, 2]
+        assert [bill_id for page in pages for bill_id in page] == expected_order(group.id)
+
+
+def test_bills_on_the_same_date_are_ordered_by_id(app, dataset):
+    with app.app_context():
+        group = db.session.get(Group, dataset.group_ids[0])
+        Bill.query.filter_by(group_id=group.id).update({Bill.date: date(2025, 6, 1)})
+        db.session.commit()
+        pages = walk(group, limit=2)
+        assert [len(page) for page in pages] == [2, 2, 2]
+        bill_ids = [bill_id for page in pages for bill_id in page]
+        assert bill_ids == sorted(dataset.bill_ids[:6], reverse=True)
+
+
+def test_page_rows_carry_product_counts_and_totals(app, dataset):
+    with app.app_context():
+        group = db.session.get(Group, dataset.group_ids[0])
+        rows, _ = group.bill_page(limit=10)
+        for bill, product_count, total in rows:
+            assert product_count == len(bill.products) == 3
+            assert round(total, 2) == round(bill.get_total_amount(), 2)
+
+
+def test_api_follows_the_cursor_in_next_url(client, app, dataset):
+    group_id = dataset.group_ids[0]
+    first = client.get(f'/api/group/{group_id}/bills?limit=2').get_json()
+    assert len(first['bills']) == 2
+    assert first['next_url']
+
+    rest = client.get(first['next_url']).get_json()
+    assert rest['next_url'] is None
+    with app.app_context():
+        assert [bill['id'] for bill in first['bills'] + rest['bills']] == expected_order(group_id)
+
+
+def test_api_rejects_malformed_cursors_and_other_users(client, app, dataset):
+    group_id = dataset.group_ids[0]
+    assert client.get(f'/api/group/{group_id}/bills?after=yesterday').status_code == 400
+    with app.app_context():
+        other = generate(users=1, groups=1, seed=9)
+    assert client.get(f'/api/group/{other.group_ids[0]}/bills').status_code == 403
@@ -0,0 +1,109 @@
+import pytest
+
+from models import db, Bill, Member, Product, ProductMember
+
+
+def share_rows(product_ids):
+    """{(product_id, member_id): row id} of the given products"""
+    rows = db.session.query(ProductMember.product_id, ProductMember.member_id, ProductMember.id) \
+        .filter(ProductMember.product_id.in_(product_ids))
+    return {(product_id, member_id): row_id for product_id, member_id, row_id in rows}
+
+
+def bill_setup(dataset):
+    bill = db.session.get(Bill, dataset.bill_ids[0])
+    product_ids = [product.id for product in sorted(bill.products, key=lambda product: product.id)]
+    member_ids = [member.id for member in Member.query.filter_by(group_id=bill.group_id).order_by(Member.id)]
+    return bill, product_ids, member_ids
+
+
+def test_sync_writes_only_the_differences(app, dataset):
+    with app.app_context():
+        _, product_ids, member_ids = bill_setup(dataset)
+        product_id = product_ids[0]
+        first, second, third = ((product_id, member_id) for member_id in member_ids[:3])
+        ProductMember.sync(set(share_rows([product_id])), {first, second})
+        db.session.commit()
+        before = share_rows([product_id])
+
+        added, removed = ProductMember.sync({first, second}, {first, third})
+        db.session.commit()
+
+        assert (added, removed) == ({third}, {second})
+        after = share_rows([product_id])
+        assert set(after) == {first, third}
+        # The unchanged row was neither deleted nor reinserted
+        assert after[first] == before[first]
+
+
+def test_sync_of_equal_sets_changes_nothing(app, dataset):
+    with app.app_context():
+        _, product_ids, _ = bill_setup(dataset)
+        before = share_rows(product_ids)
+        assert ProductMember.sync(set(before), set(before)) == (set(), set())
+        db.session.commit()
+        assert share_rows(product_ids) == before
+
+
+def test_edit_product_keeps_rows_of_members_still_involved(client, app, dataset):
+    with app.app_context():
+        _, product_ids, member_ids = bill_setup(dataset)
+        product = db.session.get(Product, product_ids[0])
+        before = share_rows([product.id])
+        payer_id, price = product.payer_id, product.price
+    wanted = member_ids[:2]
+    response = client.post(f'/product/{product_ids[0]}/edit', data={
+        'name': 'Edited', 'price': price, 'payer': payer_id, 'members_involved': wanted})
+    assert response.status_code == 302
+    with app.app_context():
+        after = share_rows([product_ids[0]])
+        assert sorted(member_id for _, member_id in after) == wanted
+        for pair, row_id in after.items():
+            if pair in before:
+                assert row_id == before[pair]
+
+
+@pytest.mark.parametrize('mode, given, expected', [
+    ('replace', [2], [2]),
+    ('add', [2], [0, 1, 2]),
+    ('remove', [1], [0]),
+])
+def test_bulk_edit_members(app, dataset, mode, given, expected):
+    with app.app_context():
+        bill, product_ids, member_ids = bill_setup(dataset)
+        bill.bulk_edit_products(product_ids, member_ids=member_ids[:2])
+        db.session.commit()
+
+        edited = bill.bulk_edit_products(product_ids, member_ids=[member_ids[i] for i in given], mode=mode)
+        db.session.commit()
+
+        assert edited == len(product_ids)
+        assert set(share_rows(product_ids)) == {(product_id, member_ids[i])
+                                                for product_id in product_ids for i in expected}
+
+
+def test_bulk_edit_refuses_to_leave_a_product_without_members(app, dataset):
+    with app.app_context():
+        bill, product_ids, member_ids = bill_setup(dataset)
+        before = share_rows(product_ids)
+        version = bill.version
+        with pytest.raises(ValueError):
+            bill.bulk_edit_products(product_ids, member_ids=member_ids, mode='remove')
+        db.session.rollback()
+        assert share_rows(product_ids) == before
+        assert db.session.get(Bill, bill.id).version == version
+
+
+def test_bulk_edit_payer_ignores_other_bills_products(app, dataset):
+    with app.app_context():
+        bill, product_ids, member_ids = bill_setup(dataset)
+        other = db.session.get(Bill, dataset.bill_ids[1])
+        other_payers = {product.id: product.payer_id for product in other.products}
+
+        edited = bill.bulk_edit_products(product_ids + list(other_payers), payer_id=member_ids[-1])
+        db.session.commit()
+
+        assert edited == len(product_ids)
+        assert {product.payer_id for product in Product.query.filter(Product.id.in_(product_ids))} == {member_ids[-1]}
+        assert {product.id: product.payer_id for product in Product.query.filter(Product.id.in_(other_payers))} \
+            == other_payers
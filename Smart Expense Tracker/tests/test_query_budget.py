@@ -0,0 +1,7 @@
+from benchmarks import query_budget
+
+
+def test_routes_stay_within_query_budgets():
+    results = query_budget.run(list(query_budget.BUDGETS), runs=1)
+    failures = {route: query_budget.problems(route, results) for route in query_budget.BUDGETS}
+    assert {route: found for route, found in failures.items() if found} == {}
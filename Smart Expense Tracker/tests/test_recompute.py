@@ -0,0 +1,72 @@
+import json
+
+from sqlalchemy import event
+
+from benchmarks.datagen import generate
+from commands import recompute_users
+from models import db, Group, GroupRollup, ROLLUP_VERSION
+
+
+def users_with_rollups():
+    return {user_id for (user_id,) in db.session.query(Group.user_id).join(GroupRollup).distinct()}
+
+
+def test_recompute_updates_a_rollup_a_request_stored_meanwhile(app, dataset):
+    with app.app_context():
+        group_id = dataset.group_ids[0]
+        inserted = []
+
+        def insert_concurrently(session):
+            # Another process stores the group's rollup just before this chunk commits
+            if not inserted:
+                inserted.append(True)
+                with db.engine.begin() as conn:
+                    conn.execute(db.insert(GroupRollup).values(
+                        group_id=group_id, user_id=dataset.user_ids[0], group_version=-1,
+                        logic_version=ROLLUP_VERSION, total=0, bill_count=0))
+
+        event.listen(db.session(), 'before_commit', insert_concurrently)
+        try:
+            counts = recompute_users(dataset.user_ids, chunk_size=10)
+        finally:
+            event.remove(db.session(), 'before_commit', insert_concurrently)
+
+        assert inserted
+        assert counts['groups'] == len(dataset.group_ids)
+        rollup = db.session.get(GroupRollup, group_id)
+        group = db.session.get(Group, group_id)
+        assert rollup.group_version == group.version
+        assert rollup.total == group.compute_rollup()['total']
+
+
+def test_resume_recomputes_users_and_groups_added_since_the_checkpoint(app, tmp_path):
+    checkpoint = tmp_path / 'checkpoint.json'
+    with app.app_context():
+        first, second, third = generate(users=3, groups=1, members=3, bills=2, products=2, seed=4).user_ids
+        max_group_id = db.session.query(db.func.max(Group.id)).scalar()
+        # The first user's range finished when it held them alone, the second's
+        # range when it held two users; a third user has appeared in it since
+        checkpoint.write_text(json.dumps({'rollup_version': ROLLUP_VERSION, 'max_group_id': max_group_id,
+                                          'ranges': [[first, first, 1], [second, third, 1]]}))
+        GroupRollup.query.delete()
+        db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['recompute-rollups', '--workers', '1',
+                                                '--checkpoint', str(checkpoint)])
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        assert users_with_rollups() == {second, third}
+
+        # A group created after the run started belongs to a user whose range was already done
+        checkpoint.write_text(json.dumps({'rollup_version': ROLLUP_VERSION, 'max_group_id': max_group_id,
+                                          'ranges': [[first, third, 3]]}))
+        db.session.add(Group(name='Later', user_id=first))
+        GroupRollup.query.delete()
+        db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['recompute-rollups', '--workers', '1',
+                                                '--checkpoint', str(checkpoint)])
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        assert users_with_rollups() == {first}
+    assert not checkpoint.exists()
@@ -0,0 +1,69 @@
+from models import db, Bill, Member, Product
+
+SNAPSHOT_FIELDS = ('members', 'balances', 'transfers', 'products', 'breakdown')
+
+
+def summary(client, bill_id):
+    response = client.get(f'/api/bill/{bill_id}/summary')
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def rename_members(client, app, group_id, suffix):
+    with app.app_context():
+        members = [(m.id, m.name, m.email or '', m.mobile_number)
+                   for m in Member.query.filter_by(group_id=group_id).order_by(Member.id)]
+    for member_id, name, email, mobile_number in members:
+        response = client.post(f'/member/{member_id}/edit',
+                               data={'name': name + suffix, 'email': email, 'mobile_number': mobile_number})
+        assert response.status_code == 302
+
+
+def test_settled_bill_keeps_its_summary_until_reopened(client, app, dataset):
+    bill_id = dataset.bill_ids[0]
+    open_summary = summary(client, bill_id)
+
+    assert client.post(f'/bill/{bill_id}/settle').status_code == 302
+    settled = summary(client, bill_id)
+    assert settled['bill']['settled'] is True
+    for field in SNAPSHOT_FIELDS:
+        assert settled[field] == open_summary[field]
+
+    # Later edits to the group's members do not reach the frozen summary
+    rename_members(client, app, dataset.group_ids[0], ' (renamed)')
+    after_rename = summary(client, bill_id)
+    for field in SNAPSHOT_FIELDS:
+        assert after_rename[field] == open_summary[field]
+
+    assert client.post(f'/bill/{bill_id}/reopen').status_code == 302
+    reopened = summary(client, bill_id)
+    assert reopened['bill']['settled'] is False
+    assert all(member['name'].endswith(' (renamed)') for member in reopened['members'].values())
+    assert reopened['balances'] == open_summary['balances']
+
+
+def test_settled_bill_refuses_product_edits(client, app, dataset):
+    bill_id = dataset.bill_ids[0]
+    client.post(f'/bill/{bill_id}/settle')
+    with app.app_context():
+        product = Product.query.filter_by(bill_id=bill_id).order_by(Product.id).first()
+        product_id, price, payer_id = product.id, product.price, product.payer_id
+        members = [pm.member_id for pm in product.members_involved]
+
+    response = client.post(f'/product/{product_id}/edit', data={
+        'name': 'Changed', 'price': price + 10, 'payer': payer_id, 'members_involved': members})
+    assert response.status_code == 302
+    with app.app_context():
+        product = db.session.get(Product, product_id)
+        assert (product.name, product.price) != ('Changed', price + 10)
+        assert db.session.get(Bill, bill_id).is_settled
+
+
+def test_settling_and_reopening_change_the_bill_version(client, app, dataset):
+    bill_id = dataset.bill_ids[0]
+    versions = [summary(client, bill_id)['bill']['version']]
+    client.post(f'/bill/{bill_id}/settle')
+    versions.append(summary(client, bill_id)['bill']['version'])
+    client.post(f'/bill/{bill_id}/reopen')
+    versions.append(summary(client, bill_id)['bill']['version'])
+    assert len(set(versions)) == 3
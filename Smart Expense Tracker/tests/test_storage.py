@@ -0,0 +1,80 @@
+from sqlalchemy import MetaData
+
+from benchmarks.datagen import generate
+from models import db, Bill, BillTemplate, Product, ProductMember, TemplateProduct
+from smart_expense_splitter import create_app
+from storage import pending_upgrades
+
+
+def create_old_schema(engine):
+    """Create the tables as databases made before the ON DELETE actions have them"""
+    old = MetaData()
+    for table in db.metadata.sorted_tables:
+        table.to_metadata(old)
+    for table in old.tables.values():
+        for constraint in table.foreign_key_constraints:
+            constraint.ondelete = None
+    old.create_all(engine)
+
+
+def counts():
+    return {model.__tablename__: model.query.count()
+            for model in (Bill, Product, ProductMember, BillTemplate, TemplateProduct)}
+
+
+def test_upgrade_db_adds_the_cascades_to_an_old_database(tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'old.db'),
+        'FRAGMENT_CACHE_BACKEND': 'none',
+        'JOB_WORKERS': 0,
+    })
+    with app.app_context():
+        create_old_schema(db.engine)
+        dataset = generate(users=1, groups=1, members=4, bills=2, products=3, seed=5)
+        template = BillTemplate(name='Rent', title='Rent', user_id=dataset.user_ids[0],
+                                template_products=[TemplateProduct(name='Flat', price=900.0)])
+        db.session.add(template)
+        db.session.commit()
+        template_id = template.id
+        product = Product.query.filter_by(bill_id=dataset.bill_ids[0]).order_by(Product.id).first()
+        product_id = product.id
+        assert any(item.startswith('outdated foreign key') for item in pending_upgrades(db))
+        before = counts()
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(dataset.user_ids[0])
+        session['_fresh'] = True
+    # Serving the old database would break deletes, so requests are refused until it is upgraded
+    assert client.get('/dashboard').status_code == 503
+
+    result = app.test_cli_runner().invoke(args=['upgrade-db'])
+    assert result.exit_code == 0, result.output
+    assert 'outdated foreign key' in result.output
+    with app.app_context():
+        assert pending_upgrades(db) == []
+        assert counts() == before
+
+    assert client.get('/dashboard').status_code == 200
+    # Each delete leaves the rows under it to the database's ON DELETE CASCADE
+    assert client.post(f'/product/{product_id}/delete').status_code == 302
+    assert client.post(f'/template/{template_id}/delete').status_code == 302
+    assert client.post(f'/bill/{dataset.bill_ids[1]}/delete').status_code == 302
+    with app.app_context():
+        assert ProductMember.query.filter_by(product_id=product_id).count() == 0
+        assert TemplateProduct.query.filter_by(bill_template_id=template_id).count() == 0
+        assert Product.query.filter_by(bill_id=dataset.bill_ids[1]).count() == 0
+        assert db.session.execute(db.text('PRAGMA foreign_key_check')).fetchall() == []
+        db.engine.dispose()
+
+
+def test_requests_wait_for_a_new_database_to_be_created(tmp_path):
+    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'new.db')})
+    client = app.test_client()
+    assert client.get('/').status_code == 503
+    assert app.test_cli_runner().invoke(args=['upgrade-db']).exit_code == 0
+    assert client.get('/').status_code == 200
+    with app.app_context():
+        db.engine.dispose()
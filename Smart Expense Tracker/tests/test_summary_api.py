@@ -0,0 +1,49 @@
+import pytest
+
+from models import Bill, Group
+from tests.test_caching import edit_product
+
+
+def summary_urls(dataset):
+    return [(f'/api/bill/{dataset.bill_ids[0]}/summary', 'bill', Bill.SUMMARY_FIELDS),
+            (f'/api/group/{dataset.group_ids[0]}/summary', 'group', Group.SUMMARY_FIELDS)]
+
+
+@pytest.mark.parametrize('which', [0, 1], ids=['bill', 'group'])
+def test_fields_select_sections_of_the_summary(client, dataset, which):
+    url, header, allowed = summary_urls(dataset)[which]
+    full = client.get(url).get_json()
+    assert set(full) == {header, *allowed}
+
+    selected = client.get(url, query_string={'fields': ' transfers , balances '}).get_json()
+    assert set(selected) == {header, 'balances', 'transfers'}
+    assert selected == {key: full[key] for key in selected}
+
+
+@pytest.mark.parametrize('which', [0, 1], ids=['bill', 'group'])
+def test_unknown_fields_are_rejected(client, dataset, which):
+    url, _, allowed = summary_urls(dataset)[which]
+    response = client.get(url, query_string={'fields': 'balances,nonsense'})
+    assert response.status_code == 400
+    assert 'nonsense' in response.get_json()['error']
+    for field in allowed:
+        assert field in response.get_json()['error']
+
+
+@pytest.mark.parametrize('which', [0, 1], ids=['bill', 'group'])
+def test_summary_is_not_modified_until_the_bill_changes(client, app, dataset, which):
+    url, _, _ = summary_urls(dataset)[which]
+    etag = client.get(url, query_string={'fields': 'balances,transfers'}).headers['ETag']
+    # The selection is part of the ETag, in any order, but a different selection is not
+    assert client.get(url, query_string={'fields': 'transfers,balances'},
+                      headers={'If-None-Match': etag}).status_code == 304
+    other = client.get(url, query_string={'fields': 'balances'}, headers={'If-None-Match': etag})
+    assert other.status_code == 200
+    assert other.headers['ETag'] != etag
+
+    edit_product(client, app, dataset.bill_ids[0], price=123.45)
+    changed = client.get(url, query_string={'fields': 'balances,transfers'}, headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert client.get(url, query_string={'fields': 'balances,transfers'},
+                      headers={'If-None-Match': changed.headers['ETag']}).status_code == 304
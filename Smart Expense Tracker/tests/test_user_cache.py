@@ -0,0 +1,43 @@
+from caching import user_cache
+from models import db, Currency, Group, User, populate_initial_currencies
+
+
+def cached(user_id):
+    return user_id in user_cache()._entries
+
+
+def test_group_writes_leave_the_cached_user(app, dataset):
+    user_id = dataset.user_ids[0]
+    with app.app_context():
+        user_cache().load(user_id)
+        db.session.get(Group, dataset.group_ids[0]).bump_version(include_bills=True)
+        db.session.commit()
+        assert cached(user_id)
+
+
+def test_currency_and_user_changes_drop_the_cached_user(app, dataset):
+    user_id = dataset.user_ids[0]
+    with app.app_context():
+        populate_initial_currencies()
+        euro = Currency.query.filter_by(code='EUR').one()
+        user_cache().load(user_id)
+        db.session.get(User, user_id).add_currency(euro.id, is_default=True)
+        assert not cached(user_id)
+        db.session.remove()
+
+        user = user_cache().load(user_id)
+        assert user.get_default_currency().code == 'EUR'
+        assert cached(user_id)
+        user.email = 'renamed@example.com'
+        db.session.commit()
+        assert not cached(user_id)
+
+
+def test_cached_user_sees_group_writes_through_data_version(client, app, dataset):
+    url = '/api/analytics/category-data'
+    etag = client.get(url).headers['ETag']
+    with app.app_context():
+        db.session.get(Group, dataset.group_ids[1]).bump_version()
+        db.session.commit()
+        assert cached(dataset.user_ids[0])
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 200